@@ -0,0 +1,281 @@
+import sys
+import os
+import math
+import json
+import time
+import platform
+import datetime
+import statistics
+import subprocess
+import tracemalloc
+import argparse
+sys.path.append('./src/caioh_nvml_gpu_control/') # Necessary so the benchmarked files can all find each other from the projects root
+import helper_functions as main_funcs
+import nvml_backend
+import parse_args
+
+# Benchmarks the control loop on simulated GPUs (no hardware needed) and writes the results as JSON
+#
+#   python ./benchmarks/bench_control_loop.py --output results.json
+#
+# Results from different releases can be compared, as long as they ran on the same machine
+
+default_curve = '40:40,55:70,65:100'
+
+# Set by the startup benchmark on its child process. It is checked on import, so the worker also gets it when processes are spawned instead of forked
+startup_probe_variable = 'CAIOH_BENCH_STARTUP_PROBE'
+
+# Every simulated GPU gets its own curve, power limit and temperature limit, so each tick does the same work as a real multi-GPU setup
+def control_args(device_count, curve=default_curve):
+    args = ['control', '-ct', 'linear']
+
+    for index in range(device_count):
+        args += ['-id', nvml_backend.simulated_gpu_uuid(index), '-sp', curve, '-pl', '250', '-tl', '80']
+
+    return args
+
+# Keeps the temperature (and so the fan speed) moving during the whole run
+def varying_load(now):
+    return 0.5 + 0.5 * math.sin(now / 120)
+
+# Takes the place of the worker link, so every tick of control_all is measured
+class TickRecorder:
+    def __init__(self, trace_allocations):
+        self.trace_allocations = trace_allocations
+        self.tick_times_s = []
+        self.nvml_calls = []
+        self.allocated_bytes = []
+        self.retained_blocks = []
+
+    def start_tick(self):
+        self.calls_start = main_funcs.nvml.call_count
+        self.blocks_start = sys.getallocatedblocks()
+
+        if self.trace_allocations == True:
+            tracemalloc.reset_peak()
+            self.memory_start = tracemalloc.get_traced_memory()[0]
+
+        self.tick_start = time.perf_counter()
+
+    def wait_for_activation(self):
+        self.start_tick()
+
+    def tick_done(self, metrics_sample=None):
+        tick_end = time.perf_counter()
+        retained_blocks = sys.getallocatedblocks() - self.blocks_start
+
+        self.tick_times_s.append(tick_end - self.tick_start)
+        self.nvml_calls.append(main_funcs.nvml.call_count - self.calls_start)
+        self.retained_blocks.append(retained_blocks)
+
+        if self.trace_allocations == True:
+            self.allocated_bytes.append(tracemalloc.get_traced_memory()[1] - self.memory_start)
+
+        self.start_tick()
+
+    def error(self, error_text):
+        pass
+
+def summary(values, scale=1):
+    values = sorted(value * scale for value in values)
+
+    return {
+        'mean': statistics.mean(values),
+        'median': statistics.median(values),
+        'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+        'max': values[-1],
+    }
+
+# Runs control_all for a number of ticks of simulated time. The simulated clock doesn't wait, so the wall time is only the cost of the tick
+def run_control_loop(device_count, ticks, trace_allocations=False):
+    config = parse_args.parse_cmd_args(['.python_script'] + control_args(device_count))
+    backend = nvml_backend.SimulatedBackend(device_count, nvml_backend.SimulatedClock(end_time=ticks * config.time_interval))
+
+    for gpu in backend.gpus:
+        gpu.load = varying_load
+
+    recorder = TickRecorder(trace_allocations)
+    main_funcs.set_backend(backend, backend.clock)
+
+    if trace_allocations == True:
+        tracemalloc.start()
+
+    try:
+        backend.nvmlInit()
+
+        # The loop logs to stdout, which would be measured too
+        with open(os.devnull, 'w') as devnull:
+            sys.stdout = devnull
+            main_funcs.control_all(config, recorder)
+
+    except nvml_backend.SimulationFinished:
+        pass
+
+    finally:
+        sys.stdout = sys.__stdout__
+        tracemalloc.stop()
+        main_funcs.set_backend(nvml_backend.PynvmlBackend(), nvml_backend.SystemClock())
+
+    return recorder
+
+def bench_control_loop(device_count, ticks):
+    timed = run_control_loop(device_count, ticks)
+    traced = run_control_loop(device_count, ticks, trace_allocations=True)
+
+    # The first tick sets everything up (power limit, temperature limit and fan policy), the rest is the steady state
+    return {
+        'devices': device_count,
+        'ticks': len(timed.tick_times_s),
+        'first_tick_us': timed.tick_times_s[0] * 1000000,
+        'wall_time_per_tick_us': summary(timed.tick_times_s[1:], 1000000),
+        'wall_time_per_device_tick_us': statistics.mean(timed.tick_times_s[1:]) * 1000000 / device_count,
+        'nvml_calls_first_tick': timed.nvml_calls[0],
+        'nvml_calls_per_tick': summary(timed.nvml_calls[1:]),
+        'peak_allocated_bytes_per_tick': summary(traced.allocated_bytes[1:]), # Highest amount of memory allocated at once during the tick
+        'retained_blocks_per_tick': statistics.mean(timed.retained_blocks[1:]), # Should stay close to 0, otherwise the loop is leaking
+    }
+
+# Time from starting the process to the first change made to a device, measured in a child process like a real start
+def bench_startup(device_count, runs):
+    command = [sys.executable, __file__, '--startup-probe'] + control_args(device_count) + ['-sim', str(device_count), '-su']
+    environment = dict(os.environ, **{startup_probe_variable: '1'})
+
+    first_write_s = []
+    total_s = []
+
+    for run in range(runs):
+        start = time.monotonic()
+        result = subprocess.run(command, capture_output=True, text=True, env=environment, timeout=120)
+        end = time.monotonic()
+
+        first_writes = [float(line.split()[1]) for line in result.stdout.splitlines() if line.startswith('FIRST_WRITE ')]
+
+        if result.returncode != 0 or len(first_writes) == 0:
+            raise RuntimeError(f'The startup benchmark failed:\n{result.stdout}\n{result.stderr}')
+
+        first_write_s.append(first_writes[0] - start)
+        total_s.append(end - start)
+
+    return {
+        'devices': device_count,
+        'runs': runs,
+        'time_to_first_write_ms': summary(first_write_s, 1000),
+        'process_time_ms': summary(total_s, 1000),
+    }
+
+# Modules that an action which doesn't need them should not import, since they are the slowest ones to load
+heavy_modules = ['pynvml', 'numpy', 'multiprocessing', 'http.server']
+
+entry_point = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src', 'caioh_nvml_gpu_control', '__main__.py')
+
+# Wall time of short commands started like a user would (help and an information query), with the modules they import (-X importtime)
+def bench_cli_startup(runs):
+    commands = {
+        'help': ['help'],
+        'fan-info': ['fan-info', '-sim', '1', '-id', nvml_backend.simulated_gpu_uuid(0)],
+    }
+
+    results = {}
+
+    for name, args in commands.items():
+        command = [sys.executable, '-X', 'importtime', entry_point] + args
+        wall_time_s = []
+
+        for run in range(runs):
+            start = time.monotonic()
+            result = subprocess.run(command, capture_output=True, text=True, timeout=120)
+            wall_time_s.append(time.monotonic() - start)
+
+            if result.returncode != 0:
+                raise RuntimeError(f'The CLI startup benchmark failed:\n{result.stdout}\n{result.stderr}')
+
+        # "import time: self [us] | cumulative | imported package", the nesting is the indentation of the name
+        imported_modules = [line.split('|')[2].strip() for line in result.stderr.splitlines() if line.startswith('import time:') and line.count('|') == 2]
+        imported_modules = [module for module in imported_modules if module != 'imported package']
+
+        results[name] = {
+            'runs': runs,
+            'wall_time_ms': summary(wall_time_s, 1000),
+            'imported_modules': len(imported_modules),
+            'heavy_modules': [module for module in heavy_modules if module in imported_modules],
+        }
+
+    return results
+
+# Prints the time of the first write to any simulated device. time.monotonic() is the same clock for all processes, so the parent can compare it
+def install_startup_probe():
+    written = False
+
+    def probe(set_function):
+        def probed_set_function(*args):
+            nonlocal written
+            result = set_function(*args)
+
+            if written != True:
+                written = True
+                print(f'FIRST_WRITE {time.monotonic()}', flush=True)
+
+            return result
+
+        return probed_set_function
+
+    for function_name in nvml_backend.backend_functions:
+        if function_name.startswith('nvmlDeviceSet'):
+            setattr(nvml_backend.SimulatedBackend, function_name, probe(getattr(nvml_backend.SimulatedBackend, function_name)))
+
+if os.environ.get(startup_probe_variable) == '1':
+    install_startup_probe()
+
+def device_counts(max_devices):
+    counts = []
+    count = 1
+
+    while count <= max_devices:
+        counts.append(count)
+        count *= 2
+
+    return counts
+
+def main():
+
+    # The child process of the startup benchmark runs the real program
+    if len(sys.argv) > 1 and sys.argv[1] == '--startup-probe':
+        import nvml_gpu_control
+        sys.argv = [sys.argv[0]] + sys.argv[2:]
+        nvml_gpu_control.main()
+        return
+
+    parser = argparse.ArgumentParser(description='Benchmarks the control loop on simulated GPUs')
+    parser.add_argument('--output', help='JSON file for the results (default: stdout)')
+    parser.add_argument('--ticks', type=int, default=500, help='Ticks per measurement (default: 500)')
+    parser.add_argument('--max-devices', type=int, default=64, help='Largest number of simulated devices (default: 64)')
+    parser.add_argument('--startup-runs', type=int, default=5, help='Processes started to measure the startup time (default: 5)')
+    options = parser.parse_args()
+
+    results = {
+        'version': main_funcs.caioh_gpu_control_version,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            'ticks': options.ticks,
+            'max_devices': options.max_devices,
+            'startup_runs': options.startup_runs,
+            'curve': default_curve,
+        },
+        'startup': bench_startup(1, options.startup_runs),
+        'cli_startup': bench_cli_startup(options.startup_runs),
+        'scaling': [bench_control_loop(device_count, options.ticks) for device_count in device_counts(options.max_devices)],
+    }
+
+    output = json.dumps(results, indent=4)
+
+    if options.output == None:
+        print(output)
+        return
+
+    with open(options.output, 'w') as output_file:
+        output_file.write(output + '\n')
+
+if __name__ == '__main__':
+    main()
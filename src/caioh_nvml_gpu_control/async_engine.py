@@ -0,0 +1,172 @@
+import asyncio
+import concurrent.futures
+import queue
+import threading
+import pynvml
+import helper_functions as main_funcs
+from log_writer import log_helper, error_print
+
+# Alternative control engine (--engine async): the GPUs of a tick are controlled in parallel, and no NVML call can take longer than
+# --call-timeout. The control loop (helper_functions.control_loop) is the same, only how the GPUs of a tick run changes:
+#
+#   - Each GPU runs its tick (helper_functions.control_gpu_tick) on its own thread, the ticks are gathered by an asyncio event loop
+#   - Every NVML call goes to a bounded pool of threads and the caller waits for it until the deadline. A missed deadline fails the call
+#     with NVML_ERROR_TIMEOUT, so the GPU is handled like any other failing device, after its fans are set to --safe-speed
+#
+# A call that never returns keeps its pool thread, which is why the pool is bounded: once it is full of stuck calls, the next calls time
+# out as well, and when every GPU is failing the worker restarts with a new NVML session (see worker_process.py)
+
+# Threads of the NVML call pool per GPU, so a stuck call of one GPU leaves room for the others
+nvml_threads_per_gpu = 2
+
+# Thread pool whose threads don't keep the process alive. A call stuck inside the driver would otherwise block the exit of the worker
+# forever (concurrent.futures.ThreadPoolExecutor joins its threads on exit), so it could only be replaced with --watchdog
+class DaemonThreadPool(concurrent.futures.Executor):
+    def __init__(self, max_workers):
+        self.work = queue.SimpleQueue()
+        self.threads = [threading.Thread(target=self.run, daemon=True) for thread_idx in range(max_workers)]
+
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, function, *args):
+        future = concurrent.futures.Future()
+        self.work.put((future, function, args))
+        return future
+
+    def run(self):
+
+        while(True):
+            work = self.work.get()
+
+            if work == None:
+                return
+
+            future, function, args = work
+
+            # Cancelled while it was waiting
+            if future.set_running_or_notify_cancel() != True:
+                continue
+
+            try:
+                result = function(*args)
+            except BaseException as error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    # Threads with a stuck call are left behind, they end with the process
+    def shutdown(self, wait=True, **kwargs):
+
+        for thread in self.threads:
+            self.work.put(None)
+
+        if wait == True:
+            for thread in self.threads:
+                thread.join()
+
+# Runs the NVML calls on the pool, installed on helper_functions.nvml while the engine is running
+#
+# Each GPU has a generation, which a missed deadline moves on. The calls of the older generations that didn't start yet are dropped, so a
+# fan or power limit write that was still waiting can't land after the safe speed. A call already inside the driver can't be stopped
+class DeadlineCallRunner:
+    def __init__(self, pool, timeout_s):
+        self.pool = pool
+        self.timeout_s = timeout_s
+        self.deadline_misses = 0
+        self.generations = {} # GPU label -> generation
+        self.lock = threading.Lock()
+        self.local = threading.local() # Label of the GPU whose tick runs on the thread, None for the calls outside of the ticks
+
+    def __call__(self, function, args):
+        label = getattr(self.local, 'label', None)
+        generation = self.generations.get(label, 0)
+        future = self.pool.submit(self.run_call, label, generation, function, args)
+
+        try:
+            return future.result(self.timeout_s)
+
+        # The generation moves on first, so the call is either cancelled, dropped when it starts or already inside the driver
+        except concurrent.futures.TimeoutError:
+
+            with self.lock:
+                self.deadline_misses += 1
+                self.generations[label] = self.generations.get(label, 0) + 1
+
+            future.cancel()
+
+            error_print('NVML call {} missed its deadline of {}s ({} missed deadlines)', getattr(function, '__name__', 'unknown'), self.timeout_s, self.deadline_misses)
+            raise pynvml.NVMLError(pynvml.NVML_ERROR_TIMEOUT)
+
+    def run_call(self, label, generation, function, args):
+
+        if self.generations.get(label, 0) != generation:
+            raise pynvml.NVMLError(pynvml.NVML_ERROR_TIMEOUT)
+
+        return function(*args)
+
+    # Calls made by the function are for the GPU of the label
+    def run_for_gpu(self, label, function, *args):
+        self.local.label = label
+
+        try:
+            return function(*args)
+        finally:
+            self.local.label = None
+
+class AsyncEngine:
+    def __init__(self, configuration, gpu_count):
+        self.loop = asyncio.new_event_loop()
+        self.device_threads = DaemonThreadPool(max(1, gpu_count))
+        self.nvml_threads = DaemonThreadPool(max(1, gpu_count) * nvml_threads_per_gpu)
+        self.call_runner = DeadlineCallRunner(self.nvml_threads, configuration.call_timeout_s)
+        self.safe_speed_writes = 0
+
+        main_funcs.nvml.call_runner = self.call_runner
+
+    def tick(self, controlled_gpus, configuration, attach_only=False):
+        self.loop.run_until_complete(self.tick_all(controlled_gpus, configuration, attach_only))
+
+    async def tick_all(self, controlled_gpus, configuration, attach_only):
+        await asyncio.gather(*[self.tick_gpu(controlled_gpu, configuration, attach_only) for controlled_gpu in controlled_gpus])
+
+    async def tick_gpu(self, controlled_gpu, configuration, attach_only):
+        handle = controlled_gpu.handle
+        device_errors = controlled_gpu.device_errors
+
+        await self.loop.run_in_executor(self.device_threads, self.call_runner.run_for_gpu, controlled_gpu.label, main_funcs.control_gpu_tick, controlled_gpu, configuration, attach_only)
+
+        # Only the GPUs whose fans are controlled, the others keep what the driver does. A GPU that failed while attaching has no handle to use
+        missed_deadline = controlled_gpu.device_errors != device_errors and isinstance(controlled_gpu.last_error, pynvml.NVMLError_Timeout)
+
+        if missed_deadline == True and handle != None and len(controlled_gpu.config.temp_speed_pair) != 0 and configuration.action == 'control':
+            await self.loop.run_in_executor(self.device_threads, self.call_runner.run_for_gpu, controlled_gpu.label, self.set_safe_speed, controlled_gpu, handle, configuration)
+
+    # The calls still have the deadline, a GPU that doesn't answer at all can't be helped from here
+    def set_safe_speed(self, controlled_gpu, handle, configuration):
+
+        try:
+            fan_count = controlled_gpu.properties.get('fan_count', main_funcs.nvml.nvmlDeviceGetNumFans, handle)
+            main_funcs.set_gpu_fan_speed(handle, configuration.safe_fan_speed, configuration.dry_run, fan_count)
+
+        except pynvml.NVMLError as error:
+            error_print('{}: Could not set the safe fan speed: {}', controlled_gpu.label, str(error))
+            return
+
+        controlled_gpu.fan_target = configuration.safe_fan_speed
+        controlled_gpu.fan_target_time = main_funcs.clock.monotonic()
+        controlled_gpu.fan_writes_issued += 1
+        self.safe_speed_writes += 1
+
+        log_helper('{}: Missed an NVML deadline, the fans are at the safe speed of {}% (safe speed writes: {})', controlled_gpu.label, configuration.safe_fan_speed, self.safe_speed_writes)
+
+    # Sent with the metrics sample (see metrics_server.py)
+    def metrics(self):
+        return {'nvml_deadline_misses': self.call_runner.deadline_misses, 'safe_speed_writes': self.safe_speed_writes}
+
+    # Stuck calls are not waited for, their threads end with the process (see DaemonThreadPool)
+    def close(self):
+        main_funcs.nvml.call_runner = None
+        self.loop.close()
+        self.device_threads.shutdown(wait=False)
+        self.nvml_threads.shutdown(wait=False)
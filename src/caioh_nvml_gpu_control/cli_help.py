@@ -0,0 +1,174 @@
+# Kept apart from the rest of the program, so printing the help doesn't load the NVML bindings
+def print_help():
+    help_text = '''
+python ./nvml_gpu_control.py <ACTION> <OPTIONS>
+
+ACTIONS
+    help
+          Display help text
+
+    list
+          List all available GPUs connected to the system by printing its name and UUID. With --json, it prints all the details of every GPU as JSON
+
+    control
+         Allows the use of all controls in a single command/loop. Each setting is enabled by configuring its respective option: fan curve, power and temperature
+
+    record --record <FILE>
+          Samples the temperature, fan speeds and power of the selected GPUs in a loop and records them (see --record), without changing any setting. Example: record -n "NVIDIA GeForce RTX 4080" -rc gpu.ring -ti 5
+
+    replay --record <FILE>
+          Runs a recorded file through the same logic as the control action with the given settings (--speed-pair, --curve-type, --default-speed, --hysteresis, --min-dwell, --power-limit and --acoustic-temp-limit), much faster than real time and without touching the GPU or the driver. It prints the writes it would have issued (and the ones that were recorded), the time spent at each fan speed and the peak temperature. The temperatures come from the recording, so the effect of the new fan speeds on them is not modeled. Example: replay -n "NVIDIA GeForce RTX 4080" -rc gpu.ring -sp "40:30,60:70,75:100" -hy 3
+
+    tune --record <FILE>
+          Searches a fan curve for the selected GPU on a recorded file: a simple thermal model is fitted on the recording and thousands of candidate curves (see --candidates and --curve-type) are simulated on the recorded power usage. It prints the Pareto front of the average fan speed, the peak temperature and the time above the slowdown threshold (see --slowdown-temp), followed by the --speed-pair of the curve with the lowest average fan speed that stays 5°C below the threshold. With --speed-pair, the current curve is scored too. The recording needs some fan speed changes (e.g. recorded with control --record and a fan curve). Needs NumPy (pip install numpy). Example: tune -n "NVIDIA GeForce RTX 4080" -rc gpu.ring -st 87 -ct linear
+
+    fan-info
+          Shows information about fan speed
+
+    fan-policy <--auto|--manual>
+          Changes the fan control policy to automatic (vBIOS controlled) or manual. Note that when the fan speed is changed, the NVML library automatically changes this setting to manual. This setting is useful to change the GPU back to its original state
+
+    fan-policy-info
+          Shows information about the current fan policy
+
+    power-limit-info
+          Shows information about the power limit of the selected GPU
+
+    thresholds-info
+          Shows information about temperature thresholds in dregrees Celsius of the selected GPU.
+
+OPTIONS
+
+    --name OR -n <GPU_NAME>
+          Select a target GPU by its name. Example: --name "NVIDIA GeForce RTX 4080". Note: the other selectors have preference over name. When more than one GPU has the name, the first one is used: select it with --pci, --index or --uuid instead
+
+    --uuid OR -id <GPU_UUID>
+          Select a target GPU by its Universally Unique IDentifier (UUID). Example: --uuid "GPU-00000000-0000-0000-0000-000000000000". Note: UUID has preference over the other selectors
+
+    --pci OR -pci <PCI_BUS_ID>
+          Select a target GPU by its PCI bus ID, which tells apart GPUs of the same model. Example: --pci 0000:01:00.0 (see list --json)
+
+    --serial OR -sn <SERIAL>
+          Select a target GPU by its board serial number. Only some boards have one. Example: --serial 1320000000000
+
+    --index OR -ix <INDEX>
+          Select a target GPU by its NVML index, the order of the list action. Example: --index 0
+
+          The control action can drive multiple GPUs in a single process. Selecting another GPU (using the same kind of selector again) starts its own group of settings: --speed-pair, --default-speed, --power-limit and --acoustic-temp-limit always apply to the last selected GPU. Each GPU can only be selected once. A GPU that fails is reported and probed again every --retry-interval while the others keep being controlled (its state is also exported on --metrics-port). The program only closes when every GPU is failing. Example: -id "GPU-00000000-0000-0000-0000-000000000000" -pl 280 -id "GPU-11111111-1111-1111-1111-111111111111" -sp "0:50,40:100"
+
+    --device-cache OR -dc <FILE>
+          Keeps the name, UUID, PCI bus ID and serial of every GPU in this file, so the next calls find the selected GPU without asking the other GPUs. The file is read again only while the driver version and the boot are the same, and it is rebuilt when a GPU is not where it says (Linux only). Example: fan-info --pci 0000:01:00.0 -dc /tmp/nvml-gpu-control-devices.json
+
+    --time-interval OR -ti <TIME_SECONDS>
+          Time period in seconds to wait before probing the GPU again. Works for all actions that run in a loop. The time spent probing is part of the period, so the loop keeps its cadence (tick metrics are logged every 5 minutes)
+
+    --adaptive-interval OR -ai <MIN_TIME_SECONDS:MAX_TIME_SECONDS>
+          Replaces the fixed --time-interval: the GPU is probed every MIN seconds while the temperature or the power usage is changing and the interval doubles up to MAX seconds while they are stable. The effective sample rate is logged every 5 minutes. Example: -ai 0.5:5
+
+    --engine OR -en <ENGINE>
+          How the control loop runs the GPUs of each tick. sync (default): one after the other on a single thread. async: every GPU at the same time on its own thread, gathered by an asyncio event loop, with every NVML call made on a bounded thread pool and a deadline (--call-timeout). A GPU with a call that misses the deadline gets its fans set to --safe-speed and is handled like a failing GPU (see --retry). Missed deadlines and safe speed writes are exported on --metrics-port. Not available with --events. Example: control -en async -cto 1 -ss 90
+
+    --call-timeout OR -cto <TIME_SECONDS>
+          Deadline of each NVML call of the async engine. Default: 2
+
+    --safe-speed OR -ss <SPEED_PERCENTAGE>
+          Fan speed the async engine sets on a GPU (with --speed-pair) after one of its NVML calls missed the deadline. Default: 100
+
+    --events OR -ev <SAFETY_INTERVAL_SECONDS>
+          Event-assisted control: between ticks, the control loop waits for NVML events of the GPUs (clock, performance state and power source changes, critical Xid errors) and ticks right away when one arrives, or after the safety interval without events, since temperature changes have no events. A burst of events starts a single tick. It replaces --time-interval (but not --adaptive-interval), which becomes the minimum time between the ticks started by events: the events in between are merged into the next tick. The event counts are logged every 5 minutes and exported on --metrics-port. GPUs without events are only controlled on the safety interval, and the loop goes back to --time-interval when the driver has no events (e.g. on Windows). Example: control -ev 10
+
+    --retry-interval OR -ri <TIME_SECONDS>
+          Time period in seconds to wait before trying to issue commands to the GPU again. Works for all actions that run in a loop. When the worker keeps failing, this time doubles on each failure (with some randomness)
+
+    --retry-max-interval OR -rm <TIME_SECONDS>
+          Maximum time to wait between retries. Default: 60
+
+    --probe-interval OR -pi <TIME_SECONDS>
+          After 5 identical failures in a row, the worker is only restarted at this interval and a single summary line is logged until it works again. Default: 300
+
+    --hysteresis OR -hy <TEMP_CELSIUS>
+          The temperature must drop this many degrees below a curve point before the fan speed is lowered. Avoids flipping between two speeds when the temperature sits on a curve point. Default: 0
+
+    --min-dwell OR -md <TIME_SECONDS>
+          Minimum time to stay at a fan speed before lowering it. Raising the fan speed is never delayed. Default: 0
+
+    --dry-run OR -dr
+          Run the program, but don't change/set anything. Useful for testing the behavior of the program
+
+    --speed-pair OR -sp <TEMP_CELSIUS:SPEED_PERCENTAGE,TEMP_CELSIUS:SPEED_PERCENTAGE...>
+          A comma separated list of pairs of temperature in celsius and the fan speed in % (temp:speed) defining basic settings for a fan curve
+
+    --default-speed OR -ds <FAN_SPEED_PERCENTAGE>
+          Set a default speed for when there is no match for the fan curve settings
+
+    --curve-type OR -ct <step|linear|spline>
+          How the fan speed is calculated between the temperature-speed pairs. step: uses the speed of the highest pair below the current temperature (default). linear: straight lines between the pairs. spline: smooth curve that never goes above or below the speeds of the pairs
+
+    --manual
+          Sets the fan policy to manual
+
+    --auto
+          Sets the fan policy to automatic (vBIOS controlled)
+
+    --power-limit OR -pl <POWER_LIMIT_WATTS>
+          Sets the power limit of the GPU in watts
+
+    --acoustic-temp-limit OR -tl <TEMPERATURE_CELSIUS>
+          Sets the acoustic threshold in celsious (note that this is the same temperature limit used by GeForce Experience)
+
+    --single-use OR -su
+          Makes some actions work only once instead of in a loop
+
+    --verbose OR -V
+          When there are no settings changes, leg messages are omitted by default. This option enables them back (good for debugging)
+
+    --retry OR -rt
+          By default the program closes when it encounters an error, but this lets the program try to recover. It could be useful to let the service manager restart the process
+
+    --watchdog OR -wd <TIME_SECONDS>
+          Kills and replaces the worker process when it doesn't finish a control tick within this time (e.g. a NVML call blocked inside of the driver). It must be longer than the time interval. Hangs and the time to detect them are logged. Default: 0 (disabled)
+
+    --standby OR -sb
+          Keeps a second worker process already initialized, so it can take over right after the active one fails (only used with --retry). The recovery gap (from the worker exit to the first control tick) is logged on each restart
+
+    --metrics-port OR -mp <PORT>
+          Serves the values sampled by the control loop at http://127.0.0.1:<PORT>/metrics in the Prometheus text format (temperature, fan speed, power limit, writes, tick duration and worker restarts). Scrapes don't make any NVML calls
+
+    --record OR -rc <FILE>
+          Records the temperature, fan speed per controller, power limit, power usage and the actions taken (writes, held fan speeds and errors) of every GPU on each tick of the control or record action. The file has a fixed size (the oldest records are overwritten) and is memory-mapped, so recording costs almost nothing per tick and the file can be read while the loop is running. A restarted worker continues the same file
+
+    --record-size OR -rs <MEGABYTES>
+          Maximum size of the record file. Each record takes 48 bytes, so 16 MB keep about 350000 records (4 days of a single GPU at 1 second). Default: 16
+
+    --config OR -cf <FILE>
+          Reads the options from a TOML (Python 3.11 or newer) or JSON file, as if they were given in place of this option, so the options after it override the file. Each entry of "gpus" selects a new GPU (with name, uuid, pci, serial or index) with its own settings. The control and record actions reload the file when it changes or on SIGHUP (Linux only), between ticks and without restarting the worker or the NVML session: the fan curves, limits, intervals, hysteresis and minimum dwell time take effect on the next tick, while other changes (e.g. selecting other GPUs) need a restart. An invalid file keeps the current settings. Example: control -cf /etc/nvml-gpu-control.toml
+          Example file:
+              time-interval = 2
+              [[gpus]]
+              uuid = "GPU-00000000-0000-0000-0000-000000000000"
+              speed-pair = "40:30,60:70,75:100"
+              power-limit = 250
+
+    --json OR -js
+          Makes the list action print a JSON document with every GPU, read in a single NVML session: index, name, UUID, PCI bus ID, serial, fan count, fan policy, power limit constraints, current and enforced power limits and acoustic thresholds. Values the GPU doesn't support are null. Example: list --json
+
+    --socket OR -so <PATH>
+          With the control or record action: answers fan-info, fan-policy-info, power-limit-info and thresholds-info on this Unix socket from the values sampled by the loop (all of them are sampled on each tick). With an info action: asks the process at this socket first, so it prints right away without a new NVML session, and falls back to the driver when no process answers or the sample is stale. Not available on Windows. Example: fan-info -n "NVIDIA GeForce RTX 4080" -so /run/nvml-gpu-control.sock
+
+    --slowdown-temp OR -st <TEMP_CELSIUS>
+          Temperature the tune action must stay below, usually the slowdown threshold of the GPU (see thresholds-info). Default: 90
+
+    --candidates OR -cn <COUNT>
+          Number of fan curves evaluated by the tune action. Default: 4096
+
+    --log-format OR -lf <text|json>
+          Format of the log messages. json: one JSON object per line (time, level, pid and message). The control worker writes its logs on a background thread, so a slow output (e.g. journald) never delays the control loop, and identical messages are only written once every 30 seconds. Default: text
+
+    --trace-nvml OR -tn
+          Records the count, errors and latency histogram of every NVML call. The trace is printed when the program (or the worker process) exits and when it receives SIGUSR1 (Linux only). Example: kill -USR1 <PID>
+
+    --simulate OR -sim <GPU_COUNT>
+          Uses simulated GPUs (with a thermal model and a simulated clock) instead of the driver. Nothing touches the real hardware and the loop runs without waiting, which is useful to test a configuration. The GPUs are named "NVIDIA Simulated GPU" and their UUIDs end with their index. Example: control -sim 2 -n "NVIDIA Simulated GPU" -sp "0:30,60:100" -V
+
+'''
+    print(help_text)
@@ -0,0 +1,129 @@
+import json
+import os
+
+# Settings file (--config): the same options as the command line, so it is validated by the same rules (see parse_args.py)
+#
+#   time-interval = 2
+#   hysteresis = 3
+#   dry-run = false
+#
+#   [[gpus]]
+#   uuid = "GPU-00000000-0000-0000-0000-000000000000"    # Or name, pci, serial or index
+#   speed-pair = "40:30,60:70,75:100"    # Or a list of pairs: [[40, 30], [60, 70], [75, 100]]
+#   curve-type = "linear"
+#   power-limit = 250
+#
+# .toml files need Python 3.11 or newer (tomllib), any other extension is read as JSON with the same keys
+
+# Options that don't belong to a GPU. Flags take true or false
+flag_options = ['dry-run', 'verbose', 'retry', 'standby', 'trace-nvml', 'single-use', 'auto', 'manual']
+value_options = ['time-interval', 'adaptive-interval', 'retry-interval', 'retry-max-interval', 'probe-interval', 'hysteresis', 'min-dwell',
+                 'watchdog', 'metrics-port', 'log-format', 'simulate', 'record', 'record-size', 'socket', 'slowdown-temp', 'candidates',
+                 'device-cache', 'events', 'engine', 'call-timeout', 'safe-speed']
+
+# Options of each entry of "gpus". At the top level, they apply to the GPU selected on the command line
+gpu_selectors = ['name', 'uuid', 'pci', 'serial', 'index']
+gpu_options = gpu_selectors + ['speed-pair', 'curve-type', 'default-speed', 'power-limit', 'acoustic-temp-limit']
+
+# Placed before the settings of each entry of "gpus", so each one is a new GPU (the command line only starts a new GPU when the same kind
+# of selector is repeated). It is not a string, so it can't be typed on the command line
+next_gpu = object()
+
+class InvalidConfigFile(Exception):
+    pass
+
+# tomllib is only in the standard library since Python 3.11
+def load_tomllib():
+    try:
+        import tomllib
+    except ImportError:
+        return None
+
+    return tomllib
+
+def read_config_file(path):
+
+    if os.path.splitext(path)[1].lower() == '.toml':
+        tomllib = load_tomllib()
+
+        if tomllib == None:
+            raise InvalidConfigFile('TOML files need Python 3.11 or newer, use a JSON file instead')
+
+        with open(path, 'rb') as config_file:
+            return tomllib.load(config_file)
+
+    with open(path, 'r', encoding='utf-8') as config_file:
+        return json.load(config_file)
+
+def option_value(key, value):
+
+    if key == 'speed-pair' and isinstance(value, list):
+        try:
+            return ','.join(f'{int(temperature)}:{int(speed)}' for temperature, speed in value)
+        except (TypeError, ValueError):
+            raise InvalidConfigFile('speed-pair must be a list of [temperature, speed] pairs')
+
+    if isinstance(value, bool) or isinstance(value, (list, dict)) or value == None:
+        raise InvalidConfigFile(f'Invalid value for {key}: {value}')
+
+    return str(value)
+
+def option_args(settings, allowed_options, where):
+    args = []
+
+    for key, value in settings.items():
+        option = str(key).replace('_', '-')
+
+        if option in flag_options and option in allowed_options:
+            if isinstance(value, bool) != True:
+                raise InvalidConfigFile(f'{option} {where} must be true or false')
+
+            if value == True:
+                args.append(f'--{option}')
+
+        elif option in allowed_options:
+            args += [f'--{option}', option_value(option, value)]
+
+        elif option != 'gpus':
+            raise InvalidConfigFile(f'Unknown option {where}: {key}')
+
+    return args
+
+# Command line arguments with the settings of the file
+def load_config_args(path):
+
+    try:
+        settings = read_config_file(path)
+    except (OSError, ValueError) as error: # Both decoders raise subclasses of ValueError
+        raise InvalidConfigFile(f'Could not read {path}: {error}')
+
+    if isinstance(settings, dict) != True:
+        raise InvalidConfigFile(f'{path} must contain a table (TOML) or an object (JSON)')
+
+    args = option_args(settings, flag_options + value_options + gpu_options, 'at the top level')
+
+    gpus = settings.get('gpus', [])
+    if isinstance(gpus, list) != True:
+        raise InvalidConfigFile('gpus must be a list of tables ([[gpus]] in TOML)')
+
+    for gpu_idx, gpu_settings in enumerate(gpus):
+        if isinstance(gpu_settings, dict) != True:
+            raise InvalidConfigFile(f'gpus[{gpu_idx}] must be a table')
+
+        if all(selector not in gpu_settings for selector in gpu_selectors):
+            raise InvalidConfigFile(f'gpus[{gpu_idx}] needs one of: {", ".join(gpu_selectors)}')
+
+        args.append(next_gpu)
+        args += option_args(gpu_settings, gpu_options, f'in gpus[{gpu_idx}]')
+
+    return args
+
+# Changes when the file is written or replaced (e.g. an editor writing a new file and renaming it)
+def file_version(path):
+
+    try:
+        file_stat = os.stat(path)
+    except OSError:
+        return None
+
+    return (file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size)
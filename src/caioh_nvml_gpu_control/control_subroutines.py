@@ -0,0 +1,228 @@
+import fan_curve
+from log_writer import log_helper
+
+# What the control subroutines decide for a GPU on each tick, from a DeviceSnapshot. Nothing here talks to the driver: the settings are
+# written through settings_writer, which helper_functions replaces with the NVML writes when it is loaded. So the replay and the tuner
+# (see telemetry_replay.py) run the same subroutines as the control loop without loading the NVML bindings
+
+class TemperatureThresholds:
+    def __init__(self, shutdown_t, slowdown_t, max_memory_t, gpu_max_t, min_acoustic_t, current_acoustic_t, max_acoustic_t):
+        self.shutdown = shutdown_t
+        self.slowdown = slowdown_t
+        self.max_memory = max_memory_t
+        self.gpu_max = gpu_max_t
+        self.min_acoustic = min_acoustic_t
+        self.current_acoustic = current_acoustic_t
+        self.max_acoustic = max_acoustic_t
+
+class PowerLimitConstraintsWatts:
+    def __init__(self, min_pl, max_pl):
+        self.min = min_pl
+        self.max = max_pl
+
+class FanSpeedConstraintsPercentage:
+    def __init__(self, min_s, max_s):
+        self.min = min_s
+        self.max = max_s
+
+# Everything the control subroutines need from the device, collected once per tick
+class DeviceSnapshot:
+    def __init__(self):
+        self.time = 0.0 # time.monotonic() value of when it was collected
+        self.temperature = None # Only sampled when something uses it
+        self.fan_speed = 0
+        self.fan_speeds = [] # Per fan controller
+        self.current_power_limit = 0
+        self.enforced_power_limit = 0
+        self.power_usage = None # In watts, only available with the power field values
+        self.power_limit_constraints = None
+        self.temperature_thresholds = None
+        self.name = None # Only sampled for the info socket (--socket), like the values below
+        self.uuid = None
+        self.fan_constraints = None
+        self.fan_policy = None
+        self.nvml_calls = 0 # How many NVML calls it took to collect it
+
+# The control state of a GPU, what the subroutines read and update on each tick (see helper_functions.ControlledGpu for the rest)
+class GpuControlState:
+    def __init__(self, gpu_config):
+        self.config = gpu_config
+        self.label = gpu_config.label()
+        self.handle = None # Only set while the device is working
+        self.snapshot = None # Latest DeviceSnapshot
+        self.fan_curve = fan_curve.CompiledFanCurve(gpu_config.temp_speed_pair, gpu_config.default_speed, gpu_config.curve_type)
+        self.fan_target = None # Last fan speed chosen by the control loop
+        self.fan_target_time = 0.0 # time.monotonic() value of when fan_target was chosen
+        self.fan_writes_issued = 0
+        self.fan_writes_suppressed = 0 # Speed changes held back by the hysteresis or the minimum dwell time
+        self.held_speed = None # Curve speed held back on the previous tick, so a change held over several ticks is only counted once
+        self.power_limit_writes = 0
+        self.acoustic_limit_writes = 0
+
+# Receives the settings chosen by the subroutines. This one writes nothing, which is all the replay needs (it always runs as a dry run)
+class SettingsWriter:
+
+    def set_fan_speed(self, gpu_handle, speed_percentage, dry_run, fan_count):
+        pass
+
+    def set_power_limit(self, gpu_handle, power_limit_watts, dry_run):
+        pass
+
+    def set_acoustic_threshold(self, gpu_handle, temperature_C, dry_run):
+        pass
+
+settings_writer = SettingsWriter()
+
+# Only lower the fan speed when the temperature is clearly lower and after the minimum dwell time, raising it is never delayed
+def hold_fan_speed(controlled_gpu, current_temp, configuration, now):
+    curve = controlled_gpu.fan_curve
+    last_target = controlled_gpu.fan_target
+    target_speed = curve.speed(current_temp)
+
+    if last_target == None or target_speed >= last_target:
+        return target_speed
+
+    # The speed used a few degrees above the current temperature, if it is still the same, we are inside of the hysteresis band
+    target_speed = curve.speed(current_temp + configuration.hysteresis)
+
+    if target_speed >= last_target:
+        return last_target
+
+    if now - controlled_gpu.fan_target_time < configuration.min_dwell_s:
+        return last_target
+
+    return target_speed
+
+# Control GPU functions and monitor for changes (e.g. temperature)
+def fan_control_subroutine(controlled_gpu, configuration):
+
+    gpu_handle = controlled_gpu.handle
+    gpu_config = controlled_gpu.config
+    snapshot = controlled_gpu.snapshot
+
+    current_temp = snapshot.temperature
+    current_speed = snapshot.fan_speed
+    fan_count = len(snapshot.fan_speeds)
+
+    # The curve is compiled into a table, so this is just an index
+    now = snapshot.time
+    curve_speed = controlled_gpu.fan_curve.speed(current_temp)
+    target_speed = hold_fan_speed(controlled_gpu, current_temp, configuration, now)
+
+    # Without hysteresis and the dwell time, the curve speed would have been written (once, not on every tick it stays held)
+    speed_held = target_speed != curve_speed and current_speed != curve_speed
+    if speed_held == True and curve_speed != controlled_gpu.held_speed:
+        controlled_gpu.fan_writes_suppressed += 1
+
+    controlled_gpu.held_speed = curve_speed if speed_held == True else None
+
+    if target_speed != controlled_gpu.fan_target:
+        controlled_gpu.fan_target = target_speed
+        controlled_gpu.fan_target_time = now
+
+    # Only send commands to the GPU if necessary (if the current setting is different from the targeted one)
+    setting_changed = current_speed != target_speed
+    if setting_changed == True:
+        settings_writer.set_fan_speed(gpu_handle, target_speed, configuration.dry_run, fan_count)
+        controlled_gpu.fan_writes_issued += 1
+
+    # Only print log messages when necessary to avoid taking too much disk space (and only build them in that case)
+    if configuration.verbose != True and setting_changed != True:
+        return
+
+    log_msg = []
+
+    log_msg.append(f'Device: {controlled_gpu.label}')
+    log_msg.append(f'Current temp: {current_temp}°C')
+    log_msg.append(f'Current speed: {current_speed}%') # Monitor for fan fan speed changes and reajust! 
+
+    # Get the fan speed per controller
+    for idx, fan_speed_c in enumerate(snapshot.fan_speeds):
+        log_msg.append(f'Fan controller speed {idx}: {fan_speed_c}%')
+
+    if controlled_gpu.fan_curve.has_match(current_temp) == False:
+        log_msg.append(f'Found no temperature match, using default fan speed: {gpu_config.default_speed}%')
+
+    if speed_held == True:
+        log_msg.append(f'Keeping fan speed at {target_speed}% instead of {curve_speed}% (hysteresis or minimum dwell time)')
+
+    if setting_changed == True:
+        log_msg.append(f'Setting GPU fan speed: {target_speed}%')
+    else:
+        log_msg.append(f'Same as previous speed, nothing to do!')
+
+    log_msg.append(f'Fan writes: {controlled_gpu.fan_writes_issued} issued, {controlled_gpu.fan_writes_suppressed} suppressed')
+
+    log_helper("\n" + "\n".join(log_msg) + "\n")
+
+# Power control
+
+def power_control_subroutine(controlled_gpu, configuration):
+    gpu_handle = controlled_gpu.handle
+    target_power_limit = controlled_gpu.config.power_limit
+
+    snapshot = controlled_gpu.snapshot
+
+    power_limit_constraints_watts = snapshot.power_limit_constraints
+    current_pl = snapshot.current_power_limit
+    current_enforced_pl = snapshot.enforced_power_limit
+
+    setting_changed = target_power_limit != current_pl or target_power_limit != current_enforced_pl
+
+    if setting_changed == True:
+        settings_writer.set_power_limit(gpu_handle, target_power_limit, configuration.dry_run)
+        controlled_gpu.power_limit_writes += 1
+
+    # Only print log messages when necessary to avoid taking too much disk space (and only build them in that case)
+    if configuration.verbose != True and setting_changed != True:
+        return
+
+    log_msg = []
+
+    log_msg.append(f'Device: {controlled_gpu.label}')
+    log_msg.append(f'Current power limit: {current_pl}W')
+    log_msg.append(f'Current enforced power limit: {current_enforced_pl}W')
+
+    if target_power_limit < power_limit_constraints_watts.min or target_power_limit > power_limit_constraints_watts.max:
+        log_msg.append(f'WARNING: trying to set power limit outside of the min({power_limit_constraints_watts.min}W) and max({power_limit_constraints_watts.max}W) range')
+
+    if setting_changed == True:
+        log_msg.append(f'Setting the power limit: {target_power_limit}W')
+    else:
+        log_msg.append(f'Nothing to do, current and enforced power limit is the same as the target')
+
+    log_helper("\n" + "\n".join(log_msg) + "\n")
+
+# Temperature control
+
+def temp_control_subroutine(controlled_gpu, configuration):
+
+    gpu_handle = controlled_gpu.handle
+    target_acoustic_temp_limit = controlled_gpu.config.acoustic_temp_limit
+
+    current_temp_thresholds = controlled_gpu.snapshot.temperature_thresholds
+
+    setting_changed = target_acoustic_temp_limit != current_temp_thresholds.current_acoustic
+
+    if setting_changed == True:
+        settings_writer.set_acoustic_threshold(gpu_handle, target_acoustic_temp_limit, configuration.dry_run)
+        controlled_gpu.acoustic_limit_writes += 1
+
+    # Only print log messages when necessary to avoid taking too much disk space (and only build them in that case)
+    if configuration.verbose != True and setting_changed != True:
+        return
+
+    log_msg = []
+
+    log_msg.append(f'Device: {controlled_gpu.label}')
+    log_msg.append(f'Current acoustic threshold: {current_temp_thresholds.current_acoustic}°C')
+
+    if target_acoustic_temp_limit < current_temp_thresholds.min_acoustic or target_acoustic_temp_limit > current_temp_thresholds.max_acoustic:
+        log_msg.append(f'WARNING: trying to set acoustic threshold outside of the min({current_temp_thresholds.min_acoustic}°C) and max({current_temp_thresholds.max_acoustic}°C) range')
+
+    if setting_changed == True:
+        log_msg.append(f'Setting acoustic temperature threshold: {target_acoustic_temp_limit}°C')
+    else:
+        log_msg.append(f'Nothing to do, current temperature threshold is the same as the target')
+
+    log_helper("\n" + "\n".join(log_msg) + "\n")
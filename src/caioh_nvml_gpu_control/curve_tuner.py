@@ -0,0 +1,387 @@
+import math
+import time
+import parse_args
+from log_writer import error_print
+from info_report import output_separator
+import fan_curve
+import telemetry_ring
+import telemetry_replay
+
+# NumPy is optional (it is not a dependency of this project), only the tune action needs it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Searches fan curves for a recorded trace (--record): a thermal model is fitted on the recording and every candidate curve is simulated on
+# the recorded power usage, all candidates at once as NumPy arrays
+#
+#   dT/dt = heating * power - (passive cooling + fan cooling * fan speed / 100) * (T - ambient)
+#
+# The hysteresis and the minimum dwell time are not simulated, so the real loop writes a bit less often than the tuned curve suggests
+
+# Room temperature of the model, the fitted cooling terms absorb most of the error when the real one is different
+ambient_temperature = 25.0
+
+# Curve points searched: one at 0°C and the others spread from the lowest recorded temperature to the slowdown threshold
+curve_points = 5
+
+# Fan speed difference (in %) the recording needs to tell how much the fans cool the GPU
+min_fan_speed_range = 10
+
+# Longer traces are simulated in coarser steps, so the run time doesn't depend on the length of the recording
+max_steps = 20000
+
+# The chosen curve must keep the peak temperature this far below the slowdown threshold
+safety_margin = 5
+
+# Highest temperature in the candidate speed tables, hotter readings use the last speed
+table_temperatures = 150
+
+# The candidates are random, but the same recording always gives the same result
+random_seed = 0
+
+# Curves of the Pareto front that are printed
+printed_front_size = 15
+
+class NumpyNotInstalled(Exception):
+    pass
+
+class ThermalModelFitFailed(Exception):
+    pass
+
+class ThermalModel:
+    def __init__(self, heating, passive_cooling, fan_cooling):
+        self.heating = heating # °C/s per W
+        self.passive_cooling = passive_cooling # 1/s
+        self.fan_cooling = fan_cooling # 1/s at 100% fan speed
+        self.fit_error = 0.0 # RMSE in °C when simulating the recorded fan speeds
+
+# The recorded trace as simulation steps: the temperature at the start, how long it lasted, the power usage and fan speed during it
+# and the temperature at its end. A step after a gap (the device was failing or the program was stopped) restarts the simulation
+class TraceSteps:
+    def __init__(self, dt, power, fan_speed, start_temperature, end_temperature, restart):
+        self.dt = numpy.asarray(dt, dtype=float)
+        self.power = numpy.asarray(power, dtype=float)
+        self.fan_speed = numpy.asarray(fan_speed, dtype=float)
+        self.start_temperature = numpy.asarray(start_temperature, dtype=float)
+        self.end_temperature = numpy.asarray(end_temperature, dtype=float)
+        self.restart = numpy.asarray(restart, dtype=bool)
+
+    def __len__(self):
+        return len(self.dt)
+
+    def duration(self):
+        return float(self.dt.sum())
+
+# Only samples with everything the model needs are used
+def trace_steps(samples):
+    intervals = [next_sample.time - sample.time for sample, next_sample in zip(samples, samples[1:])]
+    max_gap_s = sorted(intervals)[len(intervals) // 2] * telemetry_replay.max_gap_intervals if len(intervals) != 0 else 0.0
+
+    steps = ([], [], [], [], [], [])
+    previous = None
+    last_end = None # Sample at the end of the last step
+
+    for sample in samples:
+
+        if sample.flags & telemetry_ring.flag_up == 0 or sample.temperature == None or sample.power_usage == None or len(sample.fan_speeds) == 0:
+            previous = None
+            continue
+
+        if previous != None and 0 < sample.time - previous.time <= max_gap_s:
+            step = (sample.time - previous.time, previous.power_usage, sum(previous.fan_speeds) / len(previous.fan_speeds),
+                    previous.temperature, sample.temperature, previous is not last_end)
+
+            for values, value in zip(steps, step):
+                values.append(value)
+
+            last_end = sample
+
+        previous = sample
+
+    return TraceSteps(*steps)
+
+# Joins consecutive steps (never across a restart), the power usage and fan speed are averaged over the time
+def coarse_steps(steps, step_count):
+    block_size = math.ceil(len(steps) / step_count)
+
+    if block_size <= 1:
+        return steps
+
+    coarse = ([], [], [], [], [], [])
+    block_start = 0
+
+    for idx in range(1, len(steps) + 1):
+
+        if idx != len(steps) and idx - block_start < block_size and steps.restart[idx] != True:
+            continue
+
+        block = slice(block_start, idx)
+        dt = steps.dt[block]
+        duration = dt.sum()
+
+        step = (duration, (steps.power[block] * dt).sum() / duration, (steps.fan_speed[block] * dt).sum() / duration,
+                steps.start_temperature[block_start], steps.end_temperature[idx - 1], steps.restart[block_start])
+
+        for values, value in zip(coarse, step):
+            values.append(value)
+
+        block_start = idx
+
+    return TraceSteps(*coarse)
+
+# Least squares on the temperature changes: dT/dt = heating * power - passive cooling * (T - ambient) - fan cooling * fan / 100 * (T - ambient)
+def fit_thermal_model(steps):
+
+    if len(steps) < 10:
+        raise ThermalModelFitFailed('Not enough samples to fit the thermal model')
+
+    above_ambient = steps.start_temperature - ambient_temperature
+    features = numpy.column_stack([steps.power, -above_ambient, -steps.fan_speed / 100 * above_ambient])
+    rates = (steps.end_temperature - steps.start_temperature) / steps.dt
+
+    # Without fan speed changes in the recording, the fans can't be told apart from the passive cooling
+    if steps.fan_speed.max() - steps.fan_speed.min() < min_fan_speed_range:
+        raise ThermalModelFitFailed('The recording does not show how the fan speed changes the temperature')
+
+    (heating, passive_cooling, fan_cooling), _, _, _ = numpy.linalg.lstsq(features, rates, rcond=None)
+
+    if heating <= 0 or fan_cooling <= 0 or passive_cooling + fan_cooling <= 0:
+        raise ThermalModelFitFailed('The recording does not show how the fan speed changes the temperature')
+
+    return ThermalModel(float(heating), max(0.0, float(passive_cooling)), float(fan_cooling))
+
+# How far the model is from the recording when it gets the recorded fan speeds
+def recorded_fit_error(model, steps):
+    squared_error = 0.0
+    temperature = 0.0
+
+    for idx in range(len(steps)):
+
+        if steps.restart[idx] == True:
+            temperature = steps.start_temperature[idx]
+
+        cooling = model.passive_cooling + model.fan_cooling * steps.fan_speed[idx] / 100
+        equilibrium = ambient_temperature + model.heating * steps.power[idx] / cooling
+        temperature = equilibrium + (temperature - equilibrium) * math.exp(-cooling * steps.dt[idx])
+        squared_error += (temperature - steps.end_temperature[idx]) ** 2
+
+    return math.sqrt(squared_error / max(1, len(steps)))
+
+# The pairs are sorted by temperature, like the -sp option is usually written
+def speed_pair_text(temperatures, speeds):
+    return ','.join(f'{temperature}:{speed}' for temperature, speed in zip(temperatures, speeds))
+
+# Speed per degree (0°C to table_temperatures) of a curve, the same table the control loop uses
+def curve_table(temp_speed_pair, default_speed, curve_type):
+    return fan_curve.CompiledFanCurve(temp_speed_pair, default_speed, curve_type).speed_array(numpy.arange(table_temperatures + 1))
+
+# The tables of all candidates at once. Same results as CompiledFanCurve (the same operations in the same order), which is still used
+# for the spline curves. The candidates have a point at 0°C, so the default speed is never used
+def candidate_tables(temperatures, speeds, curve_type):
+    grid = numpy.arange(table_temperatures + 1)
+    points = numpy.array(temperatures)
+    segments = numpy.searchsorted(points, grid, side='right') - 1
+
+    if curve_type == 'step':
+        return speeds[:, segments]
+
+    if curve_type == 'linear':
+        segments = numpy.minimum(segments, len(points) - 2)
+        t0, t1 = points[segments], points[segments + 1]
+        s0, s1 = speeds[:, segments].astype(float), speeds[:, segments + 1].astype(float)
+
+        tables = numpy.rint(s0 + (s1 - s0) * (grid - t0) / (t1 - t0)).astype(numpy.int64)
+        tables[:, grid >= points[-1]] = speeds[:, -1:]
+
+        return numpy.clip(tables, 0, 100)
+
+    return numpy.array([curve_table([parse_args.TempSpeedPair(int(temperature), int(speed)) for temperature, speed in zip(temperatures, row)], int(row[0]), curve_type) for row in speeds])
+
+class CandidateCurves:
+    def __init__(self, temperatures, speeds, curve_type):
+        self.temperatures = temperatures # Shared by all candidates
+        self.speeds = speeds # One row per candidate
+        self.curve_type = curve_type
+        self.tables = candidate_tables(temperatures, speeds, curve_type)
+
+    def speed_pair(self, candidate):
+        return speed_pair_text([int(temperature) for temperature in self.temperatures], [int(speed) for speed in self.speeds[candidate]])
+
+# Speeds only go up with the temperature and never below the lowest recorded fan speed (the GPU may not accept less)
+def generate_candidates(configuration, steps, random_generator):
+    lowest_temperature = int(max(1, math.floor(steps.start_temperature.min())))
+    highest_temperature = max(lowest_temperature + curve_points - 1, configuration.slowdown_temp)
+
+    temperatures = [0] + sorted(set(int(round(temperature)) for temperature in numpy.linspace(lowest_temperature, highest_temperature, curve_points - 1)))
+    min_speed = int(math.floor(steps.fan_speed.min()))
+
+    speeds = numpy.sort(random_generator.integers(min_speed, 101, size=(configuration.tune_candidates, len(temperatures))), axis=1)
+
+    return CandidateCurves(temperatures, speeds, configuration.curve_type)
+
+class CurveScores:
+    def __init__(self, candidate_count):
+        self.fan_speed_time = numpy.zeros(candidate_count) # Fan speed * seconds
+        self.peak_temperature = numpy.full(candidate_count, -math.inf)
+        self.time_above_slowdown = numpy.zeros(candidate_count)
+        self.duration = 0.0
+
+    def average_fan_speed(self):
+        return self.fan_speed_time / max(self.duration, 1e-9)
+
+# Simulates all curves (one table per row) at once. The fan speeds are whole numbers, so the decay and the equilibrium temperature of
+# each step are computed up front for every speed and the loop only looks them up
+def score_curves(model, steps, tables, slowdown_temp):
+    candidate_count = len(tables)
+    scores = CurveScores(candidate_count)
+    scores.duration = steps.duration()
+
+    cooling = model.passive_cooling + model.fan_cooling * numpy.arange(101) / 100
+    decays = numpy.exp(-numpy.outer(steps.dt, cooling))
+    equilibriums = ambient_temperature + model.heating * numpy.outer(steps.power, 1 / cooling)
+
+    flat_tables = numpy.ascontiguousarray(tables, dtype=numpy.int64).ravel()
+    row_offsets = numpy.arange(candidate_count) * tables.shape[1]
+    temperature = numpy.full(candidate_count, steps.start_temperature[0])
+
+    for idx in range(len(steps)):
+
+        if steps.restart[idx] == True:
+            temperature.fill(steps.start_temperature[idx])
+
+        # The loop reads whole degrees, like the driver reports them
+        indexes = numpy.clip(temperature, 0, table_temperatures).astype(numpy.int64)
+        fan_speed = flat_tables.take(indexes + row_offsets)
+
+        equilibrium = equilibriums[idx].take(fan_speed)
+        temperature = equilibrium + (temperature - equilibrium) * decays[idx].take(fan_speed)
+
+        scores.fan_speed_time += fan_speed * steps.dt[idx]
+        numpy.maximum(scores.peak_temperature, temperature, out=scores.peak_temperature)
+        scores.time_above_slowdown += (temperature >= slowdown_temp) * steps.dt[idx]
+
+    return scores
+
+# Candidates that no other candidate beats on all three scores (lower is better)
+# In lexicographic order, a candidate can only be beaten by an earlier one, and then also by one that is already on the front
+def pareto_front(scores):
+    values = numpy.column_stack([scores.average_fan_speed(), scores.peak_temperature, scores.time_above_slowdown])
+    front = []
+
+    for candidate in numpy.lexsort(values.T[::-1]):
+        front_values = values[front]
+
+        if len(front) != 0 and numpy.any(numpy.all(front_values <= values[candidate], axis=1) & numpy.any(front_values < values[candidate], axis=1)):
+            continue
+
+        front.append(int(candidate))
+
+    return front
+
+# Lowest average fan speed that stays below the slowdown threshold (with the safety margin), or the coolest curve when none does
+def best_candidate(scores, slowdown_temp):
+    average_fan_speed = scores.average_fan_speed()
+    safe = (scores.peak_temperature <= slowdown_temp - safety_margin) & (scores.time_above_slowdown == 0)
+
+    if numpy.any(safe):
+        candidates = numpy.flatnonzero(safe)
+        return int(candidates[numpy.lexsort((scores.peak_temperature[candidates], average_fan_speed[candidates]))[0]]), True
+
+    return int(numpy.argmin(scores.peak_temperature)), False
+
+class TuneResult:
+    def __init__(self, label, steps, model, candidates, scores, front, best, safe):
+        self.label = label
+        self.steps = steps
+        self.model = model
+        self.candidates = candidates
+        self.scores = scores
+        self.front = front
+        self.best = best
+        self.safe = safe # The best curve stays below the slowdown threshold with the safety margin
+        self.current_scores = None # Scores of the configured curve (-sp), if there is one
+        self.elapsed_s = 0.0
+
+def tune_record(configuration):
+
+    if numpy == None:
+        error_print('The tune action needs NumPy, install it with: pip install numpy')
+        raise NumpyNotInstalled('NumPy is not installed')
+
+    start = time.perf_counter()
+    gpu_config = configuration.gpus[0]
+    label = gpu_config.label()
+
+    reader = telemetry_ring.TelemetryReader(configuration.record_path)
+
+    try:
+        gpu_labels = reader.gpu_labels
+        samples = reader.samples()
+    finally:
+        reader.close()
+
+    if label not in gpu_labels:
+        error_print(f'{label} was not recorded in {configuration.record_path}. Recorded devices: {", ".join(gpu_labels)}')
+        raise parse_args.GpuNotFound('The device was not recorded')
+
+    gpu_index = gpu_labels.index(label)
+    steps = trace_steps([sample for sample in samples if sample.gpu_index == gpu_index])
+
+    try:
+        model = fit_thermal_model(steps)
+    except ThermalModelFitFailed as error:
+        error_print(f'{error}. Record the GPU with a fan curve and a varying load for a while, so the fan speed and the temperature change')
+        raise
+
+    simulated_steps = coarse_steps(steps, max_steps)
+    model.fit_error = recorded_fit_error(model, simulated_steps)
+
+    candidates = generate_candidates(configuration, simulated_steps, numpy.random.default_rng(random_seed))
+    scores = score_curves(model, simulated_steps, candidates.tables, configuration.slowdown_temp)
+    best, safe = best_candidate(scores, configuration.slowdown_temp)
+
+    result = TuneResult(label, simulated_steps, model, candidates, scores, pareto_front(scores), best, safe)
+
+    # The curve in use, for comparison
+    if len(gpu_config.temp_speed_pair) != 0:
+        current_table = curve_table(gpu_config.temp_speed_pair, gpu_config.default_speed, gpu_config.curve_type)
+        result.current_scores = score_curves(model, simulated_steps, current_table[None, :], configuration.slowdown_temp)
+
+    result.elapsed_s = time.perf_counter() - start
+    return result
+
+def score_text(scores, candidate, slowdown_temp):
+    return f'avg fan {scores.average_fan_speed()[candidate]:5.1f}%  peak {scores.peak_temperature[candidate]:5.1f}°C  above {slowdown_temp}°C {scores.time_above_slowdown[candidate]:6.0f}s'
+
+def print_tune(configuration):
+    result = tune_record(configuration)
+    model = result.model
+    slowdown_temp = configuration.slowdown_temp
+
+    print(f'Device: {result.label}')
+    print(f'Thermal model: heating {model.heating * 1000:.3f}°C/s per kW, passive cooling {model.passive_cooling * 1000:.3f}/ks, fan cooling {model.fan_cooling * 1000:.3f}/ks at 100% (error on the recorded fan speeds: {model.fit_error:.2f}°C RMSE)')
+    print(f'Evaluated {len(result.candidates.speeds)} {result.candidates.curve_type} curves over {result.steps.duration():.0f}s of recording ({len(result.steps)} steps) in {result.elapsed_s:.2f}s')
+    print(f'{output_separator}')
+
+    print(f'Pareto front (average fan speed, peak temperature and time above the {slowdown_temp}°C slowdown threshold), {len(result.front)} curves:')
+    for candidate in result.front[:printed_front_size]:
+        print(f'    {score_text(result.scores, candidate, slowdown_temp)}  -sp "{result.candidates.speed_pair(candidate)}"')
+
+    if len(result.front) > printed_front_size:
+        print(f'    ... {len(result.front) - printed_front_size} more')
+
+    if result.current_scores != None:
+        print(f'Current curve: {score_text(result.current_scores, 0, slowdown_temp)}')
+
+    print(f'{output_separator}')
+
+    if result.safe == True:
+        print(f'Best curve (lowest average fan speed with a peak temperature of at most {slowdown_temp - safety_margin}°C):')
+    else:
+        print(f'WARNING: no curve keeps the temperature {safety_margin}°C below the slowdown threshold, this is the coolest one:')
+
+    curve_type_option = f' -ct {result.candidates.curve_type}' if result.candidates.curve_type != 'step' else ''
+    print(f'    {score_text(result.scores, result.best, slowdown_temp)}')
+    print(f'-sp "{result.candidates.speed_pair(result.best)}"{curve_type_option}')
@@ -0,0 +1,215 @@
+import json
+import os
+import threading
+import pynvml
+import parse_args
+from parse_args import GpuNotFound
+from log_writer import error_print
+
+# Finds the device of a GPU selector (see parse_args.GpuConfiguration.selector) without asking every device for its name on each lookup
+#
+# The index has the name, UUID, PCI bus ID and serial of every device. It is built by the first lookup that needs it (UUIDs go straight to
+# the driver) and kept for the whole NVML session. With --device-cache, it is also saved in a small JSON file that is valid while the
+# driver version and the boot don't change, so the next processes (e.g. each info action) only touch the target device:
+#
+#   {"driver_version": "580.95.05", "boot_id": "...", "devices": [{"index": 0, "name": "...", "uuid": "...", "pci_bus_id": "...", "serial": "..."}]}
+#
+# A device that isn't where the index says (a stale file, a device that came back, another device at the index) makes the index be built
+# again, once per lookup
+
+boot_id_path = '/proc/sys/kernel/random/boot_id'
+
+def pci_bus_id(pci_info):
+
+    if pci_info == None:
+        return None
+
+    # Older bindings return the bytes of the C string
+    if isinstance(pci_info.busId, bytes):
+        return pci_info.busId.decode('ascii')
+
+    return pci_info.busId
+
+# Changes on every boot. Only Linux has it, so the cache file is not used on other systems
+def read_boot_id():
+
+    try:
+        with open(boot_id_path, 'r') as boot_id_file:
+            return boot_id_file.read().strip()
+    except OSError:
+        return None
+
+def optional_value(query_function, *args):
+
+    try:
+        return query_function(*args)
+    except pynvml.NVMLError: # e.g. the serial number is only available on some boards
+        return None
+
+class DeviceIndex:
+    def __init__(self, nvml, cache_path=''):
+        self.nvml = nvml
+        self.cache_path = cache_path
+        self.devices = None # Device records, None until a lookup needs them
+        self.handles = {} # UUID -> handle, for the devices found by the last scan
+        self.key = None # Driver version and boot ID of the cache file
+        self.scans = 0
+        self.lock = threading.Lock() # The GPUs attach on their own threads with --engine async, a lookup must not see the index of another one half built
+
+    # Returns (handle, device record). The record is None when the device was selected by UUID and the index was never needed
+    def resolve(self, gpu_config):
+
+        with self.lock:
+            return self.resolve_locked(gpu_config)
+
+    def resolve_locked(self, gpu_config):
+        selector, value = gpu_config.selector()
+
+        if selector == 'gpu_uuid':
+            handle = self.nvml.nvmlDeviceGetHandleByUUID(value)
+            return handle, self.find(selector, value) if self.devices != None else None
+
+        scanned = False
+        if self.devices == None:
+            scanned = self.load()
+
+        while(True):
+            record = self.find(selector, value)
+
+            try:
+                if record == None:
+                    raise GpuNotFound('It was not possible to locate the device')
+
+                return self.handle(record, selector), record
+
+            except (pynvml.NVMLError, GpuNotFound):
+
+                if scanned == True:
+                    print(f'It was not possible to locate the target device : {gpu_config.label()}')
+                    raise
+
+                self.scan()
+                self.save()
+                scanned = True
+
+    def find(self, selector, value):
+        key = parse_args.selector_keys[selector]
+
+        if selector == 'gpu_index':
+            value = int(value)
+
+        matches = [record for record in self.devices if record[key] == value]
+
+        if len(matches) > 1:
+            error_print('WARNING: {} devices match {}, using index {} ({}). Select one of them with --pci, --index or --uuid',
+                        len(matches), value, matches[0]['index'], matches[0]['pci_bus_id'])
+
+        if len(matches) == 0:
+            return None
+
+        return matches[0]
+
+    def handle(self, record, selector):
+
+        if record['uuid'] in self.handles:
+            return self.handles[record['uuid']]
+
+        # The indexes of a cache file change when a device is gone or the devices are enumerated again, so the device at the index must be the same one
+        if selector == 'gpu_index':
+            handle = self.nvml.nvmlDeviceGetHandleByIndex(record['index'])
+
+            if self.nvml.nvmlDeviceGetUUID(handle) != record['uuid']:
+                raise GpuNotFound('Another device is at the index')
+
+            return handle
+
+        return self.nvml.nvmlDeviceGetHandleByUUID(record['uuid'])
+
+    # Record of a single device, without touching the others
+    def describe(self, handle, index=None):
+
+        if index == None:
+            index = self.nvml.nvmlDeviceGetIndex(handle)
+
+        return {
+            'index': index,
+            'name': self.nvml.nvmlDeviceGetName(handle),
+            'uuid': self.nvml.nvmlDeviceGetUUID(handle),
+            'pci_bus_id': pci_bus_id(optional_value(self.nvml.nvmlDeviceGetPciInfo, handle)),
+            'serial': optional_value(self.nvml.nvmlDeviceGetSerial, handle),
+        }
+
+    # Asks every device for its identifiers. Devices that can't be reached are left out, they can't be selected either
+    def scan(self):
+        self.devices = []
+        self.handles = {}
+        self.scans += 1
+
+        for index in range(self.nvml.nvmlDeviceGetCount()):
+
+            try:
+                handle = self.nvml.nvmlDeviceGetHandleByIndex(index)
+                record = self.describe(handle, index)
+            except pynvml.NVMLError:
+                continue
+
+            self.devices.append(record)
+            self.handles[record['uuid']] = handle
+
+    def cache_key(self):
+
+        if self.key == None:
+            self.key = {'driver_version': self.nvml.nvmlSystemGetDriverVersion(), 'boot_id': read_boot_id()}
+
+        return self.key
+
+    # Returns True when the devices had to be scanned
+    def load(self):
+
+        if self.cache_path != '':
+            try:
+                with open(self.cache_path, 'r', encoding='utf-8') as cache_file:
+                    cache = json.load(cache_file)
+            except (OSError, ValueError):
+                cache = None
+
+            key = self.cache_key()
+
+            if isinstance(cache, dict) == True and key['boot_id'] != None and all(cache.get(name) == value for name, value in key.items()):
+                devices = cache.get('devices')
+
+                if isinstance(devices, list) == True and all(isinstance(record, dict) and record.keys() == set(parse_args.selector_keys.values()) for record in devices):
+                    self.devices = devices
+                    return False
+
+        self.scan()
+        self.save()
+        return True
+
+    # The cache is only a shortcut, failing to write it doesn't stop anything
+    def save(self):
+
+        if self.cache_path == '':
+            return
+
+        key = self.cache_key()
+        if key['boot_id'] == None:
+            return
+
+        cache = dict(key, devices=self.devices)
+        temporary_path = f'{self.cache_path}.{os.getpid()}.tmp'
+
+        # Written on the side and renamed, so a process reading it at the same time never sees half of it
+        try:
+            with open(temporary_path, 'w', encoding='utf-8') as cache_file:
+                json.dump(cache, cache_file)
+
+            os.replace(temporary_path, self.cache_path)
+
+        except OSError as error:
+            error_print('Could not write the device cache {}: {}', self.cache_path, str(error))
+
+            try:
+                os.unlink(temporary_path)
+            except OSError:
+                pass
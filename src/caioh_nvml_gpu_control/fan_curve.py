@@ -0,0 +1,183 @@
+import math
+
+# NumPy is optional (it is not a dependency of this project), it only makes the vectorized evaluation faster for offline tools
+# It is only imported when it is used, since loading it takes longer than starting the rest of the program
+def load_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+
+    return numpy
+
+curve_types = ['step', 'linear', 'spline']
+
+# Turns the temperature-speed pairs into a table with one speed per degree, so the control loop finds the target speed with a single index
+#
+#   step: staircase graph, the speed of the highest pair whose temperature is lower or equal (the original behavior)
+#   linear: straight lines between the pairs
+#   spline: monotone cubic (Fritsch-Carlson), smooth and it never overshoots the speeds of the pairs
+#
+# For all types, temperatures below the lowest pair use the default speed and temperatures above the highest pair use its speed
+class CompiledFanCurve:
+    def __init__(self, temp_speed_pair, default_speed, curve_type='step'):
+
+        if curve_type not in curve_types:
+            raise ValueError(f'Unknown curve type: {curve_type}')
+
+        self.curve_type = curve_type
+        self.default_speed = default_speed
+        self.temp_speed_pair = temp_speed_pair
+        self.numpy_table = None # Built by the first speed_array() call
+
+        # Pairs come sorted from the highest to the lowest temperature. With repeated temperatures, the first one wins (same as the step scan)
+        points = {}
+        for pair in temp_speed_pair:
+            points.setdefault(pair.temperature, pair.speed)
+
+        self.temperatures = sorted(points)
+        self.speeds = [points[temperature] for temperature in self.temperatures]
+
+        if len(self.temperatures) == 0:
+            self.lowest_temperature = 0
+            self.table_start = 0
+            self.table = [default_speed]
+            return
+
+        self.lowest_temperature = self.temperatures[0]
+
+        # Temperatures are never negative in practice, but the user may still configure it
+        self.table_start = min(0, self.lowest_temperature)
+        table_end = self.temperatures[-1]
+
+        match curve_type:
+            case 'step':
+                interpolate = self.step_speed
+            case 'linear':
+                interpolate = self.linear_speed
+            case 'spline':
+                self.tangents = monotone_tangents(self.temperatures, self.speeds)
+                interpolate = self.spline_speed
+
+        self.table = []
+        for temperature in range(self.table_start, table_end + 1):
+
+            if temperature < self.lowest_temperature:
+                self.table.append(default_speed)
+            else:
+                self.table.append(clamp_speed(interpolate(temperature)))
+
+    # O(1) lookup used by the control loop
+    def speed(self, temperature):
+        index = math.floor(temperature) - self.table_start
+
+        if index < 0:
+            return self.default_speed
+
+        if index >= len(self.table):
+            return self.table[-1]
+
+        return self.table[index]
+
+    # Vectorized version of speed() for a sequence of temperatures (e.g. a recorded trace)
+    # Returns a NumPy array when NumPy is installed, otherwise a list
+    def speed_array(self, temperatures):
+        numpy = load_numpy()
+
+        if numpy == None:
+            return [self.speed(temperature) for temperature in temperatures]
+
+        if self.numpy_table is None:
+            self.numpy_table = numpy.array(self.table)
+
+        indexes = numpy.floor(numpy.asarray(temperatures)).astype(numpy.int64) - self.table_start
+        speeds = self.numpy_table[numpy.clip(indexes, 0, len(self.table) - 1)]
+
+        return numpy.where(indexes < 0, self.default_speed, speeds)
+
+    def has_match(self, temperature):
+        return len(self.temperatures) != 0 and temperature >= self.lowest_temperature
+
+    def step_speed(self, temperature):
+        speed = self.default_speed
+
+        for point_temperature, point_speed in zip(self.temperatures, self.speeds):
+            if temperature >= point_temperature:
+                speed = point_speed
+
+        return speed
+
+    def segment(self, temperature):
+        for idx in range(len(self.temperatures) - 1):
+            if temperature < self.temperatures[idx + 1]:
+                return idx
+
+        return None
+
+    def linear_speed(self, temperature):
+        idx = self.segment(temperature)
+
+        if idx == None:
+            return self.speeds[-1]
+
+        t0, t1 = self.temperatures[idx], self.temperatures[idx + 1]
+        s0, s1 = self.speeds[idx], self.speeds[idx + 1]
+
+        return s0 + (s1 - s0) * (temperature - t0) / (t1 - t0)
+
+    # Cubic Hermite interpolation using the monotone tangents
+    def spline_speed(self, temperature):
+        idx = self.segment(temperature)
+
+        if idx == None:
+            return self.speeds[-1]
+
+        h = self.temperatures[idx + 1] - self.temperatures[idx]
+        t = (temperature - self.temperatures[idx]) / h
+
+        h00 = 2 * t**3 - 3 * t**2 + 1
+        h10 = t**3 - 2 * t**2 + t
+        h01 = -2 * t**3 + 3 * t**2
+        h11 = t**3 - t**2
+
+        return (h00 * self.speeds[idx] + h10 * h * self.tangents[idx]
+                + h01 * self.speeds[idx + 1] + h11 * h * self.tangents[idx + 1])
+
+def clamp_speed(speed):
+    return max(0, min(100, round(speed)))
+
+# Fritsch-Carlson method: https://en.wikipedia.org/wiki/Monotone_cubic_interpolation
+def monotone_tangents(xs, ys):
+
+    if len(xs) == 1:
+        return [0.0]
+
+    secants = [(ys[k + 1] - ys[k]) / (xs[k + 1] - xs[k]) for k in range(len(xs) - 1)]
+
+    tangents = [secants[0]]
+    for k in range(1, len(xs) - 1):
+
+        # Local extremes must be flat, otherwise the curve overshoots
+        if secants[k - 1] * secants[k] <= 0:
+            tangents.append(0.0)
+        else:
+            tangents.append((secants[k - 1] + secants[k]) / 2)
+
+    tangents.append(secants[-1])
+
+    for k, secant in enumerate(secants):
+
+        if secant == 0:
+            tangents[k] = 0.0
+            tangents[k + 1] = 0.0
+            continue
+
+        a = tangents[k] / secant
+        b = tangents[k + 1] / secant
+
+        if a**2 + b**2 > 9:
+            tau = 3 / math.sqrt(a**2 + b**2)
+            tangents[k] = tau * a * secant
+            tangents[k + 1] = tau * b * secant
+
+    return tangents
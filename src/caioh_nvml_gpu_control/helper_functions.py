@@ -1,194 +1,299 @@
 import pynvml
-import datetime
-import time
 import ctypes
-import sys
+import json
+import threading
+import fan_curve
+import nvml_backend
+import nvml_trace
+import log_writer
+from log_writer import logger, log_helper, error_print
+from cli_help import print_help
+import info_report
+from info_report import output_separator
+import telemetry_ring
+import config_file
+import parse_args
+import device_index
+from device_index import GpuNotFound, pci_bus_id
+import nvml_events
+import control_subroutines
+from control_subroutines import TemperatureThresholds, PowerLimitConstraintsWatts, FanSpeedConstraintsPercentage, DeviceSnapshot, GpuControlState
+from control_subroutines import hold_fan_speed, fan_control_subroutine, power_control_subroutine, temp_control_subroutine
 
 caioh_gpu_control_version = "2.1.4.1"
 
-output_separator = '==============================================='
+# Proxy to the NVML library that counts every call going through it, so we know how many driver round trips each tick takes
+class NvmlCallCounter:
+    def __init__(self, library):
+        self.library = library
+        self.counts = threading.local() # Each thread counts its own calls, so GPUs controlled in parallel (see async_engine.py) keep their own counts
+        self.call_runner = None # Runs the calls somewhere else, e.g. with a deadline (see async_engine.py). None calls them right away
 
-class UnsupportedDriverVersion(Exception):
-    pass
-
-class GpuNotFound(Exception):
-    pass
-
-class TemperatureThresholds:
-    def __init__(self, shutdown_t, slowdown_t, max_memory_t, gpu_max_t, min_acoustic_t, current_acoustic_t, max_acoustic_t):
-        self.shutdown = shutdown_t
-        self.slowdown = slowdown_t
-        self.max_memory = max_memory_t
-        self.gpu_max = gpu_max_t
-        self.min_acoustic = min_acoustic_t
-        self.current_acoustic = current_acoustic_t
-        self.max_acoustic = max_acoustic_t
-
-class PowerLimitConstraintsWatts:
-    def __init__(self, min_pl, max_pl):
-        self.min = min_pl
-        self.max = max_pl
-
-class FanSpeedConstraintsPercentage:
-    def __init__(self, min_s, max_s):
-        self.min = min_s
-        self.max = max_s
-
-def check_driver_version(driver_version_str):
-    major = int(driver_version_str.split('.')[0])
-
-    if major < 555:
-        raise UnsupportedDriverVersion('Driver version is lower than 555')
+    # Calls made by the current thread
+    @property
+    def call_count(self):
+        return getattr(self.counts, 'value', 0)
 
-def log_helper(msg):
-    print(f'LOG[{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}]: {msg}')
+    def __getattr__(self, name):
 
-def error_print(msg):
-    print(f'{msg}', file=sys.stderr)
+        def counted_call(*args):
+            self.counts.value = self.call_count + 1
+            function = getattr(self.library, name)
 
-def print_help():
-    help_text = '''
-python ./nvml_gpu_control.py <ACTION> <OPTIONS>
+            if self.call_runner != None:
+                return self.call_runner(function, args)
 
-ACTIONS
-    help
-          Display help text
+            return function(*args)
 
-    list
-          List all available GPUs connected to the system by printing its name and UUID
+        # Cache the wrapper, so the next calls skip __getattr__ (the library function is still looked up on every call, so patching it or switching the backend keeps working)
+        self.__dict__[name] = counted_call
+        return counted_call
 
-    control
-         Allows the use of all controls in a single command/loop. Each setting is enabled by configuring its respective option: fan curve, power and temperature
+# All NVML calls from this package should go through here (see nvml_backend.py)
+nvml = NvmlCallCounter(nvml_backend.PynvmlBackend())
 
-    fan-info
-          Shows information about fan speed
+# Time source of the control loop, the simulated backend brings its own
+clock = nvml_backend.SystemClock()
 
-    fan-policy <--auto|--manual>
-          Changes the fan control policy to automatic (vBIOS controlled) or manual. Note that when the fan speed is changed, the NVML library automatically changes this setting to manual. This setting is useful to change the GPU back to its original state
+# Finds the devices of the GPU selectors, a new one for each backend (see device_index.py)
+device_resolver = device_index.DeviceIndex(nvml)
 
-    fan-policy-info
-          Shows information about the current fan policy
+def set_backend(backend, backend_clock, device_cache_path=''):
+    global clock, device_resolver
+    nvml.library = backend
+    clock = backend_clock
+    device_resolver = device_index.DeviceIndex(nvml, device_cache_path)
 
-    power-limit-info
-          Shows information about the power limit of the selected GPU
+# Each process must select it (the worker included), before nvmlInit
+def select_backend(configuration):
 
-    thresholds-info
-          Shows information about temperature thresholds in dregrees Celsius of the selected GPU.
+    backend = nvml_backend.PynvmlBackend()
+    backend_clock = nvml_backend.SystemClock()
 
-OPTIONS
+    if configuration.simulated_gpus > 0:
+        backend = nvml_backend.SimulatedBackend(configuration.simulated_gpus)
+        backend_clock = backend.clock
 
-    --name OR -n <GPU_NAME>
-          Select a target GPU by its name. Example: --name "NVIDIA GeForce RTX 4080". Note: UUID has preference over name
+    if configuration.trace_nvml == True:
+        backend = nvml_trace.TracingBackend(backend)
 
-    --uuid OR -id <GPU_UUID>
-          Select a target GPU by its Universally Unique IDentifier (UUID). Example: --uuid "GPU-00000000-0000-0000-0000-000000000000". Note: UUID has preference over name
+    set_backend(backend, backend_clock, configuration.device_cache_path)
 
-    --time-interval OR -ti <TIME_SECONDS>
-          Time period in seconds to wait before probing the GPU again. Works for all actions that run in a loop
+# Only does something when --trace-nvml is used
+def print_nvml_trace():
 
-    --retry-interval OR -ri <TIME_SECONDS>
-          Time period in seconds to wait before trying to issue commands to the GPU again. Works for all actions that run in a loop
+    if isinstance(nvml.library, nvml_trace.TracingBackend):
+        log_helper(nvml.library.report())
 
-    --dry-run OR -dr
-          Run the program, but don't change/set anything. Useful for testing the behavior of the program
-
-    --speed-pair OR -sp <TEMP_CELSIUS:SPEED_PERCENTAGE,TEMP_CELSIUS:SPEED_PERCENTAGE...>
-          A comma separated list of pairs of temperature in celsius and the fan speed in % (temp:speed) defining basic settings for a fan curve
-
-    --default-speed OR -ds <FAN_SPEED_PERCENTAGE>
-          Set a default speed for when there is no match for the fan curve settings
-
-    --manual
-          Sets the fan policy to manual
-
-    --auto
-          Sets the fan policy to automatic (vBIOS controlled)
-
-    --power-limit OR -pl <POWER_LIMIT_WATTS>
-          Sets the power limit of the GPU in watts
+class UnsupportedDriverVersion(Exception):
+    pass
 
-    --acoustic-temp-limit OR -tl <TEMPERATURE_CELSIUS>
-          Sets the acoustic threshold in celsious (note that this is the same temperature limit used by GeForce Experience)
+class DuplicateDevice(Exception):
+    pass
 
-    --single-use OR -su
-          Makes some actions work only once instead of in a loop
+# Device properties that never change while the driver is loaded, so they are only queried once per device
+class DevicePropertyCache:
+
+    # Errors meaning that the device or the driver went away, so the cached values can't be trusted anymore
+    invalidating_errors = (
+        pynvml.NVMLError_GpuIsLost,
+        pynvml.NVMLError_DriverNotLoaded,
+        pynvml.NVMLError_Uninitialized,
+        pynvml.NVMLError_ResetRequired,
+        pynvml.NVMLError_LibRmVersionMismatch,
+        pynvml.NVMLError_NotFound,
+    )
+
+    def __init__(self):
+        self.values = {}
+        self.unsupported = set() # Queries the device doesn't support, which are not asked again
+
+    def get(self, property_name, query_function, *args):
+        if property_name not in self.values:
+            self.values[property_name] = query_function(*args)
+
+        return self.values[property_name]
+
+    # Returns None when the device doesn't support the query, also for the next calls. The value itself is not cached
+    def optional(self, query_name, query_function, *args):
+        if query_name in self.unsupported:
+            return None
+
+        try:
+            return query_function(*args)
+        except pynvml.NVMLError_NotSupported:
+            self.unsupported.add(query_name)
+            return None
+
+    def invalidate(self):
+        self.values.clear()
+        self.unsupported.clear()
+
+    # Returns True when the cache was dropped
+    def invalidate_on_error(self, error):
+        if isinstance(error, DevicePropertyCache.invalidating_errors):
+            self.invalidate()
+            return True
+
+        return False
+
+# A GPU driven by the control loop. Each one keeps its own settings and state, so a fault in one device doesn't affect the others
+class ControlledGpu(GpuControlState):
+    def __init__(self, gpu_config):
+        super().__init__(gpu_config)
+        self.device = None # Identifiers of the device (see device_index.DeviceIndex.describe), only known once something needed them
+        self.uuid = None # UUID of the attached device, so two selectors can't drive the same one
+        self.retry_time = 0.0 # time.monotonic() value after which a failed device is probed again
+        self.last_error = None
+        self.properties = DevicePropertyCache()
+        self.device_errors = 0
+        self.field_values_supported = True # Some drivers don't support the power fields, so we fall back to one call per value
+        self.fan_policy = None # Last fan policy read (only with --socket, see read_fan_policy)
+        self.fan_policy_writes = None # fan_writes_issued when the fan policy was read, None to read it on the next tick
+        self.fan_policy_time = 0.0 # time.monotonic() value of when the fan policy was read
+        self.nvml_calls_last_tick = 0
+
+# Writes the settings chosen by the control subroutines (see control_subroutines.py)
+class NvmlSettingsWriter(control_subroutines.SettingsWriter):
+
+    def set_fan_speed(self, gpu_handle, speed_percentage, dry_run, fan_count):
+        set_gpu_fan_speed(gpu_handle, speed_percentage, dry_run, fan_count)
+
+    def set_power_limit(self, gpu_handle, power_limit_watts, dry_run):
+        set_power_limit(gpu_handle, power_limit_watts, dry_run)
+
+    def set_acoustic_threshold(self, gpu_handle, temperature_C, dry_run):
+        set_temperature_thresholds(gpu_handle, pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_CURR, temperature_C, dry_run)
+
+control_subroutines.settings_writer = NvmlSettingsWriter()
 
-    --verbose OR -V
-          When there are no settings changes, leg messages are omitted by default. This option enables them back (good for debugging)
+def check_driver_version(driver_version_str):
+    major = int(driver_version_str.split('.')[0])
 
-    --retry OR -rt
-          By default the program closes when it encounters an error, but this lets the program try to recover. It could be useful to let the service manager restart the process
+    if major < 555:
+        raise UnsupportedDriverVersion('Driver version is lower than 555')
 
-'''
-    print(help_text)
+# The control worker writes on a background thread and rate limits repeated messages, the other processes write right away
+def configure_logging(configuration, asynchronous=False):
+    logger.configure(configuration.log_format, asynchronous, asynchronous)
 
 def list_gpus():
-    deviceCount = pynvml.nvmlDeviceGetCount()
+    deviceCount = nvml.nvmlDeviceGetCount()
 
     for i in range(deviceCount):
-        handle = pynvml.nvmlDeviceGetHandleByIndex(i)
-        print(f'Device {i} name : {pynvml.nvmlDeviceGetName(handle)} - UUID: {pynvml.nvmlDeviceGetUUID(handle)}')
-
-def print_GPU_info(gpu_handle):
+        handle = nvml.nvmlDeviceGetHandleByIndex(i)
+        print(f'Device {i} name : {nvml.nvmlDeviceGetName(handle)} - UUID: {nvml.nvmlDeviceGetUUID(handle)}')
+
+# Returns None when the value can't be read, so a device that doesn't support something is still listed
+def inventory_query(query_function, *args):
+
+    try:
+        return query_function(*args)
+    except pynvml.NVMLError:
+        return None
+
+def device_inventory(index):
+    device = {
+        'index': index,
+        'name': None,
+        'uuid': None,
+        'pci_bus_id': None,
+        'serial': None,
+        'fan_count': None,
+        'fan_policy': None,
+        'power_limit_constraints': None,
+        'power_limit': None,
+        'enforced_power_limit': None,
+        'acoustic_thresholds': None,
+    }
+
+    gpu_handle = inventory_query(nvml.nvmlDeviceGetHandleByIndex, index)
+
+    if gpu_handle == None:
+        return device
+
+    device['name'] = inventory_query(nvml.nvmlDeviceGetName, gpu_handle)
+    device['uuid'] = inventory_query(nvml.nvmlDeviceGetUUID, gpu_handle)
+    device['pci_bus_id'] = pci_bus_id(inventory_query(nvml.nvmlDeviceGetPciInfo, gpu_handle))
+    device['serial'] = inventory_query(nvml.nvmlDeviceGetSerial, gpu_handle)
+    device['fan_count'] = inventory_query(nvml.nvmlDeviceGetNumFans, gpu_handle)
+
+    fan_policy = inventory_query(get_fan_policy, gpu_handle)
+    if fan_policy != None:
+        device['fan_policy'] = fan_policy_info_msg(fan_policy)
+
+    constraints = inventory_query(get_power_limit_constraints_watts, gpu_handle)
+    if constraints != None:
+        device['power_limit_constraints'] = {'min': constraints.min, 'max': constraints.max}
+
+    device['power_limit'] = inventory_query(get_current_power_limit_watts, gpu_handle)
+    device['enforced_power_limit'] = inventory_query(get_enforced_power_limit_watts, gpu_handle)
+
+    # Each threshold on its own, some drivers only support a few of them
+    device['acoustic_thresholds'] = {
+        'current': inventory_query(nvml.nvmlDeviceGetTemperatureThreshold, gpu_handle, pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_CURR),
+        'min': inventory_query(nvml.nvmlDeviceGetTemperatureThreshold, gpu_handle, pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_MIN),
+        'max': inventory_query(nvml.nvmlDeviceGetTemperatureThreshold, gpu_handle, pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_MAX),
+    }
+
+    return device
+
+# Every device with all of its details from a single NVML session, for inventory tools (list --json)
+def gpu_inventory():
+    return {
+        'version': caioh_gpu_control_version,
+        'driver_version': inventory_query(nvml.nvmlSystemGetDriverVersion),
+        'nvml_version': inventory_query(nvml.nvmlSystemGetNVMLVersion),
+        'gpus': [device_inventory(index) for index in range(nvml.nvmlDeviceGetCount())],
+    }
+
+def print_gpu_inventory():
+    print(json.dumps(gpu_inventory(), indent=4, ensure_ascii=False))
+
+def print_system_info():
     log_helper(f"CaioH NVML GPU Control Version : {caioh_gpu_control_version}")
-    log_helper(f"Driver Version : {pynvml.nvmlSystemGetDriverVersion()}")
-    log_helper(f"NVML Version : {pynvml.nvmlSystemGetNVMLVersion ()}")
-    log_helper(f'Device name : {pynvml.nvmlDeviceGetName(gpu_handle)}')
-    log_helper(f'Device UUID : {pynvml.nvmlDeviceGetUUID(gpu_handle)}')
-    log_helper(f'Device fan speed : {pynvml.nvmlDeviceGetFanSpeed(gpu_handle)}%')
-    log_helper(f'Fan policy : {fan_policy_info_msg( get_fan_policy(gpu_handle) )}')
-    log_helper(f"Fan controller count : {pynvml.nvmlDeviceGetNumFans(gpu_handle)}")
-    log_helper(f'Current temperature : {pynvml.nvmlDeviceGetTemperatureV(gpu_handle, pynvml.NVML_TEMPERATURE_GPU)}°C')
+    log_helper(f"Driver Version : {nvml.nvmlSystemGetDriverVersion()}")
+    log_helper(f"NVML Version : {nvml.nvmlSystemGetNVMLVersion ()}")
+
+# The label keeps the lines of identical GPUs apart, so the rate limit of the log doesn't take them for repeated messages
+def print_GPU_info(gpu_handle, label):
+    log_helper(f'{label}: Device name : {nvml.nvmlDeviceGetName(gpu_handle)}')
+    log_helper(f'{label}: Device UUID : {nvml.nvmlDeviceGetUUID(gpu_handle)}')
+    log_helper(f'{label}: Device fan speed : {nvml.nvmlDeviceGetFanSpeed(gpu_handle)}%')
+    log_helper(f'{label}: Fan policy : {fan_policy_info_msg( get_fan_policy(gpu_handle) )}')
+    log_helper(f"{label}: Fan controller count : {nvml.nvmlDeviceGetNumFans(gpu_handle)}")
+    log_helper(f'{label}: Current temperature : {nvml.nvmlDeviceGetTemperatureV(gpu_handle, pynvml.NVML_TEMPERATURE_GPU)}°C')
     #log_helper(f'Temperature limit : {get_temperarure_thresholds(gpu_handle).current_acoustic}°C') # Removed for now. It returns NOT_SUPPORTED on some Linux machines
-    log_helper(f'Power limit : {get_current_power_limit_watts(gpu_handle)}W')
-    log_helper(f'Enforced power limit : {get_enforced_power_limit_watts(gpu_handle)}W')
+    log_helper(f'{label}: Power limit : {get_current_power_limit_watts(gpu_handle)}W')
+    log_helper(f'{label}: Enforced power limit : {get_enforced_power_limit_watts(gpu_handle)}W')
 
 
 # Search for a GPU and return a handle
+def get_GPU_handle(gpu_config):
+    return device_resolver.resolve(gpu_config)[0]
 
-def get_GPU_handle(gpu_name, gpu_uuid):
-    
-    if gpu_uuid != '':
-        return pynvml.nvmlDeviceGetHandleByUUID(gpu_uuid)
-
-    else:
-        return get_GPU_handle_by_name(gpu_name)
-
-
-# This will NOT work if the user has more than 2 GPUs with the same name/model, use UUID for this case
-def get_GPU_handle_by_name(gpu_name):
-    deviceCount = pynvml.nvmlDeviceGetCount()
-
-    for i in range(deviceCount):
-        handle = pynvml.nvmlDeviceGetHandleByIndex(i)
-
-        if pynvml.nvmlDeviceGetName(handle) == gpu_name:
-            return handle
-
-    print(f'It was not possible to locate the target device : {gpu_name}')
-    raise GpuNotFound('It was not possible to locate the device')
-
-def set_gpu_fan_speed(gpu_handle, speed_percentage, dry_run):
+def set_gpu_fan_speed(gpu_handle, speed_percentage, dry_run, fan_count=None):
 
     # This is not really the number of fan, but the number of controllers
-    fan_count = pynvml.nvmlDeviceGetNumFans(gpu_handle)
+    if fan_count == None:
+        fan_count = nvml.nvmlDeviceGetNumFans(gpu_handle)
 
     for fan_idx in range(fan_count):
-        fan_speed = pynvml.nvmlDeviceGetFanSpeed_v2(gpu_handle, fan_idx)
 
         # Setting the fan speed DANGEROUS! Use dry run for testing before actual changes
         if dry_run != True:
-            pynvml.nvmlDeviceSetFanSpeed_v2(gpu_handle, fan_idx, speed_percentage)
+            nvml.nvmlDeviceSetFanSpeed_v2(gpu_handle, fan_idx, speed_percentage)
 
-def get_gpu_fan_speed_per_controller(gpu_handle):
+def get_gpu_fan_speed_per_controller(gpu_handle, fan_count=None):
 
     fan_speed_per_controller = []
 
     # This is not really the number of fan, but the number of controllers
-    fan_count = pynvml.nvmlDeviceGetNumFans(gpu_handle)
+    if fan_count == None:
+        fan_count = nvml.nvmlDeviceGetNumFans(gpu_handle)
 
     for fan_idx in range(fan_count):
-        fan_speed_per_controller.append(pynvml.nvmlDeviceGetFanSpeed_v2(gpu_handle, fan_idx))
+        fan_speed_per_controller.append(nvml.nvmlDeviceGetFanSpeed_v2(gpu_handle, fan_idx))
 
     return fan_speed_per_controller
 
@@ -201,71 +306,24 @@ def get_gpu_fan_speed_constraints(gpu_handle):
 
     # Note some drivers do not respect the minimum and may turn off the fan motor in a different speed
     # Some drivers turn off the fan motor at speeds as high as 47%
-    pynvml.nvmlDeviceGetMinMaxFanSpeed(gpu_handle, ctypes.byref(fan_min), ctypes.byref(fan_max))
+    nvml.nvmlDeviceGetMinMaxFanSpeed(gpu_handle, ctypes.byref(fan_min), ctypes.byref(fan_max))
 
     return FanSpeedConstraintsPercentage(fan_min.value, fan_max.value)
 
 def print_fan_info(configuration):
 
-    gpu_handle = get_GPU_handle(configuration.gpu_name, configuration.gpu_uuid)
+    gpu_handle = get_GPU_handle(configuration.gpus[0])
 
-    current_temp = pynvml.nvmlDeviceGetTemperatureV(gpu_handle, pynvml.NVML_TEMPERATURE_GPU)
-    current_speed = pynvml.nvmlDeviceGetFanSpeed(gpu_handle)
+    current_temp = nvml.nvmlDeviceGetTemperatureV(gpu_handle, pynvml.NVML_TEMPERATURE_GPU)
+    current_speed = nvml.nvmlDeviceGetFanSpeed(gpu_handle)
     fan_constraints = get_gpu_fan_speed_constraints(gpu_handle)
 
-    print(f'{output_separator}')
-    print(f'Current temp: {current_temp}°C')
-    print(f'Current speed: {current_speed}%') # Minitor for fan fan speed changes and reajust! 
-
-    # Get the fan speed per controller
-    for idx, fan_speed_c in enumerate(get_gpu_fan_speed_per_controller(gpu_handle)):
-        print(f'Fan controller speed {idx}: {fan_speed_c}%')
-
-    print(f'Fan constraints: Min {fan_constraints.min}% - Max {fan_constraints.max}%')
-    print(f'{output_separator}')
-
-# Control GPU functions and monitor for changes (e.g. temperature)
-def fan_control_subroutine(gpu_handle, configuration):
-
-    current_temp = pynvml.nvmlDeviceGetTemperatureV(gpu_handle, pynvml.NVML_TEMPERATURE_GPU)
-    current_speed = pynvml.nvmlDeviceGetFanSpeed(gpu_handle)
-
-    # Assume at first that it did change
-    setting_changed = True
-
-    log_msg = []
-
-    log_msg.append(f'Current temp: {current_temp}°C')
-    log_msg.append(f'Current speed: {current_speed}%') # Monitor for fan fan speed changes and reajust! 
-
-    # Get the fan speed per controller
-    for idx, fan_speed_c in enumerate(get_gpu_fan_speed_per_controller(gpu_handle)):
-        log_msg.append(f'Fan controller speed {idx}: {fan_speed_c}%')
-
-    for pair in configuration.temp_speed_pair:
-
-        # Remember that that list starts by the highest temp value and keeps lowering it
-        if current_temp >= pair.temperature:
-
-            # Only send commands to the GPU if necessary (if the current setting is different from the targeted one)
-            if current_speed != pair.speed:
-                set_gpu_fan_speed(gpu_handle, pair.speed, configuration.dry_run)
-                log_msg.append(f'Setting GPU fan speed: {pair.speed}%')
-                setting_changed = True # Setting it again for safety
-            else:
-                log_msg.append(f'Same as previous speed, nothing to do!')
-                setting_changed = False
-
-            # Only print log messages when necessary to avoid taking too much disk space
-            if configuration.verbose == True or setting_changed == True:
-                log_helper("\n" + "\n".join(log_msg) + "\n")
-
-            # Match found and set, return now
-            return
-
-    # We didn't find a match, use the default speed
-    set_gpu_fan_speed(gpu_handle, configuration.default_speed, configuration.dry_run)
-    log_helper(f'Found no temperature match, using default fan speed: {configuration.default_speed}')
+    info_report.print_fan_info({
+        'temperature': current_temp,
+        'fan_speed': current_speed,
+        'fan_speeds': get_gpu_fan_speed_per_controller(gpu_handle),
+        'fan_constraints': [fan_constraints.min, fan_constraints.max],
+    })
 
 def fan_policy_info_msg(fan_policy: int):
 
@@ -281,37 +339,35 @@ def fan_policy_info_msg(fan_policy: int):
 def set_fan_policy(gpu_handle, policy, dry_run):
 
     # This is not really the number of fan, but the number of controllers
-    fan_count = pynvml.nvmlDeviceGetNumFans(gpu_handle)
+    fan_count = nvml.nvmlDeviceGetNumFans(gpu_handle)
 
     for fan_idx in range(fan_count):
 
         # Setting the fan control policy can be DANGEROUS! Use dry run for testing before actual changes
         if dry_run != True:
-            fan_speed = pynvml.nvmlDeviceSetFanControlPolicy(gpu_handle, fan_idx, policy)
+            fan_speed = nvml.nvmlDeviceSetFanControlPolicy(gpu_handle, fan_idx, policy)
 
             # Also set the default fan speed for extra safety (automatic only)
             if policy == pynvml.NVML_FAN_POLICY_TEMPERATURE_CONTINOUS_SW:
-                pynvml.nvmlDeviceSetDefaultFanSpeed_v2(gpu_handle, fan_idx)
+                nvml.nvmlDeviceSetDefaultFanSpeed_v2(gpu_handle, fan_idx)
 
 def get_fan_policy(gpu_handle):
     current_policy = ctypes.c_uint(0)
 
     # The library unfortunately still needs pointers, this is why I need to use ctypes
-    pynvml.nvmlDeviceGetFanControlPolicy_v2(gpu_handle, 0, ctypes.byref(current_policy))
+    nvml.nvmlDeviceGetFanControlPolicy_v2(gpu_handle, 0, ctypes.byref(current_policy))
 
     return current_policy.value
 
 
 def print_fan_policy_info(configuration):
-    gpu_handle = get_GPU_handle(configuration.gpu_name, configuration.gpu_uuid)
-    print(f'{output_separator}')
-    print(f'Current fan policy is: {fan_policy_info_msg( get_fan_policy(gpu_handle) )}')
-    print(f'{output_separator}')
+    gpu_handle = get_GPU_handle(configuration.gpus[0])
+    info_report.print_fan_policy_info({'fan_policy': fan_policy_info_msg( get_fan_policy(gpu_handle) )})
 
 def fan_policy(configuration):
 
     target_fan_policy = configuration.fan_policy
-    gpu_handle = get_GPU_handle(configuration.gpu_name, configuration.gpu_uuid)
+    gpu_handle = get_GPU_handle(configuration.gpus[0])
 
     # Get the current policy before setting anything
     print(f'Current fan policy is: {fan_policy_info_msg( get_fan_policy(gpu_handle) )}')
@@ -336,94 +392,71 @@ def set_power_limit(gpu_handle, power_limit_watts, dry_run):
 
     # Setting the power limit can be DANGEROUS! Use dry run for testing before actual changes
     if dry_run != True:
-        pynvml.nvmlDeviceSetPowerManagementLimit(gpu_handle, int(power_limit_watts * 1000))
+        nvml.nvmlDeviceSetPowerManagementLimit(gpu_handle, int(power_limit_watts * 1000))
 
 # Current power limit defined by the user, but it might defer from the enforced one
 def get_current_power_limit_watts(gpu_handle):
-    return int(pynvml.nvmlDeviceGetPowerManagementLimit(gpu_handle) / 1000)
+    return int(nvml.nvmlDeviceGetPowerManagementLimit(gpu_handle) / 1000)
 
 # This one takes the constraints into account
 def get_enforced_power_limit_watts(gpu_handle):
-    return int(pynvml.nvmlDeviceGetEnforcedPowerLimit(gpu_handle) / 1000)
+    return int(nvml.nvmlDeviceGetEnforcedPowerLimit(gpu_handle) / 1000)
 
 def get_power_limit_constraints_watts(gpu_handle):
-    constraints_array = pynvml.nvmlDeviceGetPowerManagementLimitConstraints(gpu_handle)
+    constraints_array = nvml.nvmlDeviceGetPowerManagementLimitConstraints(gpu_handle)
     min = int(constraints_array[0] / 1000)
     max = int(constraints_array[1] / 1000)
 
     return PowerLimitConstraintsWatts(min, max)
 
 def print_power_limit_info(configuration):
-    gpu_handle = get_GPU_handle(configuration.gpu_name, configuration.gpu_uuid)
+    gpu_handle = get_GPU_handle(configuration.gpus[0])
 
     constraints = get_power_limit_constraints_watts(gpu_handle)
     current_pl = get_current_power_limit_watts(gpu_handle)
     current_enforced_pl = get_enforced_power_limit_watts(gpu_handle)
 
-    print(f'{output_separator}')
-    print(f'Power limit constraints\nMin: {constraints.min}W - Max: {constraints.max}W\n')
-    print(f'Current power limit: {current_pl}W\n')
-    print(f'Current enforced power limit: {current_enforced_pl}W\n')
-    print(f'{output_separator}')
-
-def power_control_subroutine(gpu_handle, target_power_limit, dry_run, verbose):
-    power_limit_constraints_watts = get_power_limit_constraints_watts(gpu_handle)
-    current_pl = get_current_power_limit_watts(gpu_handle)
-    current_enforced_pl = get_enforced_power_limit_watts(gpu_handle)
-
-    setting_changed = True
-    log_msg = []
-
-    log_msg.append(f'Current power limit: {current_pl}W')
-    log_msg.append(f'Current enforced power limit: {current_enforced_pl}W')
-
-    if target_power_limit < power_limit_constraints_watts.min or target_power_limit > power_limit_constraints_watts.max:
-        log_msg.append(f'WARNING: trying to set power limit outside of the min({power_limit_constraints_watts.min}W) and max({power_limit_constraints_watts.max}W) range')
-
-    if target_power_limit != current_pl or target_power_limit != current_enforced_pl:
-        set_power_limit(gpu_handle, target_power_limit, dry_run)
-        log_msg.append(f'Setting the power limit: {target_power_limit}W')
-        setting_changed = True
-
-    else:
-        log_msg.append(f'Nothing to do, current and enforced power limit is the same as the target')
-        setting_changed = False
-
-    # Only print log messages when necessary to avoid taking too much disk space
-    if verbose == True or setting_changed == True:
-        log_helper("\n" + "\n".join(log_msg) + "\n")
+    info_report.print_power_limit_info({
+        'power_limit_constraints': [constraints.min, constraints.max],
+        'power_limit': current_pl,
+        'enforced_power_limit': current_enforced_pl,
+    })
 
 # Temperature control
 
 # nvmlDeviceGetTemperatureThreshold is deprecated for some thresholds, use nvmlDeviceGetFieldValues insted
 # https://docs.nvidia.com/deploy/nvml-api/group__nvmlDeviceQueries.html#group__nvmlDeviceQueries_1g271ba78911494f33fc079b204a929405
-def get_temperarure_thresholds(gpu_handle):
+def get_temperarure_thresholds(gpu_handle, property_cache=None):
     # Info from nvidia-settings: T.Limit temperature after which GPU may shut down for HW protection
-    #shutdown_threshold = pynvml.nvmlDeviceGetFieldValues(gpu_handle, [pynvml.NVML_FI_DEV_TEMPERATURE_SHUTDOWN_TLIMIT])[0].value.siVal
+    #shutdown_threshold = nvml.nvmlDeviceGetFieldValues(gpu_handle, [pynvml.NVML_FI_DEV_TEMPERATURE_SHUTDOWN_TLIMIT])[0].value.siVal
     shutdown_threshold = 0
 
     # Info from nvidia-settings: T.Limit temperature after which GPU may begin HW slowdown
-    #slowdown_threshold = pynvml.nvmlDeviceGetFieldValues(gpu_handle, [pynvml.NVML_FI_DEV_TEMPERATURE_SLOWDOWN_TLIMIT])[0].value.siVal
+    #slowdown_threshold = nvml.nvmlDeviceGetFieldValues(gpu_handle, [pynvml.NVML_FI_DEV_TEMPERATURE_SLOWDOWN_TLIMIT])[0].value.siVal
     slowdown_threshold = 0
 
     # Info from nvidia-settings: T.Limit temperature after which GPU may begin SW slowdown due to memory temperature
-    #max_memory_threshold = pynvml.nvmlDeviceGetFieldValues(gpu_handle, [pynvml.NVML_FI_DEV_TEMPERATURE_MEM_MAX_TLIMIT])[0].value.siVal
+    #max_memory_threshold = nvml.nvmlDeviceGetFieldValues(gpu_handle, [pynvml.NVML_FI_DEV_TEMPERATURE_MEM_MAX_TLIMIT])[0].value.siVal
     max_memory_threshold = 0
 
     # Info from nvidia-settings: T.Limit temperature after which GPU may be throttled below base clock
-    #gpu_max_threshold = pynvml.nvmlDeviceGetFieldValues(gpu_handle, [pynvml.NVML_FI_DEV_TEMPERATURE_GPU_MAX_TLIMIT])[0].value.siVal
+    #gpu_max_threshold = nvml.nvmlDeviceGetFieldValues(gpu_handle, [pynvml.NVML_FI_DEV_TEMPERATURE_GPU_MAX_TLIMIT])[0].value.siVal
     gpu_max_threshold =0
 
     # The acoustic settings is the same used by GeForce Experience
     # Info from nvidia-settings: Current temperature that is set as acoustic threshold.
-    current_acoustic_threshold = pynvml.nvmlDeviceGetTemperatureThreshold(gpu_handle, pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_CURR)
+    current_acoustic_threshold = nvml.nvmlDeviceGetTemperatureThreshold(gpu_handle, pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_CURR)
     
+    # The acoustic range never changes, so it can come from the cache
+    if property_cache == None:
+        property_cache = DevicePropertyCache()
+
     # These thresholds still use the old function
     # Info from nvidia-settings: Minimum GPU Temperature that can be set as acoustic threshold
-    min_acoustic_threshold = pynvml.nvmlDeviceGetTemperatureThreshold(gpu_handle, pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_MIN)
+    min_acoustic_threshold = property_cache.get('min_acoustic_threshold', nvml.nvmlDeviceGetTemperatureThreshold, gpu_handle, pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_MIN)
 
     # Info from nvidia-settings: Maximum GPU temperature that can be set as acoustic threshold.
-    max_acoustic_threshold = pynvml.nvmlDeviceGetTemperatureThreshold(gpu_handle, pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_MAX)
+    max_acoustic_threshold = property_cache.get('max_acoustic_threshold', nvml.nvmlDeviceGetTemperatureThreshold, gpu_handle, pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_MAX)
 
     return TemperatureThresholds(shutdown_threshold, slowdown_threshold, max_memory_threshold, gpu_max_threshold, min_acoustic_threshold, current_acoustic_threshold, max_acoustic_threshold)
 
@@ -438,70 +471,674 @@ def get_temperarure_thresholds(gpu_handle):
 def set_temperature_thresholds(gpu_handle, threshold_type, temperature_C, dry_run):
 
     if dry_run != True:
-        pynvml.nvmlDeviceSetTemperatureThreshold(gpu_handle, threshold_type, temperature_C)
+        nvml.nvmlDeviceSetTemperatureThreshold(gpu_handle, threshold_type, temperature_C)
 
 def print_thresholds_info(configuration):
 
-    gpu_handle = get_GPU_handle(configuration.gpu_name, configuration.gpu_uuid)
+    gpu_handle = get_GPU_handle(configuration.gpus[0])
 
     temperarure_thresholds = get_temperarure_thresholds(gpu_handle)
 
-    print(f'{output_separator}')
     #print(f'Temperature threshold - shutdown: {temperarure_thresholds.shutdown}°C')
     #print(f'Temperature threshold - slowdown: {temperarure_thresholds.slowdown}°C')
     #print(f'Temperature threshold - max memory temperature: {temperarure_thresholds.max_memory}°C')
     #print(f'Temperature threshold - ignore base clock: {temperarure_thresholds.gpu_max}°C')
-    print(f'Temperature threshold - current acoustic: {temperarure_thresholds.current_acoustic}°C')
-    print(f'Temperature threshold - minimum acoustic: {temperarure_thresholds.min_acoustic}°C')
-    print(f'Temperature threshold - maximum acoustic: {temperarure_thresholds.max_acoustic}°C')
-    print(f'{output_separator}')
+    info_report.print_thresholds_info({
+        'acoustic_thresholds': [temperarure_thresholds.current_acoustic, temperarure_thresholds.min_acoustic, temperarure_thresholds.max_acoustic],
+    })
+
+# Power limits in mW. Requested is the limit set by the user and current is the one being enforced
+# The constraints are not here, since they never change (see DevicePropertyCache)
+power_limit_field_ids = [
+    pynvml.NVML_FI_DEV_POWER_REQUESTED_LIMIT,
+    pynvml.NVML_FI_DEV_POWER_CURRENT_LIMIT,
+]
+
+# The power usage comes for free in the same call, but older drivers don't have it
+power_usage_field_id = pynvml.NVML_FI_DEV_POWER_INSTANT
+
+def field_value_number(field_value):
+
+    match field_value.valueType:
+        case pynvml.NVML_VALUE_TYPE_DOUBLE:
+            return field_value.value.dVal
+        case pynvml.NVML_VALUE_TYPE_UNSIGNED_INT:
+            return field_value.value.uiVal
+        case pynvml.NVML_VALUE_TYPE_UNSIGNED_LONG:
+            return field_value.value.ulVal
+        case pynvml.NVML_VALUE_TYPE_UNSIGNED_LONG_LONG:
+            return field_value.value.ullVal
+        case pynvml.NVML_VALUE_TYPE_SIGNED_LONG_LONG:
+            return field_value.value.sllVal
+        case pynvml.NVML_VALUE_TYPE_SIGNED_INT:
+            return field_value.value.siVal
+        case _:
+            return field_value.value.usVal
+
+# Returns the values in milliwatts using a single NVML call or None if the driver doesn't support it
+# Each field fails on its own, so a field the driver doesn't have is None and the others are still used
+def get_power_field_values_mw(gpu_handle, field_ids):
+
+    try:
+        field_values = nvml.nvmlDeviceGetFieldValues(gpu_handle, field_ids)
+
+    except (pynvml.NVMLError_NotSupported, pynvml.NVMLError_FunctionNotFound):
+        return None
+
+    return [field_value_number(field_value) if field_value.nvmlReturn == pynvml.NVML_SUCCESS else None for field_value in field_values]
+
+# Only the power usage is needed by the adaptive polling (include_limits=False)
+def collect_power_snapshot(controlled_gpu, snapshot, include_limits=True):
+    gpu_handle = controlled_gpu.handle
+    power_values_mw = None
+
+    field_ids = [power_usage_field_id]
+    if include_limits == True:
+        field_ids = power_limit_field_ids + field_ids
+
+    if controlled_gpu.field_values_supported == True:
+        power_values_mw = get_power_field_values_mw(gpu_handle, field_ids)
+
+        if power_values_mw == None:
+            log_helper(f'{controlled_gpu.label}: Power field values are not supported, using one query per value')
+            controlled_gpu.field_values_supported = False
+
+    if power_values_mw != None and power_values_mw[-1] != None:
+        snapshot.power_usage = power_values_mw[-1] / 1000
+
+    if include_limits != True:
+        return
+
+    if power_values_mw != None and power_values_mw[0] != None and power_values_mw[1] != None:
+        snapshot.current_power_limit = int(power_values_mw[0] / 1000)
+        snapshot.enforced_power_limit = int(power_values_mw[1] / 1000)
 
-def temp_control_subroutine(gpu_handle, target_acoustic_temp_limit, dry_run, verbose):
+    else:
+        snapshot.current_power_limit = get_current_power_limit_watts(gpu_handle)
+        snapshot.enforced_power_limit = get_enforced_power_limit_watts(gpu_handle)
 
-    current_temp_thresholds = get_temperarure_thresholds(gpu_handle)
+    snapshot.power_limit_constraints = controlled_gpu.properties.get('power_limit_constraints', get_power_limit_constraints_watts, gpu_handle)
 
-    setting_changed = True
-    log_msg = []
+# Returns None when the device doesn't support the query
+def optional_query(query_function, *args):
 
-    log_msg.append(f'Current acoustic threshold: {current_temp_thresholds.current_acoustic}°C')
+    try:
+        return query_function(*args)
+    except pynvml.NVMLError_NotSupported:
+        return None
 
-    if target_acoustic_temp_limit < current_temp_thresholds.min_acoustic or target_acoustic_temp_limit > current_temp_thresholds.max_acoustic:
-        log_msg.append(f'WARNING: trying to set acoustic threshold outside of the min({current_temp_thresholds.min_acoustic}°C) and max({current_temp_thresholds.max_acoustic}°C) range')
+# Most fan policy changes come from the fan speed writes of the loop (they switch the fans to manual), so the policy is only read again after
+# one of them. Other programs can also change it, which is noticed within fan_policy_max_age_s
+fan_policy_max_age_s = 60.0
 
-    if target_acoustic_temp_limit != current_temp_thresholds.current_acoustic:
-        set_temperature_thresholds(gpu_handle, pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_CURR, target_acoustic_temp_limit, dry_run)
-        log_msg.append(f'Setting acoustic temperature threshold: {target_acoustic_temp_limit}°C')
-        setting_changed = True
-    
-    else:
-        log_msg.append(f'Nothing to do, current temperature threshold is the same as the target')
-        setting_changed = False
+def read_fan_policy(controlled_gpu):
+    now = clock.monotonic()
+
+    if controlled_gpu.fan_policy_writes != controlled_gpu.fan_writes_issued or now - controlled_gpu.fan_policy_time >= fan_policy_max_age_s:
+        controlled_gpu.fan_policy = controlled_gpu.properties.optional('fan_policy', get_fan_policy, controlled_gpu.handle)
+        controlled_gpu.fan_policy_writes = controlled_gpu.fan_writes_issued
+        controlled_gpu.fan_policy_time = now
+
+    return controlled_gpu.fan_policy
+
+# Query the device only once per tick and only for what the enabled subroutines use
+def collect_device_snapshot(controlled_gpu, configuration):
+    gpu_handle = controlled_gpu.handle
+    gpu_config = controlled_gpu.config
+    calls_before = nvml.call_count
+
+    snapshot = DeviceSnapshot()
+    snapshot.time = clock.monotonic()
+
+    # The record file (--record) keeps the whole history and the info socket (--socket) answers the info actions, so everything is sampled
+    serve_info = configuration.socket_path != ''
+    record_all = configuration.record_path != '' or serve_info == True
+
+    if gpu_config.power_limit != 0 or record_all == True:
+        collect_power_snapshot(controlled_gpu, snapshot)
+
+    # The adaptive polling also follows the power usage
+    elif configuration.adaptive_interval == True:
+        collect_power_snapshot(controlled_gpu, snapshot, include_limits=False)
+
+    if gpu_config.acoustic_temp_limit != 0:
+        snapshot.temperature_thresholds = get_temperarure_thresholds(gpu_handle, controlled_gpu.properties)
+
+    # Devices that don't support these are still controlled, the info action just asks the driver instead
+    elif serve_info == True:
+        snapshot.temperature_thresholds = controlled_gpu.properties.optional('temperature_thresholds', get_temperarure_thresholds, gpu_handle, controlled_gpu.properties)
+
+    if serve_info == True:
+        snapshot.name = controlled_gpu.properties.get('name', nvml.nvmlDeviceGetName, gpu_handle)
+        snapshot.uuid = controlled_gpu.properties.get('uuid', nvml.nvmlDeviceGetUUID, gpu_handle)
+        snapshot.fan_constraints = controlled_gpu.properties.get('fan_constraints', optional_query, get_gpu_fan_speed_constraints, gpu_handle)
+        snapshot.fan_policy = read_fan_policy(controlled_gpu)
+
+        # The info actions can select the device in other ways than the control loop (e.g. by its PCI bus ID)
+        if controlled_gpu.device == None:
+            controlled_gpu.device = device_resolver.describe(gpu_handle)
+
+    if len(gpu_config.temp_speed_pair) != 0 or record_all == True:
+        # This is not really the number of fan, but the number of controllers
+        fan_count = controlled_gpu.properties.get('fan_count', nvml.nvmlDeviceGetNumFans, gpu_handle)
+
+        snapshot.temperature = nvml.nvmlDeviceGetTemperatureV(gpu_handle, pynvml.NVML_TEMPERATURE_GPU)
+        snapshot.fan_speeds = get_gpu_fan_speed_per_controller(gpu_handle, fan_count)
+
+        # nvmlDeviceGetFanSpeed is the same as asking for the first controller
+        if len(snapshot.fan_speeds) != 0:
+            snapshot.fan_speed = snapshot.fan_speeds[0]
+        else:
+            snapshot.fan_speed = nvml.nvmlDeviceGetFanSpeed(gpu_handle)
+
+    # The adaptive polling follows the temperature even when the fan control is disabled
+    elif configuration.adaptive_interval == True:
+        snapshot.temperature = nvml.nvmlDeviceGetTemperatureV(gpu_handle, pynvml.NVML_TEMPERATURE_GPU)
+
+    snapshot.nvml_calls = nvml.call_count - calls_before
+    return snapshot
+
+# Resolve the device handle, so the control loop can start (or resume) sending commands
+def attach_gpu(controlled_gpu):
+    controlled_gpu.handle, controlled_gpu.device = device_resolver.resolve(controlled_gpu.config)
+    controlled_gpu.uuid = controlled_gpu.device['uuid'] if controlled_gpu.device != None else controlled_gpu.config.gpu_uuid
+    controlled_gpu.fan_policy_writes = None
+    controlled_gpu.last_error = None
+    print_GPU_info(controlled_gpu.handle, controlled_gpu.label)
+
+def control_gpu(controlled_gpu, configuration):
+    gpu_config = controlled_gpu.config
+    calls_before = nvml.call_count
+
+    controlled_gpu.snapshot = collect_device_snapshot(controlled_gpu, configuration)
+
+    # The user has enabled it with an option to take effect
+    if gpu_config.power_limit != 0:
+        power_control_subroutine(controlled_gpu, configuration)
+
+    # The user has enabled it with an option to take effect
+    if gpu_config.acoustic_temp_limit != 0:
+        temp_control_subroutine(controlled_gpu, configuration)
+
+    # The user has enabled it with an option to take effect
+    if len(gpu_config.temp_speed_pair) != 0:
+        fan_control_subroutine(controlled_gpu, configuration)
+
+    controlled_gpu.nvml_calls_last_tick = nvml.call_count - calls_before
+
+    if configuration.verbose == True:
+        log_helper('{}: NVML calls this tick: {} ({} for the snapshot)', controlled_gpu.label, controlled_gpu.nvml_calls_last_tick, controlled_gpu.snapshot.nvml_calls)
+
+# Errors are isolated per device: the failing GPU is detached and the others keep being controlled
+def control_gpu_tick(controlled_gpu, configuration, attach_only=False):
+
+    try:
+        if controlled_gpu.handle == None:
+            attach_gpu(controlled_gpu)
+
+        if attach_only != True:
+            control_gpu(controlled_gpu, configuration)
+
+    except (pynvml.NVMLError, GpuNotFound) as error:
+        error_print('Device {} failed: {}. It is not controlled until it works again (probed every {}s)', controlled_gpu.label, str(error), configuration.retry_interval_s)
+        controlled_gpu.handle = None
+        controlled_gpu.last_error = error
+        controlled_gpu.device_errors += 1
+
+        if controlled_gpu.properties.invalidate_on_error(error) == True:
+            log_helper(f'{controlled_gpu.label}: Dropped cached device properties')
+        controlled_gpu.retry_time = clock.monotonic() + configuration.retry_interval_s
+
+# What the loop already knows after a tick, sent to the parent process for the metrics endpoint (see metrics_server.py)
+# It only uses the values sampled during the tick, so it doesn't make any NVML calls
+def collect_metrics_sample(controlled_gpus, tick_work_s, include_info=False):
+    gpus = []
+
+    for controlled_gpu in controlled_gpus:
+        snapshot = controlled_gpu.snapshot
+        gpu_sample = {
+            'label': controlled_gpu.label,
+            'up': controlled_gpu.last_error is None and controlled_gpu.handle != None,
+            'fan_target': controlled_gpu.fan_target,
+            'fan_writes_issued': controlled_gpu.fan_writes_issued,
+            'fan_writes_suppressed': controlled_gpu.fan_writes_suppressed,
+            'power_limit_writes': controlled_gpu.power_limit_writes,
+            'acoustic_limit_writes': controlled_gpu.acoustic_limit_writes,
+            'device_errors': controlled_gpu.device_errors,
+            'nvml_calls_last_tick': controlled_gpu.nvml_calls_last_tick,
+        }
+
+        if snapshot != None:
+            gpu_sample['temperature'] = snapshot.temperature
+            gpu_sample['fan_speeds'] = snapshot.fan_speeds
+            gpu_sample['power_usage'] = snapshot.power_usage
+
+            if controlled_gpu.config.power_limit != 0:
+                gpu_sample['power_limit'] = snapshot.current_power_limit
+                gpu_sample['enforced_power_limit'] = snapshot.enforced_power_limit
+
+            if snapshot.temperature_thresholds != None:
+                gpu_sample['acoustic_limit'] = snapshot.temperature_thresholds.current_acoustic
+
+        if include_info == True:
+            gpu_sample['info'] = collect_device_info(controlled_gpu)
+
+        gpus.append(gpu_sample)
+
+    return {'tick_work_s': tick_work_s, 'gpus': gpus}
+
+# The values of the info actions (see info_report.py) from the latest snapshot, sent to the parent process for the info socket (--socket)
+# None when the device is failing, so the info action asks the driver instead. Like the metrics sample, it doesn't make any NVML calls
+def collect_device_info(controlled_gpu):
+    snapshot = controlled_gpu.snapshot
+
+    if snapshot == None or controlled_gpu.last_error is not None or controlled_gpu.handle == None:
+        return None
+
+    device_info = {
+        'name': snapshot.name,
+        'uuid': snapshot.uuid,
+        'index': None,
+        'pci_bus_id': None,
+        'serial': None,
+        'temperature': snapshot.temperature,
+        'fan_speed': snapshot.fan_speed,
+        'fan_speeds': snapshot.fan_speeds,
+        'fan_constraints': None,
+        'fan_policy': None,
+        'power_limit_constraints': None,
+        'power_limit': None,
+        'enforced_power_limit': None,
+        'acoustic_thresholds': None,
+    }
+
+    # The info socket finds the device with them, like the command line
+    if controlled_gpu.device != None:
+        for key in ['index', 'pci_bus_id', 'serial']:
+            device_info[key] = controlled_gpu.device[key]
+
+    if snapshot.fan_constraints != None:
+        device_info['fan_constraints'] = [snapshot.fan_constraints.min, snapshot.fan_constraints.max]
+
+    if snapshot.fan_policy != None:
+        device_info['fan_policy'] = fan_policy_info_msg(snapshot.fan_policy)
+
+    if snapshot.power_limit_constraints != None:
+        device_info['power_limit_constraints'] = [snapshot.power_limit_constraints.min, snapshot.power_limit_constraints.max]
+        device_info['power_limit'] = snapshot.current_power_limit
+        device_info['enforced_power_limit'] = snapshot.enforced_power_limit
+
+    if snapshot.temperature_thresholds != None:
+        thresholds = snapshot.temperature_thresholds
+        device_info['acoustic_thresholds'] = [thresholds.current_acoustic, thresholds.min_acoustic, thresholds.max_acoustic]
+
+    return device_info
+
+# Polls quickly while the readings are changing and backs off to the slow interval when they are stable
+class AdaptivePolling:
+
+    # Readings changing faster than this make the loop poll at the minimum interval
+    temperature_rate_threshold = 0.5 # °C per second
+    power_rate_threshold = 10.0 # W per second
+
+    # How often the effective sample rate is logged
+    report_period_s = 300.0
+
+    def __init__(self, min_interval_s, max_interval_s, now):
+        self.min_interval_s = min_interval_s
+        self.max_interval_s = max_interval_s
+        self.interval_s = min_interval_s
+        self.previous_snapshots = {} # Label -> DeviceSnapshot
+        self.report_start = now
+        self.report_samples = 0
+
+    def readings_changing(self, previous, snapshot):
+        elapsed = snapshot.time - previous.time
+
+        if elapsed <= 0:
+            return False
+
+        if previous.temperature != None and snapshot.temperature != None:
+            if abs(snapshot.temperature - previous.temperature) / elapsed >= AdaptivePolling.temperature_rate_threshold:
+                return True
+
+        if previous.power_usage != None and snapshot.power_usage != None:
+            if abs(snapshot.power_usage - previous.power_usage) / elapsed >= AdaptivePolling.power_rate_threshold:
+                return True
+
+        return False
+
+    # Returns how long to sleep before the next tick
+    def update(self, controlled_gpus, now):
+        changing = False
+
+        for controlled_gpu in controlled_gpus:
+            snapshot = controlled_gpu.snapshot
+
+            if snapshot == None or controlled_gpu.handle == None:
+                continue
+
+            previous = self.previous_snapshots.get(controlled_gpu.label)
+
+            if previous != None and self.readings_changing(previous, snapshot) == True:
+                changing = True
+
+            self.previous_snapshots[controlled_gpu.label] = snapshot
+
+        # React immediately, but only slow down gradually (a minimum interval of 0 would never grow without the 0.1s floor)
+        if changing == True:
+            self.interval_s = self.min_interval_s
+        else:
+            self.interval_s = min(self.max_interval_s, max(self.interval_s * 2, 0.1))
+
+        self.report_samples += 1
+
+        if now - self.report_start >= AdaptivePolling.report_period_s:
+            self.report(now)
+
+        return self.interval_s
+
+    def effective_sample_rate(self, now):
+        elapsed = now - self.report_start
+
+        if elapsed <= 0:
+            return 0.0
+
+        return self.report_samples / elapsed
+
+    def report(self, now):
+        elapsed = now - self.report_start
+        saved_wakeups = 0
+
+        if self.min_interval_s > 0:
+            saved_wakeups = max(0, int(elapsed / self.min_interval_s) - self.report_samples)
+
+        log_helper(f'Adaptive polling: {self.report_samples} samples in {elapsed:.0f}s ({self.effective_sample_rate(now):.3f} Hz), {saved_wakeups} wakeups saved compared to the minimum interval. Current interval: {self.interval_s}s')
+
+        self.report_start = now
+        self.report_samples = 0
+
+# Set by SIGHUP (see worker_process.py), the control loop reloads the settings file before the next tick
+reload_requested = False
+
+def request_reload():
+    global reload_requested
+    reload_requested = True
+
+# Reloads the settings file (--config) between ticks, keeping the worker, the NVML session and the device handles
+class ConfigReloader:
+
+    # Settings only read by the control loop. The others are read by the parent process or when the worker starts, so they need a restart
+    reloadable_settings = ['time_interval', 'adaptive_interval', 'min_interval_s', 'max_interval_s', 'retry_interval_s', 'hysteresis',
+                           'min_dwell_s', 'dry_run', 'verbose']
+    ignored_settings = ['gpus', 'command_line', 'config_version']
+
+    def __init__(self, configuration):
+        self.configuration = configuration
+        self.version = configuration.config_version # Reloading a broken file is only tried again when it changes
+        self.reloads = 0 # Also keeps the messages of each reload apart, so the rate limit of the log doesn't hide them
+
+    def pending(self):
+        return reload_requested == True or config_file.file_version(self.configuration.config_path) != self.version
+
+    # Returns True when the new settings are in effect
+    def reload(self, controlled_gpus):
+        global reload_requested
+        reload_requested = False
+
+        configuration = self.configuration
+        self.version = config_file.file_version(configuration.config_path)
+
+        # Same rules as the command line (parse_cmd_args reads the file again). The warnings were already printed on startup
+        try:
+            new_configuration = parse_args.parse_cmd_args(configuration.command_line, show_warnings=False)
+        except Exception as error:
+            error_print('Could not reload {}, keeping the current settings: {}', configuration.config_path, str(error))
+            return False
+
+        new_labels = [gpu_config.label() for gpu_config in new_configuration.gpus]
+
+        if new_labels != [controlled_gpu.label for controlled_gpu in controlled_gpus]:
+            error_print('Could not reload {}, keeping the current settings: selecting other GPUs needs a restart', configuration.config_path)
+            return False
+
+        for setting, value in vars(new_configuration).items():
+            if setting not in ConfigReloader.reloadable_settings + ConfigReloader.ignored_settings and getattr(configuration, setting) != value:
+                log_helper('{}: {} changed, it only takes effect after a restart', configuration.config_path, setting)
+
+        for setting in ConfigReloader.reloadable_settings:
+            setattr(configuration, setting, getattr(new_configuration, setting))
+
+        # The handle, the cached properties and the counters are kept, only the settings and the compiled curve change
+        configuration.gpus = new_configuration.gpus
+        for controlled_gpu, gpu_config in zip(controlled_gpus, new_configuration.gpus):
+            controlled_gpu.config = gpu_config
+            controlled_gpu.fan_curve = fan_curve.CompiledFanCurve(gpu_config.temp_speed_pair, gpu_config.default_speed, gpu_config.curve_type)
+
+        self.reloads += 1
+        log_helper('Reloaded the settings from {} (reload {})', configuration.config_path, self.reloads)
+        return True
+
+# Keeps the loop on a fixed cadence using time.monotonic() deadlines, so the time spent on NVML calls doesn't add up to the interval
+# Missed deadlines are skipped instead of running a burst of ticks to catch up
+class TickScheduler:
+
+    # How often the tick metrics are logged
+    report_period_s = 300.0
+
+    def __init__(self, now):
+        self.next_deadline = now
+        self.tick_start = now
+        self.report_start = now
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        self.ticks = 0
+        self.overruns = 0 # Ticks that took longer than the interval
+        self.skipped_ticks = 0 # Deadlines that were missed because of the overruns
+        self.total_work_s = 0.0
+        self.max_work_s = 0.0
+        self.last_work_s = 0.0
+        self.total_jitter_s = 0.0 # How late the ticks started compared to their deadlines
+        self.max_jitter_s = 0.0
+
+    def start_tick(self, now):
+        jitter = max(0.0, now - self.next_deadline)
+
+        self.tick_start = now
+        self.ticks += 1
+        self.total_jitter_s += jitter
+        self.max_jitter_s = max(self.max_jitter_s, jitter)
+
+    # Returns how long to sleep until the next deadline
+    def finish_tick(self, interval_s, now):
+        work = now - self.tick_start
+
+        self.last_work_s = work
+        self.total_work_s += work
+        self.max_work_s = max(self.max_work_s, work)
+
+        if interval_s <= 0:
+            self.next_deadline = now
+        else:
+            self.next_deadline += interval_s
+
+            if self.next_deadline <= now:
+                missed = int((now - self.next_deadline) / interval_s) + 1
+                self.overruns += 1
+                self.skipped_ticks += missed
+                self.next_deadline += missed * interval_s
+
+        if now - self.report_start >= TickScheduler.report_period_s:
+            self.report(now)
+
+        return max(0.0, self.next_deadline - now)
+
+    # An event started the next tick early, so the next deadline counts from it
+    def rearm(self, now):
+        self.next_deadline = now
+
+    def report(self, now):
+        ticks = max(1, self.ticks)
+
+        log_helper(f'Ticks: {self.ticks} in {now - self.report_start:.0f}s - work time avg {self.total_work_s / ticks * 1000:.2f}ms, max {self.max_work_s * 1000:.2f}ms - jitter avg {self.total_jitter_s / ticks * 1000:.2f}ms, max {self.max_jitter_s * 1000:.2f}ms - overruns: {self.overruns}, skipped ticks: {self.skipped_ticks}')
+
+        self.report_start = now
+        self.reset_metrics()
+
+# Controls the GPUs one after the other on the calling thread (the default engine, see --engine)
+class SyncEngine:
+
+    def tick(self, controlled_gpus, configuration, attach_only=False):
+        for controlled_gpu in controlled_gpus:
+            control_gpu_tick(controlled_gpu, configuration, attach_only)
+
+    def metrics(self):
+        return {}
+
+    def close(self):
+        pass
+
+def select_engine(configuration, controlled_gpus):
+
+    if configuration.engine == 'async':
+        import async_engine # asyncio is only loaded when it is used
+        return async_engine.AsyncEngine(configuration, len(controlled_gpus))
+
+    return SyncEngine()
+
+# Two selectors of the same device (e.g. its name and its index) would fight over its fans
+def check_duplicate_devices(controlled_gpus):
+    labels = {}
+
+    for controlled_gpu in controlled_gpus:
+
+        if controlled_gpu.handle == None:
+            continue
+
+        if controlled_gpu.uuid in labels:
+            error_print('{} and {} select the same device ({})', labels[controlled_gpu.uuid], controlled_gpu.label, controlled_gpu.uuid)
+            raise DuplicateDevice('The same device was selected more than once')
+
+        labels[controlled_gpu.uuid] = controlled_gpu.label
+
+# worker_link is only used when running in a worker process (see nvml_gpu_control.py)
+def control_all(configuration, worker_link=None):
+
+    controlled_gpus = [ControlledGpu(gpu_config) for gpu_config in configuration.gpus]
+    engine = select_engine(configuration, controlled_gpus)
+
+    try:
+        control_loop(configuration, controlled_gpus, engine, worker_link)
+    finally:
+        engine.close()
+
+def control_loop(configuration, controlled_gpus, engine, worker_link):
+
+    print_system_info()
+
+    adaptive_polling = None
+    if configuration.adaptive_interval == True:
+        adaptive_polling = AdaptivePolling(configuration.min_interval_s, configuration.max_interval_s, clock.monotonic())
+
+    # Get the devices ready before anything else, so a standby worker can take over right away
+    engine.tick(controlled_gpus, configuration, attach_only=True)
+    check_duplicate_devices(controlled_gpus)
+
+    if worker_link != None:
+        worker_link.wait_for_activation()
+
+    scheduler = TickScheduler(clock.monotonic())
+
+    event_waiter = None
+    if configuration.event_interval_s != 0:
+        event_waiter = nvml_events.start_event_waiter(nvml, clock)
+
+    # Opened by the worker, so each one continues the history of the previous workers
+    recorder = None
+    if configuration.record_path != '':
+        recorder = telemetry_ring.TelemetryRecorder(configuration.record_path, configuration.record_size_mb, [controlled_gpu.label for controlled_gpu in controlled_gpus])
+
+    reloader = None
+    if configuration.config_path != '':
+        reloader = ConfigReloader(configuration)
+
+    try:
+        while(True):
+
+            # Between ticks, so a tick never mixes the old and the new settings
+            if reloader != None and reloader.pending() == True and reloader.reload(controlled_gpus) == True:
+                adaptive_polling = None
+
+                if configuration.adaptive_interval == True:
+                    adaptive_polling = AdaptivePolling(configuration.min_interval_s, configuration.max_interval_s, clock.monotonic())
+
+            scheduler.start_tick(clock.monotonic())
+
+            # Failed devices are probed again after the retry interval, while the others keep being controlled
+            due_gpus = [controlled_gpu for controlled_gpu in controlled_gpus
+                        if controlled_gpu.last_error is None or clock.monotonic() >= controlled_gpu.retry_time]
+
+            engine.tick(due_gpus, configuration)
+            check_duplicate_devices(controlled_gpus)
+
+            if event_waiter != None:
+                event_waiter.update(controlled_gpus)
+
+            if recorder != None:
+                recorder.record_tick(controlled_gpus, clock.time())
+
+            failed_gpus = [controlled_gpu for controlled_gpu in controlled_gpus if controlled_gpu.last_error is not None]
+
+            # When every device is failing (or it was a single run), let the worker process die, so it can restart with a new NVML session
+            if len(failed_gpus) == len(controlled_gpus) or (len(failed_gpus) != 0 and configuration.single_use == True):
+                raise failed_gpus[0].last_error
+
+            if worker_link != None:
+                metrics_sample = None
+
+                if configuration.metrics_port != 0 or configuration.socket_path != '':
+                    metrics_sample = collect_metrics_sample(controlled_gpus, clock.monotonic() - scheduler.tick_start, configuration.socket_path != '')
+
+                    metrics_sample.update(engine.metrics())
+
+                    if event_waiter != None:
+                        metrics_sample.update(event_waiter.metrics())
+
+                worker_link.tick_done(metrics_sample)
+
+            if configuration.single_use == True:
+                break
 
-    # Only print log messages when necessary to avoid taking too much disk space
-    if verbose == True or setting_changed == True:
-        log_helper("\n" + "\n".join(log_msg) + "\n")
+            interval_s = configuration.time_interval
+            if adaptive_polling != None:
+                interval_s = adaptive_polling.update(controlled_gpus, clock.monotonic())
+            elif event_waiter != None:
+                interval_s = configuration.event_interval_s
 
+            sleep_s = scheduler.finish_tick(interval_s, clock.monotonic())
 
-def control_all(configuration):
+            if event_waiter == None:
+                clock.sleep(sleep_s)
+                continue
 
-    gpu_handle = get_GPU_handle(configuration.gpu_name, configuration.gpu_uuid)
-    print_GPU_info(gpu_handle)
+            wait_start = clock.monotonic()
 
-    while(True):
+            if event_waiter.wait(sleep_s) == True:
 
-        # The user has enabled it with an option to take effect
-        if configuration.power_limit != 0:
-            power_control_subroutine(gpu_handle, configuration.power_limit, configuration.dry_run, configuration.verbose)
+                # A steady stream of events (e.g. the clocks under load) must not tick faster than the time interval
+                holdoff_s = scheduler.tick_start + configuration.time_interval - clock.monotonic()
+                if holdoff_s > 0:
+                    event_waiter.merge(holdoff_s)
 
-        # The user has enabled it with an option to take effect
-        if configuration.acoustic_temp_limit != 0:
-            temp_control_subroutine(gpu_handle, configuration.acoustic_temp_limit, configuration.dry_run, configuration.verbose)
+                scheduler.rearm(clock.monotonic())
 
-        # The user has enabled it with an option to take effect
-        if len(configuration.temp_speed_pair) != 0:
-            fan_control_subroutine(gpu_handle, configuration)
+                if configuration.verbose == True:
+                    log_helper('NVML event: ticking {:.3f}s before the deadline (event wakeup {})', sleep_s - (clock.monotonic() - wait_start), event_waiter.event_wakeups)
 
-        if configuration.single_use == True:
-            break
+    finally:
+        if event_waiter != None:
+            event_waiter.close()
 
-        time.sleep(configuration.time_interval)
+        if recorder != None:
+            recorder.close()
@@ -0,0 +1,53 @@
+output_separator = '==============================================='
+
+# Output of the info actions. The values come from NVML (helper_functions.py) or from the latest sample of a running control loop
+# (info_server.py), so both print exactly the same thing
+#
+# Device info: a dict with the keys below, all of them can be None when they were not sampled
+#   name, uuid, index, pci_bus_id, serial, temperature, fan_speed, fan_speeds, fan_constraints [min, max], fan_policy (text), power_limit_constraints [min, max],
+#   power_limit, enforced_power_limit, acoustic_thresholds [current, min, max]
+
+def print_fan_info(device_info):
+    print(f'{output_separator}')
+    print(f'Current temp: {device_info["temperature"]}°C')
+    print(f'Current speed: {device_info["fan_speed"]}%') # Minitor for fan fan speed changes and reajust!
+
+    # Get the fan speed per controller
+    for idx, fan_speed_c in enumerate(device_info['fan_speeds']):
+        print(f'Fan controller speed {idx}: {fan_speed_c}%')
+
+    print(f'Fan constraints: Min {device_info["fan_constraints"][0]}% - Max {device_info["fan_constraints"][1]}%')
+    print(f'{output_separator}')
+
+def print_fan_policy_info(device_info):
+    print(f'{output_separator}')
+    print(f'Current fan policy is: {device_info["fan_policy"]}')
+    print(f'{output_separator}')
+
+def print_power_limit_info(device_info):
+    print(f'{output_separator}')
+    print(f'Power limit constraints\nMin: {device_info["power_limit_constraints"][0]}W - Max: {device_info["power_limit_constraints"][1]}W\n')
+    print(f'Current power limit: {device_info["power_limit"]}W\n')
+    print(f'Current enforced power limit: {device_info["enforced_power_limit"]}W\n')
+    print(f'{output_separator}')
+
+def print_thresholds_info(device_info):
+    print(f'{output_separator}')
+    print(f'Temperature threshold - current acoustic: {device_info["acoustic_thresholds"][0]}°C')
+    print(f'Temperature threshold - minimum acoustic: {device_info["acoustic_thresholds"][1]}°C')
+    print(f'Temperature threshold - maximum acoustic: {device_info["acoustic_thresholds"][2]}°C')
+    print(f'{output_separator}')
+
+# Action -> (printer, device info keys it needs)
+info_actions = {
+    'fan-info': (print_fan_info, ['temperature', 'fan_speed', 'fan_speeds', 'fan_constraints']),
+    'fan-policy-info': (print_fan_policy_info, ['fan_policy']),
+    'get-power-limit-info': (print_power_limit_info, ['power_limit_constraints', 'power_limit', 'enforced_power_limit']),
+    'get-thresholds-info': (print_thresholds_info, ['acoustic_thresholds']),
+}
+
+def has_info(device_info, action):
+    return all(device_info.get(key) != None for key in info_actions[action][1])
+
+def print_info(device_info, action):
+    info_actions[action][0](device_info)
@@ -0,0 +1,197 @@
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+import time
+import info_report
+import parse_args
+from log_writer import log_helper
+
+# Lets the info actions (fan-info, power-limit-info...) get their answers from a running control loop (--socket), instead of starting a
+# new NVML session and querying the device cold. The parent process of the control loop keeps the latest sample of the worker and
+# answers on a Unix socket, one JSON line per request and answer:
+#
+#   request: {"action": "fan-info", "selector": "gpu_pci", "value": "00000000:01:00.0"} (see parse_args.GpuConfiguration.selector)
+#   answer:  {"device": {...see info_report.py...}, "age_s": 0.4} or {"error": "..."}
+#
+# When there is no daemon or it can't answer (e.g. the worker is restarting), the info action asks the driver as usual
+
+request_timeout_s = 1.0
+max_message_size = 65536
+
+# A sample older than this many ticks means the worker is stuck or restarting
+stale_ticks = 3
+min_stale_age_s = 1.0
+
+class SocketInUse(Exception):
+    pass
+
+def supported():
+    return hasattr(socket, 'AF_UNIX')
+
+# Kept by the parent process, like metrics_server.ControllerMetrics. Requests only read this, they never reach the worker or the driver
+class ControllerInfo:
+    def __init__(self, interval_s):
+        self.lock = threading.Lock()
+        self.max_age_s = interval_s * stale_ticks + min_stale_age_s
+        self.devices = [] # (label, device info or None when it is failing)
+        self.sample_time = None # time.monotonic() value of when the sample arrived
+
+    def update(self, sample):
+        devices = [(gpu['label'], gpu.get('info')) for gpu in sample['gpus']]
+
+        with self.lock:
+            self.devices = devices
+            self.sample_time = time.monotonic()
+
+    def find_device(self, devices, selector, value):
+        label = parse_args.selector_label(selector, value)
+        key = parse_args.selector_keys[selector]
+
+        if selector == 'gpu_index':
+            value = int(value)
+
+        # The device may be selected in a different way than the control loop does (e.g. by its PCI bus ID instead of its UUID)
+        for device_label, device_info in devices:
+            if device_label == label or (device_info != None and device_info.get(key) == value):
+                return device_label, device_info
+
+        return None, None
+
+    def answer(self, request):
+
+        with self.lock:
+            devices = self.devices
+            sample_time = self.sample_time
+
+        action = request.get('action')
+        if action not in info_report.info_actions:
+            return {'error': f'Unknown action: {action}'}
+
+        if sample_time == None:
+            return {'error': 'The control loop has not finished a tick yet'}
+
+        age_s = time.monotonic() - sample_time
+        if age_s > self.max_age_s:
+            return {'error': f'The latest sample is {age_s:.1f}s old'}
+
+        selector = request.get('selector')
+        if selector not in parse_args.GpuConfiguration.selectors:
+            return {'error': f'Unknown selector: {selector}'}
+
+        label, device_info = self.find_device(devices, selector, str(request.get('value', '')))
+
+        if label == None:
+            return {'error': 'The device is not controlled by this process'}
+
+        if device_info == None:
+            return {'error': f'{label} is failing'}
+
+        if info_report.has_info(device_info, action) != True:
+            return {'error': f'{label} does not support {action}'}
+
+        return {'device': device_info, 'age_s': age_s}
+
+class InfoRequestHandler(socketserver.StreamRequestHandler):
+
+    timeout = request_timeout_s
+
+    def handle(self):
+
+        try:
+            request = json.loads(self.rfile.readline(max_message_size))
+
+            if isinstance(request, dict) != True:
+                raise ValueError('The request is not an object')
+
+            answer = self.server.info.answer(request)
+
+        except (OSError, ValueError):
+            answer = {'error': 'Invalid request'}
+
+        try:
+            self.wfile.write((json.dumps(answer) + '\n').encode('utf-8'))
+        except OSError: # The client went away
+            pass
+
+def daemon_running(path):
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(request_timeout_s)
+
+        try:
+            client.connect(path)
+        except OSError:
+            return False
+
+    return True
+
+# Runs on its own threads in the parent process, so a request never delays the worker's control ticks
+def start_info_server(info, path):
+
+    # A socket left behind by a process that didn't exit cleanly is replaced. Anything else is never removed
+    if os.path.lexists(path):
+        if stat.S_ISSOCK(os.lstat(path).st_mode) != True:
+            raise SocketInUse(f'{path} already exists and is not a socket')
+
+        if daemon_running(path) == True:
+            raise SocketInUse(f'Another process is already answering at {path}')
+
+        os.unlink(path)
+
+    server = socketserver.ThreadingUnixStreamServer(path, InfoRequestHandler)
+    server.daemon_threads = True
+    server.info = info
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server
+
+def stop_info_server(server, path):
+    server.shutdown()
+    server.server_close()
+
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+# Returns the answer of the daemon, or an error answer when there is no daemon
+def query_device_info(path, action, selector, value, timeout_s=request_timeout_s):
+    request = {'action': action, 'selector': selector, 'value': value}
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout_s)
+            client.connect(path)
+            client.sendall((json.dumps(request) + '\n').encode('utf-8'))
+
+            with client.makefile('rb') as answer_file:
+                answer = json.loads(answer_file.readline(max_message_size))
+
+    except (OSError, ValueError) as error:
+        return {'error': f'No answer: {error}'}
+
+    if isinstance(answer, dict) != True or ('device' not in answer and 'error' not in answer):
+        return {'error': 'Invalid answer'}
+
+    return answer
+
+# Returns False when the daemon couldn't answer, so the caller asks the driver instead
+def print_daemon_info(configuration):
+    answer = query_device_info(configuration.socket_path, configuration.action, *configuration.gpus[0].selector())
+
+    if 'device' not in answer or info_report.has_info(answer['device'], configuration.action) != True:
+        if configuration.verbose == True:
+            log_helper('Info socket {}: {}. Asking the driver instead', configuration.socket_path, answer.get('error', 'Incomplete answer'))
+
+        return False
+
+    if configuration.verbose == True:
+        log_helper('Info socket {}: sampled {:.3f}s ago', configuration.socket_path, answer.get('age_s', 0.0))
+
+    info_report.print_info(answer['device'], configuration.action)
+    return True
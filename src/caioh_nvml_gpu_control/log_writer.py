@@ -0,0 +1,209 @@
+import datetime
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+log_formats = ['text', 'json']
+
+# A log message that is only formatted when it is written: "message" can have str.format() fields that are filled with "args"
+class LogRecord:
+    __slots__ = ('time', 'level', 'message', 'args', 'repeated')
+
+    def __init__(self, level, message, args, repeated=0):
+        self.time = time.time()
+        self.level = level # 'info' or 'error'
+        self.message = message
+        self.args = args
+        self.repeated = repeated # Identical messages suppressed by the rate limit before this one
+
+    def text(self):
+        text = self.message
+
+        if len(self.args) != 0:
+            text = self.message.format(*self.args)
+
+        if self.repeated != 0:
+            text += f' (repeated {self.repeated} more times)'
+
+        return text
+
+# Writes the records right away (the original behavior). The streams are looked up on every write, so redirecting them keeps working
+class LogWriter:
+    def __init__(self, log_format='text'):
+        self.log_format = log_format
+        self.last_second = None
+        self.last_timestamp = ''
+
+    # strftime only once per second
+    def timestamp(self, record_time):
+        second = int(record_time)
+
+        if second != self.last_second:
+            self.last_second = second
+            self.last_timestamp = datetime.datetime.fromtimestamp(second).strftime("%Y-%m-%d %H:%M:%S")
+
+        return self.last_timestamp
+
+    def format(self, record):
+
+        if self.log_format == 'json':
+            line = {
+                'time': datetime.datetime.fromtimestamp(record.time).astimezone().isoformat(timespec='milliseconds'),
+                'level': record.level,
+                'pid': os.getpid(),
+                'message': record.text(),
+            }
+
+            if record.repeated != 0:
+                line['repeated'] = record.repeated
+
+            return json.dumps(line, ensure_ascii=False)
+
+        if record.level == 'error':
+            return record.text()
+
+        return f'LOG[{self.timestamp(record.time)}]: {record.text()}'
+
+    def write(self, record):
+        stream = sys.stderr if record.level == 'error' else sys.stdout
+        print(self.format(record), file=stream)
+
+    def close(self):
+        pass
+
+# Formats and writes the records on a background thread, so a slow stdout (e.g. a pipe to journald) never stalls the control loop
+# When the queue is full, records are dropped and counted instead of waiting
+class AsyncLogWriter(LogWriter):
+
+    queue_size = 1024
+
+    def __init__(self, log_format='text'):
+        super().__init__(log_format)
+        self.queue = queue.Queue(AsyncLogWriter.queue_size)
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.dropped_lock = threading.RLock() # The records can come from several threads (--engine async) and from the signal handlers
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.dropped_lock:
+                self.dropped += 1
+
+    def run(self):
+
+        while(True):
+            record = self.queue.get()
+
+            if record == None:
+                return
+
+            # A closed output (e.g. the reader of the pipe went away) must not kill the thread, since the control loop would fill the queue
+            try:
+                with self.dropped_lock:
+                    dropped = self.dropped
+
+                if dropped != self.reported_dropped:
+                    super().write(LogRecord('error', 'Log queue full: {} messages dropped', (dropped - self.reported_dropped,)))
+                    self.reported_dropped = dropped
+
+                super().write(record)
+
+                if self.queue.empty():
+                    sys.stdout.flush()
+
+            except (OSError, ValueError):
+                pass
+
+    # Writes what is still in the queue, without waiting forever for a stuck stdout
+    def close(self, timeout_s=2.0):
+        try:
+            self.queue.put(None, timeout=timeout_s)
+        except queue.Full:
+            return
+
+        self.thread.join(timeout_s)
+
+# Entry point of all log messages (see log_helper and error_print)
+class Logger:
+
+    # Identical messages (same text and arguments) are only written once per period, the next one tells how many were suppressed
+    rate_limit_s = 30.0
+
+    def __init__(self):
+        self.writer = LogWriter()
+        self.rate_limit = False
+        self.muted = False # Drops everything (e.g. the messages of the control subroutines during a replay)
+        self.recent = {} # (level, message, args) -> [time of the last written record, suppressed records]
+        self.lock = threading.RLock() # The messages can come from several threads (--engine async) and from the signal handlers
+
+    def configure(self, log_format, asynchronous, rate_limit):
+        self.writer.close()
+
+        if asynchronous == True:
+            self.writer = AsyncLogWriter(log_format)
+        else:
+            self.writer = LogWriter(log_format)
+
+        self.rate_limit = rate_limit
+
+        with self.lock:
+            self.recent.clear()
+
+    def log(self, level, message, args):
+
+        if self.muted == True:
+            return
+
+        record = LogRecord(level, message, args)
+
+        if self.rate_limit == True and self.rate_limited(record) == True:
+            return
+
+        self.writer.write(record)
+
+    def rate_limited(self, record):
+
+        with self.lock:
+            return self.rate_limited_locked(record)
+
+    def rate_limited_locked(self, record):
+        key = (record.level, record.message, record.args)
+
+        try:
+            recent = self.recent.get(key)
+        except TypeError: # Unhashable arguments are never rate limited
+            return False
+
+        if recent != None and record.time - recent[0] < Logger.rate_limit_s:
+            recent[1] += 1
+            return True
+
+        # Forget the old messages from time to time, so the table doesn't grow forever
+        if len(self.recent) >= 1024:
+            self.recent = {recent_key: value for recent_key, value in self.recent.items() if record.time - value[0] < Logger.rate_limit_s}
+
+        if recent != None:
+            record.repeated = recent[1]
+
+        self.recent[key] = [record.time, 0]
+        return False
+
+    def close(self):
+        self.writer.close()
+
+# All messages go through here. They are also available from helper_functions, where most of the program uses them
+logger = Logger()
+
+# The arguments fill the str.format() fields of the message when it is written, so the message is only formatted when needed
+def log_helper(msg, *args):
+    logger.log('info', msg, args)
+
+def error_print(msg, *args):
+    logger.log('error', msg, args)
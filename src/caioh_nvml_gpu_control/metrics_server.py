@@ -0,0 +1,177 @@
+import http.server
+import threading
+import time
+
+metric_prefix = 'nvml_gpu_control_'
+
+# Upper bounds of the tick duration histogram in seconds
+tick_duration_buckets_s = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0]
+
+# Per GPU values of the worker's metrics sample: (sample key, metric name, type, help text)
+gpu_metrics = [
+    ('temperature', 'temperature_celsius', 'gauge', 'GPU temperature sampled by the control loop'),
+    ('fan_target', 'fan_target_percent', 'gauge', 'Fan speed chosen by the fan curve'),
+    ('power_limit', 'power_limit_watts', 'gauge', 'Power limit set on the GPU'),
+    ('enforced_power_limit', 'enforced_power_limit_watts', 'gauge', 'Power limit enforced by the driver'),
+    ('power_usage', 'power_usage_watts', 'gauge', 'Power usage sampled by the control loop'),
+    ('acoustic_limit', 'acoustic_temperature_limit_celsius', 'gauge', 'Acoustic temperature threshold set on the GPU'),
+    ('nvml_calls_last_tick', 'nvml_calls_last_tick', 'gauge', 'NVML calls made for the GPU in the last tick'),
+    ('fan_writes_issued', 'fan_writes_total', 'counter', 'Fan speed changes sent to the GPU by the current worker'),
+    ('fan_writes_suppressed', 'fan_writes_suppressed_total', 'counter', 'Fan speed changes held back by the hysteresis or the minimum dwell time'),
+    ('power_limit_writes', 'power_limit_writes_total', 'counter', 'Power limit changes sent to the GPU by the current worker'),
+    ('acoustic_limit_writes', 'acoustic_limit_writes_total', 'counter', 'Acoustic threshold changes sent to the GPU by the current worker'),
+    ('device_errors', 'device_errors_total', 'counter', 'NVML errors of the GPU in the current worker'),
+]
+
+# Counters keep all of their digits
+def format_value(value):
+
+    if isinstance(value, bool):
+        return str(int(value))
+
+    if isinstance(value, int):
+        return str(value)
+
+    return repr(float(value))
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# State of the controller, kept by the parent process: the latest sample sent by the worker after each tick and the worker restarts
+# Scrapes only read this, they never reach the worker or the driver
+class ControllerMetrics:
+    def __init__(self, version):
+        self.lock = threading.Lock()
+        self.version = version
+        self.sample = None
+        self.sample_time = None # time.monotonic() value of when the sample arrived
+        self.ticks = 0
+        self.tick_duration_sum_s = 0.0
+        self.tick_duration_histogram = [0] * len(tick_duration_buckets_s)
+        self.worker_restarts = 0
+        self.worker_hangs = 0
+
+    def update(self, sample):
+        tick_work_s = sample['tick_work_s']
+
+        with self.lock:
+            self.sample = sample
+            self.sample_time = time.monotonic()
+            self.ticks += 1
+            self.tick_duration_sum_s += tick_work_s
+
+            for bucket, bound in enumerate(tick_duration_buckets_s):
+                if tick_work_s <= bound:
+                    self.tick_duration_histogram[bucket] += 1
+
+    def worker_restarted(self, hung):
+        with self.lock:
+            self.worker_restarts += 1
+
+            if hung == True:
+                self.worker_hangs += 1
+
+    # Prometheus text exposition format
+    def render(self):
+
+        with self.lock:
+            sample = self.sample
+            sample_time = self.sample_time
+            ticks = self.ticks
+            tick_duration_sum_s = self.tick_duration_sum_s
+            tick_duration_histogram = list(self.tick_duration_histogram)
+            worker_restarts = self.worker_restarts
+            worker_hangs = self.worker_hangs
+
+        lines = []
+
+        def metric(name, metric_type, help_text, values):
+            lines.append(f'# HELP {metric_prefix}{name} {help_text}')
+            lines.append(f'# TYPE {metric_prefix}{name} {metric_type}')
+
+            for labels, value in values:
+                label_text = ','.join(f'{label}="{escape_label(label_value)}"' for label, label_value in labels)
+
+                if label_text != '':
+                    label_text = '{' + label_text + '}'
+
+                lines.append(f'{metric_prefix}{name}{label_text} {format_value(value)}')
+
+        metric('info', 'gauge', 'Version of the controller', [([('version', self.version)], 1)])
+        metric('worker_restarts_total', 'counter', 'Times a worker process was replaced after a failure', [([], worker_restarts)])
+        metric('worker_hangs_total', 'counter', 'Workers killed by the watchdog', [([], worker_hangs)])
+        metric('ticks_total', 'counter', 'Control ticks finished', [([], ticks)])
+
+        lines.append(f'# HELP {metric_prefix}tick_duration_seconds Time spent on each control tick')
+        lines.append(f'# TYPE {metric_prefix}tick_duration_seconds histogram')
+        for bound, count in zip(tick_duration_buckets_s, tick_duration_histogram):
+            lines.append(f'{metric_prefix}tick_duration_seconds_bucket{{le="{bound:g}"}} {count}')
+        lines.append(f'{metric_prefix}tick_duration_seconds_bucket{{le="+Inf"}} {ticks}')
+        lines.append(f'{metric_prefix}tick_duration_seconds_sum {format_value(tick_duration_sum_s)}')
+        lines.append(f'{metric_prefix}tick_duration_seconds_count {ticks}')
+
+        # Nothing else is known before the first tick
+        if sample == None:
+            return '\n'.join(lines) + '\n'
+
+        metric('last_tick_age_seconds', 'gauge', 'Time since the last control tick, it keeps growing when the worker is stuck', [([], time.monotonic() - sample_time)])
+        metric('up', 'gauge', 'Whether the GPU is being controlled (1) or failing (0)', [([('gpu', gpu['label'])], gpu['up']) for gpu in sample['gpus']])
+
+        fan_speeds = []
+        for gpu in sample['gpus']:
+            for fan_idx, fan_speed in enumerate(gpu.get('fan_speeds', [])):
+                fan_speeds.append(([('gpu', gpu['label']), ('fan', fan_idx)], fan_speed))
+
+        if len(fan_speeds) != 0:
+            metric('fan_speed_percent', 'gauge', 'Fan speed per fan controller sampled by the control loop', fan_speeds)
+
+        for key, name, metric_type, help_text in gpu_metrics:
+            values = [([('gpu', gpu['label'])], gpu[key]) for gpu in sample['gpus'] if gpu.get(key) != None]
+
+            if len(values) != 0:
+                metric(name, metric_type, help_text, values)
+
+        # Only with --engine async (see async_engine.py)
+        if 'nvml_deadline_misses' in sample:
+            metric('nvml_deadline_misses_total', 'counter', 'NVML calls that missed their deadline in the current worker', [([], sample['nvml_deadline_misses'])])
+            metric('safe_speed_writes_total', 'counter', 'Fan speed changes to the safe speed after a missed deadline in the current worker', [([], sample['safe_speed_writes'])])
+
+        # Only with --events (see nvml_events.py)
+        if 'events' in sample:
+            metric('events_total', 'counter', 'NVML events received by the current worker', [([('type', event_type)], count) for event_type, count in sample['events'].items()])
+            metric('event_wakeups_total', 'counter', 'Waits for NVML events ended by an event in the current worker', [([], sample['event_wakeups'])])
+            metric('event_timeouts_total', 'counter', 'Waits for NVML events that reached the safety interval in the current worker', [([], sample['event_timeouts'])])
+            metric('merged_events_total', 'counter', 'NVML events that arrived before the minimum time between ticks in the current worker', [([], sample['merged_events'])])
+
+        return '\n'.join(lines) + '\n'
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+
+        body = self.server.metrics.render().encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Scrapes would flood the log
+    def log_message(self, format, *args):
+        pass
+
+# Runs on its own threads in the parent process, so a slow scrape never delays the worker's control ticks
+def start_metrics_server(metrics, port, address='127.0.0.1'):
+    server = http.server.ThreadingHTTPServer((address, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server
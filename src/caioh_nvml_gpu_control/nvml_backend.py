@@ -0,0 +1,407 @@
+import pynvml
+import math
+import time
+
+# The NVML entry points used by this package. A backend provides them with the same names, arguments and errors (pynvml.NVMLError) as pynvml
+backend_functions = [
+    'nvmlInit',
+    'nvmlShutdown',
+    'nvmlSystemGetDriverVersion',
+    'nvmlSystemGetNVMLVersion',
+    'nvmlDeviceGetCount',
+    'nvmlDeviceGetHandleByIndex',
+    'nvmlDeviceGetHandleByUUID',
+    'nvmlDeviceGetIndex',
+    'nvmlDeviceGetName',
+    'nvmlDeviceGetUUID',
+    'nvmlDeviceGetPciInfo',
+    'nvmlDeviceGetSerial',
+    'nvmlDeviceGetTemperatureV',
+    'nvmlDeviceGetNumFans',
+    'nvmlDeviceGetFanSpeed',
+    'nvmlDeviceGetFanSpeed_v2',
+    'nvmlDeviceSetFanSpeed_v2',
+    'nvmlDeviceSetDefaultFanSpeed_v2',
+    'nvmlDeviceGetMinMaxFanSpeed',
+    'nvmlDeviceGetFanControlPolicy_v2',
+    'nvmlDeviceSetFanControlPolicy',
+    'nvmlDeviceGetPowerManagementLimit',
+    'nvmlDeviceGetEnforcedPowerLimit',
+    'nvmlDeviceGetPowerManagementLimitConstraints',
+    'nvmlDeviceSetPowerManagementLimit',
+    'nvmlDeviceGetTemperatureThreshold',
+    'nvmlDeviceSetTemperatureThreshold',
+    'nvmlDeviceGetFieldValues',
+    'nvmlDeviceGetSupportedEventTypes',
+    'nvmlDeviceRegisterEvents',
+    'nvmlEventSetCreate',
+    'nvmlEventSetWait',
+    'nvmlEventSetFree',
+]
+
+# The real driver
+class PynvmlBackend:
+    # Looked up on every call, so patching pynvml (like the tests do) keeps working
+    def __getattr__(self, name):
+        return getattr(pynvml, name)
+
+# Clocks used by the control loop. The simulated clock doesn't wait, so hours of control can run in a few seconds
+class SystemClock:
+    def monotonic(self):
+        return time.monotonic()
+
+    # Wall clock time, for timestamps that are read later (e.g. --record)
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+class SimulationFinished(Exception):
+    pass
+
+class SimulatedClock:
+    def __init__(self, start_time=0.0, end_time=None):
+        self.now = start_time
+        self.end_time = end_time # Sleeping past this raises SimulationFinished, so a simulated control loop can end
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(0.0, seconds)
+
+        if self.end_time != None and self.now >= self.end_time:
+            raise SimulationFinished(f'Simulation ended at {self.now:.3f}s')
+
+def simulated_gpu_uuid(index):
+    return f'GPU-00000000-0000-0000-0000-{index:012d}'
+
+# A GPU with a first order thermal model
+#
+#   power draw (W) = idle power + load * power limit
+#   cooling (W/°C) = passive cooling + fan cooling * fan speed / 100
+#   temperature goes exponentially towards ambient + power draw / cooling, with the heat capacity setting how fast
+#
+# Above the acoustic threshold the GPU throttles its power draw, like the real one lowers its clocks
+class SimulatedGpu:
+    def __init__(self, index, clock, load=0.5, ambient_temperature=25.0):
+        self.clock = clock
+        self.name = 'NVIDIA Simulated GPU'
+        self.uuid = simulated_gpu_uuid(index)
+        self.pci_bus_id = f'00000000:{index + 1:02X}:00.0'
+        self.serial = f'{1320000000000 + index}'
+
+        self.load = load # 0.0 to 1.0, either a number or a function of the simulated time
+        self.ambient_temperature = ambient_temperature
+        self.idle_power_w = 20.0
+        self.passive_cooling_w = 3.0
+        self.fan_cooling_w = 9.0
+        self.heat_capacity_j = 400.0
+        self.throttle_factor = 0.7
+
+        self.temperature = ambient_temperature
+        self.last_update = clock.monotonic()
+
+        self.fan_count = 2
+        self.fan_speeds = [30] * self.fan_count
+        self.fan_policies = [pynvml.NVML_FAN_POLICY_TEMPERATURE_CONTINOUS_SW] * self.fan_count
+        self.default_fan_speed = 30
+        self.min_fan_speed = 30
+        self.max_fan_speed = 100
+
+        self.power_limit_mw = 300000
+        self.min_power_limit_mw = 100000
+        self.max_power_limit_mw = 350000
+
+        self.acoustic_threshold = 83
+        self.min_acoustic_threshold = 40
+        self.max_acoustic_threshold = 90
+
+        self.lost = False # Every call fails with GPU_IS_LOST while set
+        self.event_types = pynvml.nvmlEventTypeClock | pynvml.nvmlEventTypePState | pynvml.nvmlEventTypePowerSourceChange | pynvml.nvmlEventTypeXidCriticalError
+
+    def current_load(self):
+        if callable(self.load):
+            return max(0.0, min(1.0, self.load(self.clock.monotonic())))
+
+        return self.load
+
+    def power_draw_w(self):
+        power_w = self.idle_power_w + self.current_load() * self.power_limit_mw / 1000
+
+        if self.temperature > self.acoustic_threshold:
+            power_w *= self.throttle_factor
+
+        return min(power_w, self.power_limit_mw / 1000)
+
+    def cooling_w(self):
+        return self.passive_cooling_w + self.fan_cooling_w * sum(self.fan_speeds) / len(self.fan_speeds) / 100
+
+    # Brings the temperature to the current simulated time. The inputs are treated as constant since the last update
+    def update(self):
+        now = self.clock.monotonic()
+        elapsed = now - self.last_update
+        self.last_update = now
+
+        if elapsed <= 0:
+            return
+
+        cooling = self.cooling_w()
+        equilibrium = self.ambient_temperature + self.power_draw_w() / cooling
+        self.temperature = equilibrium + (self.temperature - equilibrium) * math.exp(-cooling * elapsed / self.heat_capacity_j)
+
+class SimulatedEventSet:
+    def __init__(self):
+        self.event_types = {} # SimulatedGpu -> event types registered for it
+        self.freed = False
+
+# Drop-in replacement for pynvml backed by simulated GPUs, the handles are the SimulatedGpu objects
+class SimulatedBackend:
+    def __init__(self, gpu_count=1, clock=None):
+
+        if clock == None:
+            clock = SimulatedClock()
+
+        self.clock = clock
+        self.gpus = [SimulatedGpu(index, clock) for index in range(gpu_count)]
+        self.initialized = False
+        self.scheduled_events = [] # (simulated time, SimulatedGpu, event type), see schedule_event
+
+    # Simulated event source: nvmlEventSetWait returns the event when the simulated clock reaches its time
+    def schedule_event(self, event_time, gpu_index, event_type):
+        self.scheduled_events.append((event_time, self.gpus[gpu_index], event_type))
+        self.scheduled_events.sort(key=lambda event: event[0])
+
+    def device(self, handle):
+        if self.initialized != True:
+            raise pynvml.NVMLError(pynvml.NVML_ERROR_UNINITIALIZED)
+
+        if handle.lost == True:
+            raise pynvml.NVMLError(pynvml.NVML_ERROR_GPU_IS_LOST)
+
+        handle.update()
+        return handle
+
+    def check_fan_index(self, gpu, fan_idx):
+        if fan_idx < 0 or fan_idx >= gpu.fan_count:
+            raise pynvml.NVMLError(pynvml.NVML_ERROR_INVALID_ARGUMENT)
+
+    def nvmlInit(self):
+        self.initialized = True
+
+    def nvmlShutdown(self):
+        self.initialized = False
+
+    def nvmlSystemGetDriverVersion(self):
+        return '580.95.05'
+
+    def nvmlSystemGetNVMLVersion(self):
+        return '13.580.95.05'
+
+    def nvmlDeviceGetCount(self):
+        if self.initialized != True:
+            raise pynvml.NVMLError(pynvml.NVML_ERROR_UNINITIALIZED)
+
+        return len(self.gpus)
+
+    def nvmlDeviceGetHandleByIndex(self, index):
+        if index < 0 or index >= self.nvmlDeviceGetCount():
+            raise pynvml.NVMLError(pynvml.NVML_ERROR_INVALID_ARGUMENT)
+
+        return self.gpus[index]
+
+    def nvmlDeviceGetHandleByUUID(self, uuid):
+        self.nvmlDeviceGetCount()
+
+        for gpu in self.gpus:
+            if gpu.uuid == uuid:
+                return gpu
+
+        raise pynvml.NVMLError(pynvml.NVML_ERROR_NOT_FOUND)
+
+    def nvmlDeviceGetIndex(self, handle):
+        return self.gpus.index(self.device(handle))
+
+    def nvmlDeviceGetName(self, handle):
+        return self.device(handle).name
+
+    def nvmlDeviceGetUUID(self, handle):
+        return self.device(handle).uuid
+
+    def nvmlDeviceGetPciInfo(self, handle):
+        pci_info = pynvml.nvmlPciInfo_t()
+        pci_info.busId = self.device(handle).pci_bus_id.encode('ascii')
+        return pci_info
+
+    def nvmlDeviceGetSerial(self, handle):
+        return self.device(handle).serial
+
+    def nvmlDeviceGetTemperatureV(self, handle, sensor):
+        if sensor != pynvml.NVML_TEMPERATURE_GPU:
+            raise pynvml.NVMLError(pynvml.NVML_ERROR_INVALID_ARGUMENT)
+
+        return int(self.device(handle).temperature)
+
+    def nvmlDeviceGetNumFans(self, handle):
+        return self.device(handle).fan_count
+
+    def nvmlDeviceGetFanSpeed(self, handle):
+        return self.nvmlDeviceGetFanSpeed_v2(handle, 0)
+
+    def nvmlDeviceGetFanSpeed_v2(self, handle, fan_idx):
+        gpu = self.device(handle)
+        self.check_fan_index(gpu, fan_idx)
+        return gpu.fan_speeds[fan_idx]
+
+    def nvmlDeviceSetFanSpeed_v2(self, handle, fan_idx, speed):
+        gpu = self.device(handle)
+        self.check_fan_index(gpu, fan_idx)
+
+        # Like many drivers, the reported minimum is not enforced
+        if speed < 0 or speed > 100:
+            raise pynvml.NVMLError(pynvml.NVML_ERROR_INVALID_ARGUMENT)
+
+        gpu.fan_speeds[fan_idx] = speed
+        gpu.fan_policies[fan_idx] = pynvml.NVML_FAN_POLICY_MANUAL
+
+    def nvmlDeviceSetDefaultFanSpeed_v2(self, handle, fan_idx):
+        gpu = self.device(handle)
+        self.check_fan_index(gpu, fan_idx)
+        gpu.fan_speeds[fan_idx] = gpu.default_fan_speed
+
+    # Both the pointer (ctypes.byref) and the return value forms of pynvml are supported
+    def nvmlDeviceGetMinMaxFanSpeed(self, handle, min_speed=None, max_speed=None):
+        gpu = self.device(handle)
+
+        if min_speed == None or max_speed == None:
+            return [gpu.min_fan_speed, gpu.max_fan_speed]
+
+        min_speed._obj.value = gpu.min_fan_speed
+        max_speed._obj.value = gpu.max_fan_speed
+        return pynvml.NVML_SUCCESS
+
+    def nvmlDeviceGetFanControlPolicy_v2(self, handle, fan_idx, policy=None):
+        gpu = self.device(handle)
+        self.check_fan_index(gpu, fan_idx)
+
+        if policy == None:
+            return gpu.fan_policies[fan_idx]
+
+        policy._obj.value = gpu.fan_policies[fan_idx]
+        return pynvml.NVML_SUCCESS
+
+    def nvmlDeviceSetFanControlPolicy(self, handle, fan_idx, policy):
+        gpu = self.device(handle)
+        self.check_fan_index(gpu, fan_idx)
+        gpu.fan_policies[fan_idx] = policy
+
+    def nvmlDeviceGetPowerManagementLimit(self, handle):
+        return self.device(handle).power_limit_mw
+
+    def nvmlDeviceGetEnforcedPowerLimit(self, handle):
+        return self.device(handle).power_limit_mw
+
+    def nvmlDeviceGetPowerManagementLimitConstraints(self, handle):
+        gpu = self.device(handle)
+        return [gpu.min_power_limit_mw, gpu.max_power_limit_mw]
+
+    def nvmlDeviceSetPowerManagementLimit(self, handle, limit_mw):
+        gpu = self.device(handle)
+
+        if limit_mw < gpu.min_power_limit_mw or limit_mw > gpu.max_power_limit_mw:
+            raise pynvml.NVMLError(pynvml.NVML_ERROR_INVALID_ARGUMENT)
+
+        gpu.power_limit_mw = limit_mw
+
+    def nvmlDeviceGetTemperatureThreshold(self, handle, threshold_type):
+        gpu = self.device(handle)
+
+        match threshold_type:
+            case pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_CURR:
+                return gpu.acoustic_threshold
+            case pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_MIN:
+                return gpu.min_acoustic_threshold
+            case pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_MAX:
+                return gpu.max_acoustic_threshold
+
+        raise pynvml.NVMLError(pynvml.NVML_ERROR_NOT_SUPPORTED)
+
+    def nvmlDeviceSetTemperatureThreshold(self, handle, threshold_type, temperature):
+        gpu = self.device(handle)
+
+        if threshold_type != pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_CURR:
+            raise pynvml.NVMLError(pynvml.NVML_ERROR_NOT_SUPPORTED)
+
+        if temperature < gpu.min_acoustic_threshold or temperature > gpu.max_acoustic_threshold:
+            raise pynvml.NVMLError(pynvml.NVML_ERROR_INVALID_ARGUMENT)
+
+        gpu.acoustic_threshold = temperature
+
+    # Unknown fields are reported per value, like the driver does
+    def nvmlDeviceGetFieldValues(self, handle, field_ids):
+        gpu = self.device(handle)
+
+        fields = {
+            pynvml.NVML_FI_DEV_POWER_REQUESTED_LIMIT: gpu.power_limit_mw,
+            pynvml.NVML_FI_DEV_POWER_CURRENT_LIMIT: gpu.power_limit_mw,
+            pynvml.NVML_FI_DEV_POWER_MIN_LIMIT: gpu.min_power_limit_mw,
+            pynvml.NVML_FI_DEV_POWER_MAX_LIMIT: gpu.max_power_limit_mw,
+            pynvml.NVML_FI_DEV_POWER_INSTANT: int(gpu.power_draw_w() * 1000),
+        }
+
+        field_values = (pynvml.c_nvmlFieldValue_t * len(field_ids))()
+        for field_value, field_id in zip(field_values, field_ids):
+            field_value.fieldId = field_id
+            field_value.timestamp = int(self.clock.monotonic() * 1000000)
+
+            if field_id not in fields:
+                field_value.nvmlReturn = pynvml.NVML_ERROR_NOT_SUPPORTED
+                continue
+
+            field_value.nvmlReturn = pynvml.NVML_SUCCESS
+            field_value.valueType = pynvml.NVML_VALUE_TYPE_UNSIGNED_INT
+            field_value.value.uiVal = fields[field_id]
+
+        return field_values
+
+    def nvmlDeviceGetSupportedEventTypes(self, handle):
+        return self.device(handle).event_types
+
+    def nvmlDeviceRegisterEvents(self, handle, event_types, event_set):
+        gpu = self.device(handle)
+
+        if event_types & ~gpu.event_types != 0:
+            raise pynvml.NVMLError(pynvml.NVML_ERROR_NOT_SUPPORTED)
+
+        event_set.event_types[gpu] = event_set.event_types.get(gpu, 0) | event_types
+
+    def nvmlEventSetCreate(self):
+        self.nvmlDeviceGetCount()
+        return SimulatedEventSet()
+
+    # Sleeps on the simulated clock until the next registered event or the timeout. Events nobody registered for are dropped
+    def nvmlEventSetWait(self, event_set, timeout_ms):
+        now = self.clock.monotonic()
+        deadline = now + timeout_ms / 1000
+
+        while len(self.scheduled_events) != 0 and self.scheduled_events[0][0] <= deadline:
+            event_time, gpu, event_type = self.scheduled_events.pop(0)
+
+            if event_set.event_types.get(gpu, 0) & event_type == 0:
+                continue
+
+            self.clock.sleep(event_time - now)
+
+            event_data = pynvml.c_nvmlEventData_t()
+            event_data.eventType = event_type
+            return event_data
+
+        self.clock.sleep(deadline - now)
+        raise pynvml.NVMLError(pynvml.NVML_ERROR_TIMEOUT)
+
+    def nvmlEventSetFree(self, event_set):
+        event_set.freed = True
@@ -0,0 +1,162 @@
+import math
+import pynvml
+from log_writer import log_helper, error_print
+
+# Event-assisted control (--events): between ticks, the loop waits for an NVML event of the controlled GPUs instead of sleeping
+# An event (clocks or performance state changed, power source changed, critical Xid) starts a tick right away. Without events the loop
+# still ticks after the safety interval, since temperature changes don't have events of their own
+#
+# A burst of events (the clocks change many times per second under load) only starts one tick, and the ticks started by events are at
+# least --time-interval apart: the events that arrive in between are merged into the next tick
+
+# Event type -> name in the counters
+event_types = {
+    pynvml.nvmlEventTypeClock: 'clock',
+    pynvml.nvmlEventTypePState: 'pstate',
+    pynvml.nvmlEventTypePowerSourceChange: 'power_source',
+    pynvml.nvmlEventTypeXidCriticalError: 'xid',
+}
+
+wanted_event_types = sum(event_types)
+
+# Most events read after the first one of a burst
+max_burst_events = 64
+
+class EventWaiter:
+
+    # How often the event counts are logged
+    report_period_s = 300.0
+
+    def __init__(self, nvml, clock, event_set):
+        self.nvml = nvml
+        self.clock = clock
+        self.event_set = event_set
+        self.registered = set() # Labels of the GPUs whose events are being waited for
+        self.event_counts = {name: 0 for name in event_types.values()}
+        self.event_wakeups = 0 # Waits ended by an event
+        self.merged_events = 0 # Events that arrived before the minimum time between ticks, handled by the next tick
+        self.timeouts = 0 # Waits that reached the safety interval
+        self.report_start = clock.monotonic()
+        self.report_wakeups = 0
+        self.report_timeouts = 0
+
+    # Devices that come back after a failure are registered again, devices without any of the events are still controlled on the safety interval
+    def update(self, controlled_gpus):
+
+        for controlled_gpu in controlled_gpus:
+
+            if controlled_gpu.handle == None:
+                self.registered.discard(controlled_gpu.label)
+
+            elif controlled_gpu.label not in self.registered:
+                self.register(controlled_gpu)
+
+    def register(self, controlled_gpu):
+        self.registered.add(controlled_gpu.label)
+
+        try:
+            supported = self.nvml.nvmlDeviceGetSupportedEventTypes(controlled_gpu.handle) & wanted_event_types
+
+            if supported != 0:
+                self.nvml.nvmlDeviceRegisterEvents(controlled_gpu.handle, supported, self.event_set)
+
+        except pynvml.NVMLError as error:
+            error_print('{}: NVML events are not available ({}), it is only controlled on the safety interval', controlled_gpu.label, str(error))
+            return
+
+        if supported == 0:
+            error_print('{}: The GPU has none of the NVML events, it is only controlled on the safety interval', controlled_gpu.label)
+            return
+
+        log_helper('{}: Waiting for NVML events: {}', controlled_gpu.label, ', '.join(name for event_type, name in event_types.items() if supported & event_type != 0))
+
+    def count(self, event_data):
+        name = event_types.get(event_data.eventType)
+
+        if name != None:
+            self.event_counts[name] += 1
+
+    # Returns True when an event ended the wait
+    def wait(self, timeout_s):
+
+        try:
+            self.count(self.nvml.nvmlEventSetWait(self.event_set, int(timeout_s * 1000)))
+
+        except pynvml.NVMLError_Timeout:
+            self.timeouts += 1
+            self.report_timeouts += 1
+            self.report_if_due()
+            return False
+
+        # Keep waiting on the clock, so a broken event set doesn't make the loop spin
+        except pynvml.NVMLError as error:
+            error_print('Waiting for NVML events failed: {}', str(error))
+            self.clock.sleep(timeout_s)
+            return False
+
+        # The rest of the burst
+        for burst_event in range(max_burst_events):
+
+            try:
+                self.count(self.nvml.nvmlEventSetWait(self.event_set, 0))
+            except pynvml.NVMLError:
+                break
+
+        self.event_wakeups += 1
+        self.report_wakeups += 1
+        self.report_if_due()
+        return True
+
+    # Keeps reading events until the time is over, without starting a tick for them
+    def merge(self, duration_s):
+        end = self.clock.monotonic() + duration_s
+
+        while(True):
+            remaining_s = end - self.clock.monotonic()
+            if remaining_s <= 0:
+                return
+
+            try:
+                self.count(self.nvml.nvmlEventSetWait(self.event_set, math.ceil(remaining_s * 1000)))
+                self.merged_events += 1
+
+            except pynvml.NVMLError_Timeout:
+                return
+
+            except pynvml.NVMLError as error:
+                error_print('Waiting for NVML events failed: {}', str(error))
+                self.clock.sleep(remaining_s)
+                return
+
+    # The counters of the current worker, sent with the metrics sample (see metrics_server.py)
+    def metrics(self):
+        return {'events': dict(self.event_counts), 'event_wakeups': self.event_wakeups, 'event_timeouts': self.timeouts, 'merged_events': self.merged_events}
+
+    def report_if_due(self):
+        now = self.clock.monotonic()
+
+        if now - self.report_start >= EventWaiter.report_period_s:
+            event_counts = ', '.join(f'{name} {count}' for name, count in self.event_counts.items())
+            log_helper(f'NVML events: {self.report_wakeups} wakeups and {self.report_timeouts} safety interval timeouts in {now - self.report_start:.0f}s. Events so far: {event_counts}')
+
+            self.report_start = now
+            self.report_wakeups = 0
+            self.report_timeouts = 0
+
+    def close(self):
+
+        try:
+            self.nvml.nvmlEventSetFree(self.event_set)
+        except pynvml.NVMLError:
+            pass
+
+# Returns None when the driver has no events (e.g. on Windows), so the loop keeps polling
+def start_event_waiter(nvml, clock):
+
+    try:
+        event_set = nvml.nvmlEventSetCreate()
+    except pynvml.NVMLError as error:
+        error_print('NVML events are not available ({}), polling on the time interval instead', str(error))
+        return None
+
+    return EventWaiter(nvml, clock, event_set)
@@ -1,62 +1,63 @@
-from pynvml import *
 import sys
-import helper_functions as main_funcs
 import parse_args
-import time
-import multiprocessing
+import cli_help
+import info_report
 
-# This is working in a separate process
-def worker_task(config):
-
-    # So we need to reinitialize nvml
-    nvmlInit()
-    main_funcs.control_all(config)
-    nvmlShutdown()
-
-def control_worker(config):
-
-    while(True):
-        # Execute the GPU queries in a separate process, so it can be restarted on errors
-        process = multiprocessing.Process(target=worker_task, args=(config,), daemon=True)
-        process.start()
-        process.join()
-
-        if process.exitcode != 0:
-            print(f"Worker failed. Exit code: {process.exitcode}")
-            process.close()
-
-            if config.retry == True:
-                print(f"Retrying in {config.retry_interval_s} seconds\n")
-                time.sleep(config.retry_interval_s) 
-                continue               
-
-        # If everything works fine, we don't need to retry
-        process.close()
-        break
+# Only what every action needs is imported here. The rest (the NVML bindings, multiprocessing, numpy...) is imported by the actions that use it,
+# so printing the help or querying a value starts faster
 
 def main():
     
     # Getting a configuration obj
     config = parse_args.parse_cmd_args(sys.argv)
 
+    # No NVML needed
     if config.action == 'help':
-        main_funcs.print_help()
+        cli_help.print_help()
         return
 
-    nvmlInit()
+    # Runs offline, it doesn't need the driver
+    if config.action == 'replay':
+        import telemetry_replay
+        telemetry_replay.print_replay(config)
+        return
+
+    if config.action == 'tune':
+        import curve_tuner
+        curve_tuner.print_tune(config)
+        return
+
+    # A running control loop (--socket) already has the answer, the driver is only used when it can't answer
+    if config.socket_path != '' and config.action in info_report.info_actions:
+        import info_server
+
+        if info_server.print_daemon_info(config) == True:
+            return
+
+    import atexit
+    import helper_functions as main_funcs
+
+    main_funcs.configure_logging(config)
+    main_funcs.select_backend(config)
+    atexit.register(main_funcs.print_nvml_trace)
+    main_funcs.nvml.nvmlInit()
 
-    # Verify driver version
-    try:
-        main_funcs.check_driver_version(nvmlSystemGetDriverVersion())
+    # Verify driver version, only for the actions that change the settings of the GPU
+    if config.action in ['control', 'fan-policy']:
+        try:
+            main_funcs.check_driver_version(main_funcs.nvml.nvmlSystemGetDriverVersion())
 
-    except main_funcs.UnsupportedDriverVersion:
-        print('WARNING: You are running an unsupported driver, you may have problems')
+        except main_funcs.UnsupportedDriverVersion:
+            print('WARNING: You are running an unsupported driver, you may have problems')
     
     match config.action:
 
         # Information query
         case 'list':
-            main_funcs.list_gpus()
+            if config.json_output == True:
+                main_funcs.print_gpu_inventory()
+            else:
+                main_funcs.list_gpus()
 
         case 'get-power-limit-info':
             main_funcs.print_power_limit_info(config)
@@ -73,11 +74,12 @@ def main():
         case 'fan-policy-info':
             main_funcs.print_fan_policy_info(config)
 
-        # Enable everything
-        case 'control':
-            control_worker(config)
+        # Enable everything. record is the same loop without any settings, it only samples the GPUs
+        case 'control' | 'record':
+            import worker_process
+            worker_process.control_worker(config)
 
-    nvmlShutdown()
+    main_funcs.nvml.nvmlShutdown()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
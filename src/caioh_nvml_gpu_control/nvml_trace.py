@@ -0,0 +1,110 @@
+import pynvml
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets in microseconds, the last bucket takes everything above them
+latency_buckets_us = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 50000, 100000]
+
+# NVML return codes by value, for readable error counts
+nvml_error_names = {getattr(pynvml, name): name for name in dir(pynvml) if name.startswith('NVML_ERROR_')}
+
+# Statistics of a single NVML function
+class FunctionTrace:
+    def __init__(self):
+        self.calls = 0
+        self.errors = {} # NVML error name -> count
+        self.total_ns = 0
+        self.max_ns = 0
+        self.histogram = [0] * (len(latency_buckets_us) + 1)
+
+    def record(self, elapsed_ns, error=None):
+        self.calls += 1
+        self.total_ns += elapsed_ns
+        self.max_ns = max(self.max_ns, elapsed_ns)
+
+        bucket = 0
+        while bucket < len(latency_buckets_us) and elapsed_ns > latency_buckets_us[bucket] * 1000:
+            bucket += 1
+
+        self.histogram[bucket] += 1
+
+        if error is not None:
+            error_name = nvml_error_names.get(error.value, f'NVML_ERROR_{error.value}')
+            self.errors[error_name] = self.errors.get(error_name, 0) + 1
+
+    # Upper bound of the bucket where the percentile falls, so it is an estimate that errs on the slow side
+    def percentile_us(self, percentile):
+        target = self.calls * percentile / 100
+        count = 0
+
+        for bucket, bucket_count in enumerate(self.histogram):
+            count += bucket_count
+
+            if count >= target and bucket < len(latency_buckets_us):
+                return latency_buckets_us[bucket]
+
+        return self.max_ns / 1000
+
+# Backend wrapper that records every NVML call going through it (enabled with --trace-nvml)
+# The wrapped backend is looked up on every call, so patching it keeps working
+# The calls can come from several threads (--engine async). The lock is reentrant because the report is printed from a signal handler,
+# which can interrupt the main thread while it records a call
+class TracingBackend:
+    def __init__(self, backend):
+        self.backend = backend
+        self.traces = {} # Function name -> FunctionTrace
+        self.start_time = time.monotonic()
+        self.lock = threading.RLock()
+
+    def __getattr__(self, name):
+
+        def traced_call(*args):
+            function = getattr(self.backend, name)
+
+            start = time.perf_counter_ns()
+            try:
+                result = function(*args)
+            except pynvml.NVMLError as error:
+                self.record(name, time.perf_counter_ns() - start, error)
+                raise
+
+            self.record(name, time.perf_counter_ns() - start)
+            return result
+
+        self.__dict__[name] = traced_call
+        return traced_call
+
+    def record(self, name, elapsed_ns, error=None):
+
+        with self.lock:
+            trace = self.traces.get(name)
+
+            if trace == None:
+                trace = FunctionTrace()
+                self.traces[name] = trace
+
+            trace.record(elapsed_ns, error)
+
+    # Functions sorted by the total time spent on them, so the hot spots come first
+    def report(self):
+
+        with self.lock:
+            return self.format_report()
+
+    def format_report(self):
+        lines = [f'NVML trace: {time.monotonic() - self.start_time:.1f}s, {sum(trace.calls for trace in self.traces.values())} calls']
+        lines.append(f'{"Function":<45} {"Calls":>9} {"Total ms":>10} {"Avg us":>9} {"p50 us":>8} {"p99 us":>8} {"Max us":>9}  Errors')
+
+        for name, trace in sorted(self.traces.items(), key=lambda item: item[1].total_ns, reverse=True):
+            errors = ', '.join(f'{error_name}: {count}' for error_name, count in sorted(trace.errors.items()))
+            lines.append(f'{name:<45} {trace.calls:>9} {trace.total_ns / 1000000:>10.2f} {trace.total_ns / trace.calls / 1000:>9.1f} '
+                         f'{trace.percentile_us(50):>8g} {trace.percentile_us(99):>8g} {trace.max_ns / 1000:>9.1f}  {errors}')
+
+        lines.append('Latency histogram (calls per bucket, upper bound in us):')
+        bucket_names = [f'<={bound}' for bound in latency_buckets_us] + [f'>{latency_buckets_us[-1]}']
+
+        for name, trace in sorted(self.traces.items()):
+            buckets = ' '.join(f'{bucket_name}:{count}' for bucket_name, count in zip(bucket_names, trace.histogram) if count != 0)
+            lines.append(f'    {name}: {buckets}')
+
+        return '\n'.join(lines)
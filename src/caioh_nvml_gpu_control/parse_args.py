@@ -1,5 +1,9 @@
-import helper_functions
-from helper_functions import error_print
+import cli_help
+from log_writer import error_print
+import log_writer
+
+# The modules only needed by some options (fan_curve, telemetry_ring, config_file...) are imported where those options are parsed, so the
+# help and the actions that don't use them start faster
 
 class InvalidAction(Exception):
     pass
@@ -22,27 +26,174 @@ class InvalidTimeParameter(Exception):
 class InvalidConfig(Exception):
     pass
 
+class InvalidCurveType(Exception):
+    pass
+
+class InvalidTemperatureParameter(Exception):
+    pass
+
+class InvalidGpuCount(Exception):
+    pass
+
+class InvalidPort(Exception):
+    pass
+
+class InvalidLogFormat(Exception):
+    pass
+
+class InvalidRecordSize(Exception):
+    pass
+
+class InvalidCandidateCount(Exception):
+    pass
+
+class InvalidGpuSelector(Exception):
+    pass
+
+class InvalidEngine(Exception):
+    pass
+
+# No device matches a GPU selector (see device_index.py), or the selected GPU is not in a record file
+class GpuNotFound(Exception):
+    pass
+
+# How the control loop runs the GPUs of a tick: one after the other (sync), or in parallel with a deadline on each NVML call (async, see async_engine.py)
+engines = ['sync', 'async']
 
-class Configuration:
+
+# Settings that belong to a single GPU, so each device can have its own curve and limits
+class GpuConfiguration:
+
+    # Ways to select a device, from the most specific one. Only the first one that is set is used (see device_index.py)
+    selectors = ['gpu_uuid', 'gpu_pci', 'gpu_serial', 'gpu_index', 'gpu_name']
 
     def __init__(self):
-        # This only supports one target gpu, use a process for each GPU (erros become isolated to each other) 
-        self.target_gpu = ""
         self.gpu_name = ""
         self.gpu_uuid = ""
-        self.action = ""
+        self.gpu_pci = "" # PCI bus ID, as NVML writes it (see normalize_pci_bus_id)
+        self.gpu_serial = ""
+        self.gpu_index = "" # NVML device index
         self.temp_speed_pair = []
-        self.curve_type = "fixed" # Currently for internal usage only (I want to later add calculation for lines and curves fuctions)
+        self.curve_type = "step" # How the points between the temperature-speed pairs are calculated (see fan_curve.py)
         self.default_speed = 50 # Percentage
+        self.acoustic_temp_limit = 0 # The user must set the value
+        self.power_limit = 0 # The user must set the value
+
+    # Returns (selector, value), or (None, '') when no device was selected
+    def selector(self):
+
+        for selector in GpuConfiguration.selectors:
+            if getattr(self, selector) != '':
+                return selector, getattr(self, selector)
+
+        return None, ''
+
+    # How the device is called in the messages, the metrics and the record files
+    def label(self):
+        return selector_label(*self.selector())
+
+# Selector -> key of the device identifiers (see device_index.py)
+selector_keys = {
+    'gpu_uuid': 'uuid',
+    'gpu_pci': 'pci_bus_id',
+    'gpu_serial': 'serial',
+    'gpu_index': 'index',
+    'gpu_name': 'name',
+}
+
+def selector_label(selector, value):
+
+    if selector == 'gpu_index':
+        return f'index {value}'
+
+    return value
+
+# PCI bus IDs as NVML writes them (00000000:01:00.0), from any of the usual forms: 0000:01:00.0, 01:00.0...
+# Returns None when it is not a PCI bus ID
+def normalize_pci_bus_id(bus_id):
+    import re
+
+    match = re.fullmatch(r'(?:([0-9a-fA-F]{1,8}):)?([0-9a-fA-F]{1,2}):([0-9a-fA-F]{1,2})\.([0-7])', bus_id.strip())
+
+    if match == None:
+        return None
+
+    domain = int(match.group(1), 16) if match.group(1) != None else 0
+    bus, device, function = (int(match.group(group), 16) for group in range(2, 5))
+
+    if device > 0x1f:
+        return None
+
+    return f'{domain:08X}:{bus:02X}:{device:02X}.{function:X}'
+
+# Single GPU actions (and old code) still read the settings directly from the configuration, so they point to the first GPU
+def first_gpu_setting(setting_name):
+    return property(lambda self: getattr(self.gpus[0], setting_name), lambda self, value: setattr(self.gpus[0], setting_name, value))
+
+class Configuration:
+
+    gpu_name = first_gpu_setting('gpu_name')
+    gpu_uuid = first_gpu_setting('gpu_uuid')
+    gpu_pci = first_gpu_setting('gpu_pci')
+    gpu_serial = first_gpu_setting('gpu_serial')
+    gpu_index = first_gpu_setting('gpu_index')
+    temp_speed_pair = first_gpu_setting('temp_speed_pair')
+    curve_type = first_gpu_setting('curve_type')
+    default_speed = first_gpu_setting('default_speed')
+    acoustic_temp_limit = first_gpu_setting('acoustic_temp_limit')
+    power_limit = first_gpu_setting('power_limit')
+
+    def __init__(self):
+        # The control action drives all GPUs from a single process, each one with its own settings
+        self.gpus = [GpuConfiguration()]
+        self.target_gpu = ""
+        self.action = ""
         self.time_interval = 1.0 # In seconds
+        self.adaptive_interval = False # Use the min and max intervals below instead of time_interval
+        self.min_interval_s = 0.5 # In seconds
+        self.max_interval_s = 5.0 # In seconds
         self.retry_interval_s = 2.0 # In seconds
+        self.retry_max_interval_s = 60.0 # In seconds, the retry interval doubles on each identical failure up to this value
+        self.probe_interval_s = 300.0 # In seconds, retry interval after too many identical failures
+        self.engine = 'sync' # See engines
+        self.call_timeout_s = 2.0 # In seconds, deadline of each NVML call of the async engine
+        self.safe_fan_speed = 100 # Percentage, set by the async engine when a GPU misses a deadline
+        self.event_interval_s = 0.0 # In seconds, wait for NVML events between ticks for up to this long instead of the time interval (0 disables it, see nvml_events.py)
+        self.hysteresis = 0 # In celsius, how much the temperature must drop before lowering the fan speed
+        self.min_dwell_s = 0.0 # In seconds, minimum time to stay at a fan speed before lowering it
         self.dry_run = False
         self.fan_policy = ''
         self.single_use = False
-        self.acoustic_temp_limit = 0 # The user must set the value
-        self.power_limit = 0 # The user must set the value
         self.verbose = False # Omit log messages by default
         self.retry = False # Let the service manager restart the process instead, only retry when asked explicitly
+        self.standby = False # Keep a standby worker ready to take over when the active one fails
+        self.watchdog_timeout_s = 0.0 # In seconds, kill the worker when a tick takes longer than this (0 disables it)
+        self.simulated_gpus = 0 # Use this many simulated GPUs instead of the driver (0 uses the driver)
+        self.trace_nvml = False # Record the latency of every NVML call
+        self.metrics_port = 0 # Serve the Prometheus metrics on this port (0 disables it)
+        self.log_format = 'text' # See log_writer.py
+        self.record_path = '' # Record the telemetry of the control loop in this file (see telemetry_ring.py)
+        self.record_size_mb = 16 # Maximum size of the record file, the oldest records are overwritten
+        self.slowdown_temp = 90 # In celsius, the tune action keeps the temperature below it
+        self.tune_candidates = 4096 # Fan curves evaluated by the tune action
+        self.config_path = '' # Settings file (see config_file.py), the control loop reloads it when it changes
+        self.config_version = None # Version of the settings file that was read (see config_file.file_version)
+        self.command_line = [] # The arguments without the settings of the file, so it can be read again
+        self.json_output = False # The list action prints a JSON document with the details of every GPU
+        self.socket_path = '' # The control loop answers the info actions on this Unix socket, which the info actions try first (see info_server.py)
+        self.device_cache_path = '' # Keep the device index in this file, so the next processes find the devices faster (see device_index.py)
+
+    # Longest time between two ticks, for the watchdog deadline and the age of the info socket samples
+    def longest_interval(self):
+
+        if self.adaptive_interval == True:
+            return self.max_interval_s
+
+        # Without events from the driver, the loop goes back to the time interval
+        if self.event_interval_s != 0:
+            return max(self.event_interval_s, self.time_interval)
+
+        return self.time_interval
 
 class TempSpeedPair:
 
@@ -68,12 +219,48 @@ class TempSpeedPair:
             return False
 
 # Some sane checks (in case the user makes a bad config by accident)
-def validate_config(config):
+# show_warnings=False keeps the warnings of a settings reload from repeating the ones printed on startup
+def validate_config(config, show_warnings=True):
 
-    # At least one of the target setting must be configured
-    if config.gpu_name == '' and config.gpu_uuid == '':
-        error_print("You did not select a target GPU")
-        raise InvalidConfig("No GPU was selected")
+    # Only the control loop knows how to handle more than one GPU
+    if config.action not in ['control', 'record', 'replay'] and len(config.gpus) > 1:
+        error_print("Only the control, record and replay actions support multiple GPUs")
+        raise InvalidConfig("Multiple GPUs were selected")
+
+    # The list action shows every GPU
+    if config.action != 'list':
+        for gpu in config.gpus:
+            validate_gpu_config(config, gpu, show_warnings)
+
+    # The labels name the GPUs in the logs, metrics and settings reloads. Different selectors of the same device are found on attach
+    labels = [gpu.label() for gpu in config.gpus]
+    if config.action != 'list' and len(set(labels)) != len(labels):
+        error_print("The same GPU was selected more than once")
+        raise InvalidConfig("Duplicate GPU selector")
+
+    if config.standby == True and config.retry != True and show_warnings == True:
+        print(f'WARNING: The standby worker is only used with --retry')
+
+    # A tick only happens after the interval, so a shorter deadline would kill healthy workers
+    longest_interval_s = config.longest_interval()
+    if config.watchdog_timeout_s != 0 and config.watchdog_timeout_s <= longest_interval_s and show_warnings == True:
+        print(f'WARNING: The watchdog deadline ({config.watchdog_timeout_s}s) should be longer than the time interval ({longest_interval_s}s)')
+
+    if config.action in ['record', 'replay', 'tune'] and config.record_path == '':
+        error_print(f"The {config.action} action needs a file: --record <FILE>")
+        raise InvalidConfig("No record file was selected")
+
+    # The event set is waited on with the NVML call deadline of the async engine, so the events would always time out early
+    if config.engine == 'async' and config.event_interval_s != 0:
+        error_print("The async engine doesn't support --events")
+        raise InvalidConfig("Events with the async engine")
+
+    if config.socket_path != '':
+        import socket
+
+        if hasattr(socket, 'AF_UNIX') != True:
+            error_print("Unix sockets (--socket) are not available on this system")
+            raise InvalidConfig("Unix sockets are not supported")
 
     # fan-policy needs a mode
     if config.action == 'fan-policy':
@@ -81,29 +268,54 @@ def validate_config(config):
             error_print("You did not select a fan policy: autmatic or manual")
             raise InvalidConfig("No fan policy was selected")
 
+def validate_gpu_config(config, gpu, show_warnings=True):
+
+    # At least one of the target setting must be configured
+    if gpu.selector()[0] == None:
+        error_print("You did not select a target GPU")
+        raise InvalidConfig("No GPU was selected")
+
     # temp-control needs a power limit configuration
-    if config.action == 'control':
-        if len(config.temp_speed_pair) == 0 and config.power_limit == 0 and config.acoustic_temp_limit == 0:
-            error_print("You did not select any setting, please use one")
+    if config.action in ['control', 'replay']:
+        target = gpu.label()
+
+        if len(gpu.temp_speed_pair) == 0 and gpu.power_limit == 0 and gpu.acoustic_temp_limit == 0:
+            error_print(f"You did not select any setting for {target}, please use one")
             raise InvalidConfig("No setting was selected")
 
         # Print warnings just to let users know
-        if len(config.temp_speed_pair) == 0:
-            print(f'WARNING: There is no temperature-speed pairs configured')
+        if len(gpu.temp_speed_pair) == 0 and show_warnings == True:
+            print(f'WARNING: There is no temperature-speed pairs configured for {target}')
 
-        if config.power_limit == 0:
-            print(f'WARNING: There is no power limit configured')
+        if gpu.power_limit == 0 and show_warnings == True:
+            print(f'WARNING: There is no power limit configured for {target}')
         
-        if config.acoustic_temp_limit == 0:
-            print(f'WARNING: There is no temperature limit configured')
+        if gpu.acoustic_temp_limit == 0 and show_warnings == True:
+            print(f'WARNING: There is no temperature limit configured for {target}')
+
+    # Recording only watches the GPU, control --record changes the settings while recording
+    if config.action == 'record':
+        if len(gpu.temp_speed_pair) != 0 or gpu.power_limit != 0 or gpu.acoustic_temp_limit != 0:
+            error_print("The record action doesn't change any setting, use control --record instead")
+            raise InvalidConfig("Settings were selected for the record action")
+
+# Selecting a GPU again with the same kind of selector starts the settings of a new GPU
+def select_gpu(configuration, selector, value):
+    gpu = configuration.gpus[-1]
+
+    if getattr(gpu, selector) != '':
+        gpu = GpuConfiguration()
+        configuration.gpus.append(gpu)
 
+    setattr(gpu, selector, value)
 
-def parse_cmd_args(args):
+def parse_cmd_args(args, show_warnings=True):
 
     configuration = Configuration()
+    configuration.command_line = list(args)
 
     if len(args) == 1:
-        helper_functions.print_help()
+        cli_help.print_help()
         error_print(f'You must pass more arguments')
         raise InsufficientArgs("No action was supplied")
 
@@ -118,7 +330,6 @@ def parse_cmd_args(args):
 
     elif (action == 'list'):
         configuration.action = 'list'
-        return configuration # It should stop here, ignore all other args
 
     elif (action == 'fan-info'):
         configuration.action = 'fan-info'
@@ -138,24 +349,72 @@ def parse_cmd_args(args):
     elif (action == 'control'):
         configuration.action = 'control'
 
+    elif (action == 'record'):
+        configuration.action = 'record'
+
+    elif (action == 'replay'):
+        configuration.action = 'replay'
+
+    elif (action == 'tune'):
+        configuration.action = 'tune'
+
     else:
-        helper_functions.print_help()
+        cli_help.print_help()
         print(f'Invalid action: {action}\n\n')
         raise InvalidAction("The action passed as argument is incorrect")
 
 
+    # Marker between the GPUs of the settings file (config_file.next_gpu), only known once a file is read
+    next_gpu = None
+
     # You can safely ignore the action here
     i = 2
     while(i < len(args)):
 
         arg = args[i]
 
-        if (arg == '--name' or arg == '-n'):
-            configuration.gpu_name = args[i+1]
+        # GPU specific options always apply to the last selected GPU
+        gpu = configuration.gpus[-1]
+
+        # Each GPU of the settings file starts its own group of settings
+        if next_gpu != None and arg is next_gpu:
+            if gpu.selector()[0] != None:
+                configuration.gpus.append(GpuConfiguration())
+
+        elif (arg == '--name' or arg == '-n'):
+            select_gpu(configuration, 'gpu_name', args[i+1])
             i += 1 # Skip the next iteration
 
         elif (arg == '--uuid' or arg == '-id'):
-            configuration.gpu_uuid = args[i+1]
+            select_gpu(configuration, 'gpu_uuid', args[i+1])
+            i += 1 # Skip the next iteration
+
+        elif (arg == '--pci' or arg == '-pci'):
+            bus_id = normalize_pci_bus_id(args[i+1])
+            i += 1 # Skip the next iteration
+
+            if bus_id == None:
+                error_print(f'Invalid PCI bus ID: {args[i]}. Use the DOMAIN:BUS:DEVICE.FUNCTION form, e.g. 0000:01:00.0')
+                raise InvalidGpuSelector("Invalid PCI bus ID")
+
+            select_gpu(configuration, 'gpu_pci', bus_id)
+
+        elif (arg == '--serial' or arg == '-sn'):
+            select_gpu(configuration, 'gpu_serial', args[i+1])
+            i += 1 # Skip the next iteration
+
+        elif (arg == '--index' or arg == '-ix'):
+            gpu_index = int(args[i+1])
+            i += 1 # Skip the next iteration
+
+            if gpu_index < 0:
+                error_print("The device index cannot be negative")
+                raise InvalidGpuSelector("Invalid device index")
+
+            select_gpu(configuration, 'gpu_index', str(gpu_index))
+
+        elif (arg == '--device-cache' or arg == '-dc'):
+            configuration.device_cache_path = args[i+1]
             i += 1 # Skip the next iteration
 
         elif (arg == '--speed-pair' or arg == '-sp'):
@@ -182,12 +441,22 @@ def parse_cmd_args(args):
                     error_print(f'The fan speed cannot be lower than 0%. You chose {speed}')
                     raise InvalidFanSpeed(f'The fan speed cannot be lower than 0%. You chose {speed}')
 
-                configuration.temp_speed_pair.append( TempSpeedPair(temp, speed) )
+                gpu.temp_speed_pair.append( TempSpeedPair(temp, speed) )
 
             i += 1 # Skip the next iteration
 
+        elif (arg == '--curve-type' or arg == '-ct'):
+            gpu.curve_type = args[i+1]
+            i += 1 # Skip the next iteration
+
+            import fan_curve
+
+            if gpu.curve_type not in fan_curve.curve_types:
+                error_print(f'Invalid curve type: {gpu.curve_type}. Use one of: {", ".join(fan_curve.curve_types)}')
+                raise InvalidCurveType('The curve type given was invalid')
+
         elif (arg == '--default-speed' or arg == '-ds'):
-            configuration.default_speed = int(args[i+1])
+            gpu.default_speed = int(args[i+1])
             i += 1 # Skip the next iteration
 
         elif (arg == '--time-interval' or arg == '-ti'):
@@ -199,6 +468,78 @@ def parse_cmd_args(args):
                 error_print("You cannot use negative time values for intervals")
                 raise InvalidTimeParameter("Invalid time parameter")
 
+        elif (arg == '--retry-max-interval' or arg == '-rm'):
+            configuration.retry_max_interval_s = float(args[i+1])
+            i += 1 # Skip the next iteration
+
+            # Refuse to continue with negative time values
+            if configuration.retry_max_interval_s < 0:
+                error_print("You cannot use negative time values for intervals")
+                raise InvalidTimeParameter("Invalid time parameter")
+
+        elif (arg == '--probe-interval' or arg == '-pi'):
+            configuration.probe_interval_s = float(args[i+1])
+            i += 1 # Skip the next iteration
+
+            # Refuse to continue with negative time values
+            if configuration.probe_interval_s < 0:
+                error_print("You cannot use negative time values for intervals")
+                raise InvalidTimeParameter("Invalid time parameter")
+
+        elif (arg == '--adaptive-interval' or arg == '-ai'):
+            intervals = args[i+1].split(':')
+            i += 1 # Skip the next iteration
+
+            if (len(intervals) != 2):
+                error_print('The adaptive interval needs a minimum and a maximum time: MIN:MAX')
+                raise InvalidTimeParameter("Invalid time parameter")
+
+            configuration.adaptive_interval = True
+            configuration.min_interval_s = float(intervals[0])
+            configuration.max_interval_s = float(intervals[1])
+
+            # Refuse to continue with negative time values
+            if configuration.min_interval_s < 0 or configuration.max_interval_s < 0:
+                error_print("You cannot use negative time values for intervals")
+                raise InvalidTimeParameter("Invalid time parameter")
+
+            if configuration.min_interval_s > configuration.max_interval_s:
+                error_print("The minimum interval cannot be higher than the maximum interval")
+                raise InvalidTimeParameter("Invalid time parameter")
+
+        elif (arg == '--engine' or arg == '-en'):
+            configuration.engine = args[i+1]
+            i += 1 # Skip the next iteration
+
+            if configuration.engine not in engines:
+                error_print(f'Invalid engine: {configuration.engine}. Use one of: {", ".join(engines)}')
+                raise InvalidEngine('The engine given was invalid')
+
+        elif (arg == '--call-timeout' or arg == '-cto'):
+            configuration.call_timeout_s = float(args[i+1])
+            i += 1 # Skip the next iteration
+
+            if configuration.call_timeout_s <= 0:
+                error_print("The NVML call deadline must be higher than 0")
+                raise InvalidTimeParameter("Invalid time parameter")
+
+        elif (arg == '--safe-speed' or arg == '-ss'):
+            configuration.safe_fan_speed = int(args[i+1])
+            i += 1 # Skip the next iteration
+
+            if configuration.safe_fan_speed < 0 or configuration.safe_fan_speed > 100:
+                error_print(f'The safe fan speed must be between 0% and 100%. You chose {configuration.safe_fan_speed}')
+                raise InvalidFanSpeed('Invalid safe fan speed')
+
+        elif (arg == '--events' or arg == '-ev'):
+            configuration.event_interval_s = float(args[i+1])
+            i += 1 # Skip the next iteration
+
+            # The loop always needs the safety tick, temperature changes don't have events
+            if configuration.event_interval_s <= 0:
+                error_print("The safety interval of the events must be higher than 0")
+                raise InvalidTimeParameter("Invalid time parameter")
+
         elif (arg == '--retry-interval' or arg == '-ri'):
             configuration.retry_interval_s = float(args[i+1])
             i += 1 # Skip the next iteration
@@ -208,6 +549,23 @@ def parse_cmd_args(args):
                 error_print("You cannot use negative time values for intervals")
                 raise InvalidTimeParameter("Invalid time parameter")
 
+        elif (arg == '--hysteresis' or arg == '-hy'):
+            configuration.hysteresis = int(args[i+1])
+            i += 1 # Skip the next iteration
+
+            if configuration.hysteresis < 0:
+                error_print("You cannot use negative temperature values for hysteresis")
+                raise InvalidTemperatureParameter("Invalid temperature parameter")
+
+        elif (arg == '--min-dwell' or arg == '-md'):
+            configuration.min_dwell_s = float(args[i+1])
+            i += 1 # Skip the next iteration
+
+            # Refuse to continue with negative time values
+            if configuration.min_dwell_s < 0:
+                error_print("You cannot use negative time values for intervals")
+                raise InvalidTimeParameter("Invalid time parameter")
+
         elif (arg == '--dry-run' or arg == '-dr'):
             configuration.dry_run = True
 
@@ -217,6 +575,93 @@ def parse_cmd_args(args):
         elif (arg == '--retry' or arg == '-rt'):
             configuration.retry = True
 
+        elif (arg == '--standby' or arg == '-sb'):
+            configuration.standby = True
+
+        elif (arg == '--watchdog' or arg == '-wd'):
+            configuration.watchdog_timeout_s = float(args[i+1])
+            i += 1 # Skip the next iteration
+
+            # Refuse to continue with negative time values
+            if configuration.watchdog_timeout_s < 0:
+                error_print("You cannot use negative time values for intervals")
+                raise InvalidTimeParameter("Invalid time parameter")
+
+        elif (arg == '--metrics-port' or arg == '-mp'):
+            configuration.metrics_port = int(args[i+1])
+            i += 1 # Skip the next iteration
+
+            if configuration.metrics_port < 1 or configuration.metrics_port > 65535:
+                error_print("The port must be between 1 and 65535")
+                raise InvalidPort("Invalid port")
+
+        elif (arg == '--log-format' or arg == '-lf'):
+            configuration.log_format = args[i+1]
+            i += 1 # Skip the next iteration
+
+            if configuration.log_format not in log_writer.log_formats:
+                error_print(f'Invalid log format: {configuration.log_format}. Use one of: {", ".join(log_writer.log_formats)}')
+                raise InvalidLogFormat("Invalid log format")
+
+        elif (arg == '--trace-nvml' or arg == '-tn'):
+            configuration.trace_nvml = True
+
+        elif (arg == '--simulate' or arg == '-sim'):
+            configuration.simulated_gpus = int(args[i+1])
+            i += 1 # Skip the next iteration
+
+            if configuration.simulated_gpus < 1:
+                error_print("The number of simulated GPUs must be at least 1")
+                raise InvalidGpuCount("Invalid GPU count")
+
+        elif (arg == '--record' or arg == '-rc'):
+            configuration.record_path = args[i+1]
+            i += 1 # Skip the next iteration
+
+        elif (arg == '--record-size' or arg == '-rs'):
+            configuration.record_size_mb = float(args[i+1])
+            i += 1 # Skip the next iteration
+
+            if configuration.record_size_mb < 1:
+                error_print("The record file must have at least 1 MB")
+                raise InvalidRecordSize("Invalid record size")
+
+        # The settings of the file are read as if they were given here, so the options after it override them
+        elif (arg == '--config' or arg == '-cf'):
+            import config_file
+
+            next_gpu = config_file.next_gpu
+            configuration.config_path = args[i+1]
+            configuration.config_version = config_file.file_version(configuration.config_path)
+
+            try:
+                file_args = config_file.load_config_args(configuration.config_path)
+            except config_file.InvalidConfigFile as error:
+                error_print(str(error))
+                raise
+
+            args = args[:i+2] + file_args + args[i+2:]
+            i += 1 # Skip the next iteration
+
+        elif (arg == '--json' or arg == '-js'):
+            configuration.json_output = True
+
+        elif (arg == '--socket' or arg == '-so'):
+            configuration.socket_path = args[i+1]
+            i += 1 # Skip the next iteration
+
+        elif (arg == '--slowdown-temp' or arg == '-st'):
+            configuration.slowdown_temp = int(args[i+1])
+            i += 1 # Skip the next iteration
+
+        elif (arg == '--candidates' or arg == '-cn'):
+            configuration.tune_candidates = int(args[i+1])
+            i += 1 # Skip the next iteration
+
+            if configuration.tune_candidates < 1:
+                error_print("The tune action needs at least 1 candidate curve")
+                raise InvalidCandidateCount("Invalid candidate count")
+
         # For the fan-policy action
         elif (arg == '--auto'):
             configuration.fan_policy = 'automatic'
@@ -228,15 +673,15 @@ def parse_cmd_args(args):
             configuration.single_use = True
 
         elif (arg == '--acoustic-temp-limit' or arg == '-tl'):
-            configuration.acoustic_temp_limit = int(args[i+1])
+            gpu.acoustic_temp_limit = int(args[i+1])
             i += 1 # Skip the next iteration
 
         elif (arg == '--power-limit' or arg == '-pl'):
-            configuration.power_limit = int(args[i+1])
+            gpu.power_limit = int(args[i+1])
             i += 1 # Skip the next iteration
 
         else:
-            helper_functions.print_help()
+            cli_help.print_help()
             error_print(f'Invalid option: {arg}\n\n')
             raise InvalidOption('The option given was invalid')
 
@@ -244,8 +689,9 @@ def parse_cmd_args(args):
         i += 1
 
     # Organizing the array before sending the configuration
-    configuration.temp_speed_pair.sort(reverse=True)
+    for gpu in configuration.gpus:
+        gpu.temp_speed_pair.sort(reverse=True)
 
-    validate_config(configuration)
+    validate_config(configuration, show_warnings)
 
     return configuration
\ No newline at end of file
@@ -0,0 +1,208 @@
+import datetime
+import statistics
+import time
+import telemetry_ring
+import control_subroutines
+from log_writer import logger, error_print
+from info_report import output_separator
+from parse_args import GpuNotFound
+
+# Runs a record file (--record) through the same subroutines as the control loop, so a new curve or limit can be tried on real traces
+#
+# The temperatures and the power usage come from the recording, so the effect of the new settings on them is not modeled. The settings
+# written by the replay are assumed to take effect right away (the next sample sees the new fan speed, power limit and acoustic threshold)
+
+# A pause in the recording longer than this many intervals (e.g. the program was stopped) doesn't count as time at a fan speed
+max_gap_intervals = 10
+
+class ReplaySummary:
+    def __init__(self, label):
+        self.label = label
+        self.samples = 0
+        self.failed_samples = 0 # Samples taken while the device was failing
+        self.start_time = None
+        self.end_time = None
+        self.peak_temperature = None
+        self.peak_temperature_time = None
+        self.power_usage_sum = 0.0
+        self.power_usage_samples = 0
+        self.max_power_usage = None
+        self.fan_writes = 0
+        self.fan_writes_suppressed = 0
+        self.power_limit_writes = 0
+        self.acoustic_limit_writes = 0
+        self.recorded_fan_writes = 0 # Writes of the settings used while recording, for comparison
+        self.recorded_power_limit_writes = 0
+        self.recorded_acoustic_limit_writes = 0
+        self.time_at_speed = {} # Fan speed -> seconds
+
+def count_recorded_actions(summary, sample):
+
+    if sample.flags & telemetry_ring.flag_fan_write != 0:
+        summary.recorded_fan_writes += 1
+
+    if sample.flags & telemetry_ring.flag_power_limit_write != 0:
+        summary.recorded_power_limit_writes += 1
+
+    if sample.flags & telemetry_ring.flag_acoustic_limit_write != 0:
+        summary.recorded_acoustic_limit_writes += 1
+
+# The device as the control subroutines would see it, with the settings written by the replay
+def replay_snapshot(sample, fan_speed, power_limit, acoustic_limit):
+    snapshot = control_subroutines.DeviceSnapshot()
+    snapshot.time = sample.time
+    snapshot.temperature = sample.temperature
+    snapshot.fan_speeds = [fan_speed] * len(sample.fan_speeds)
+    snapshot.fan_speed = fan_speed
+    snapshot.current_power_limit = power_limit
+    snapshot.enforced_power_limit = power_limit
+    snapshot.power_usage = sample.power_usage
+
+    # The record doesn't have the constraints, so the target is always considered valid
+    snapshot.power_limit_constraints = control_subroutines.PowerLimitConstraintsWatts(0, 2 ** 16)
+    snapshot.temperature_thresholds = control_subroutines.TemperatureThresholds(None, None, None, None, -2 ** 15, acoustic_limit, 2 ** 15)
+
+    return snapshot
+
+def replay_gpu(configuration, gpu_config, samples):
+    controlled_gpu = control_subroutines.GpuControlState(gpu_config)
+    summary = ReplaySummary(controlled_gpu.label)
+
+    # The device starts as it was recorded
+    first_sample = samples[0]
+    fan_speed = first_sample.fan_speeds[0] if len(first_sample.fan_speeds) != 0 else 0
+    power_limit = first_sample.power_limit if first_sample.power_limit != None else 0
+    acoustic_limit = first_sample.acoustic_limit if first_sample.acoustic_limit != None else 0
+
+    intervals = [next_sample.time - sample.time for sample, next_sample in zip(samples, samples[1:])]
+    max_gap_s = statistics.median(intervals) * max_gap_intervals if len(intervals) != 0 else 0.0
+
+    for sample_idx, sample in enumerate(samples):
+        summary.samples += 1
+        count_recorded_actions(summary, sample)
+
+        if summary.start_time == None:
+            summary.start_time = sample.time
+        summary.end_time = sample.time
+
+        if sample.flags & telemetry_ring.flag_up == 0 or sample.temperature == None:
+            summary.failed_samples += 1
+            continue
+
+        if summary.peak_temperature == None or sample.temperature > summary.peak_temperature:
+            summary.peak_temperature = sample.temperature
+            summary.peak_temperature_time = sample.time
+
+        if sample.power_usage != None:
+            summary.power_usage_sum += sample.power_usage
+            summary.power_usage_samples += 1
+            summary.max_power_usage = sample.power_usage if summary.max_power_usage == None else max(summary.max_power_usage, sample.power_usage)
+
+        # Settings that are not replayed keep their recorded values
+        if len(gpu_config.temp_speed_pair) == 0 and len(sample.fan_speeds) != 0:
+            fan_speed = sample.fan_speeds[0]
+
+        controlled_gpu.snapshot = replay_snapshot(sample, fan_speed, power_limit, acoustic_limit)
+
+        # Same order as control_gpu
+        if gpu_config.power_limit != 0:
+            control_subroutines.power_control_subroutine(controlled_gpu, configuration)
+            power_limit = gpu_config.power_limit
+
+        if gpu_config.acoustic_temp_limit != 0:
+            control_subroutines.temp_control_subroutine(controlled_gpu, configuration)
+            acoustic_limit = gpu_config.acoustic_temp_limit
+
+        if len(gpu_config.temp_speed_pair) != 0:
+            control_subroutines.fan_control_subroutine(controlled_gpu, configuration)
+            fan_speed = controlled_gpu.fan_target
+
+        # The speed is kept until the next sample
+        if sample_idx < len(intervals) and intervals[sample_idx] <= max_gap_s:
+            summary.time_at_speed[fan_speed] = summary.time_at_speed.get(fan_speed, 0.0) + intervals[sample_idx]
+
+    summary.fan_writes = controlled_gpu.fan_writes_issued
+    summary.fan_writes_suppressed = controlled_gpu.fan_writes_suppressed
+    summary.power_limit_writes = controlled_gpu.power_limit_writes
+    summary.acoustic_limit_writes = controlled_gpu.acoustic_limit_writes
+
+    return summary
+
+# Returns a ReplaySummary for each selected GPU
+def replay_record(configuration):
+    reader = telemetry_ring.TelemetryReader(configuration.record_path)
+
+    try:
+        gpu_labels = reader.gpu_labels
+        samples = reader.samples()
+    finally:
+        reader.close()
+
+    replayed_gpus = []
+
+    for gpu_config in configuration.gpus:
+        label = gpu_config.label()
+
+        if label not in gpu_labels:
+            error_print(f'{label} was not recorded in {configuration.record_path}. Recorded devices: {", ".join(gpu_labels)}')
+            raise GpuNotFound('The device was not recorded')
+
+        gpu_index = gpu_labels.index(label)
+        gpu_samples = [sample for sample in samples if sample.gpu_index == gpu_index]
+
+        if len(gpu_samples) == 0:
+            error_print(f'There are no samples of {label} in {configuration.record_path}')
+            raise GpuNotFound('The device has no samples')
+
+        replayed_gpus.append((gpu_config, gpu_samples))
+
+    # Nothing is written to the devices (there aren't any) and the messages of each write would flood the output
+    dry_run = configuration.dry_run
+    configuration.dry_run = True
+    logger.muted = configuration.verbose != True
+
+    try:
+        summaries = [replay_gpu(configuration, gpu_config, gpu_samples) for gpu_config, gpu_samples in replayed_gpus]
+
+    finally:
+        configuration.dry_run = dry_run
+        logger.muted = False
+
+    return summaries
+
+def format_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+def print_replay(configuration):
+    start = time.perf_counter()
+    summaries = replay_record(configuration)
+    elapsed = time.perf_counter() - start
+
+    replayed_s = sum(summary.end_time - summary.start_time for summary in summaries)
+    print(f'Replayed {sum(summary.samples for summary in summaries)} samples of {configuration.record_path} in {elapsed:.3f}s ({replayed_s / max(elapsed, 1e-9):.0f}x faster than real time)')
+    print('Temperatures and power usage come from the recording, the effect of the new settings on them is not modeled')
+    print(f'{output_separator}')
+
+    for summary in summaries:
+        print(f'Device: {summary.label}')
+        print(f'Recorded from {format_time(summary.start_time)} to {format_time(summary.end_time)} ({summary.end_time - summary.start_time:.0f}s)')
+        print(f'Samples: {summary.samples} ({summary.failed_samples} while the device was failing)')
+
+        if summary.peak_temperature != None:
+            print(f'Peak temperature: {summary.peak_temperature}°C at {format_time(summary.peak_temperature_time)}')
+
+        if summary.power_usage_samples != 0:
+            print(f'Power usage: avg {summary.power_usage_sum / summary.power_usage_samples:.1f}W, max {summary.max_power_usage:.1f}W')
+
+        print(f'Fan speed writes: {summary.fan_writes} (recorded: {summary.recorded_fan_writes}), {summary.fan_writes_suppressed} held back by the hysteresis or the minimum dwell time')
+        print(f'Power limit writes: {summary.power_limit_writes} (recorded: {summary.recorded_power_limit_writes})')
+        print(f'Acoustic threshold writes: {summary.acoustic_limit_writes} (recorded: {summary.recorded_acoustic_limit_writes})')
+
+        total_s = sum(summary.time_at_speed.values())
+        if total_s > 0:
+            print('Time at each fan speed:')
+
+            for speed, speed_s in sorted(summary.time_at_speed.items()):
+                print(f'    {speed}%: {speed_s:.0f}s ({speed_s / total_s * 100:.1f}%)')
+
+        print(f'{output_separator}')
@@ -0,0 +1,241 @@
+import json
+import math
+import mmap
+import os
+import struct
+
+# Telemetry history of the control loop (--record), kept in a file with a fixed size:
+#
+#   [header: 64 bytes][metadata: JSON padded with zeros up to data_offset][record 0][record 1]...[record capacity - 1]
+#
+# Records are written in a ring, the oldest one is overwritten when the file is full. The file is memory-mapped, so writing a record is a
+# single copy into the page cache (the OS writes it back to the disk) and other processes can read it while the control loop is running
+
+magic = b'NVGCRING'
+format_version = 1
+
+# magic, format version, max fans per record, record size, capacity (records), written records (keeps growing, the slot is written % capacity)
+header_struct = struct.Struct('<8sHHIIQ')
+written_offset = 20 # Offset of the written records in the header
+header_size = 64
+data_offset = 4096 # The metadata fills the rest of the first page
+
+max_fans = 8
+
+# sequence, time, gpu index, flags, temperature, acoustic limit, fan target, fan count, fan speeds, power limit, enforced power limit, power usage
+# The sequence is the number of the record + 1 (0 while it is being written), so readers can tell when a slot was overwritten under them
+record_struct = struct.Struct(f'<QdHHhhBB{max_fans}BHHf6x')
+sequence_struct = struct.Struct('<Q')
+
+# Unknown values (e.g. a failed device or a value the loop didn't sample)
+no_temperature = -32768
+no_fan_target = 255
+no_power_limit = 65535
+
+# What happened to the device during the tick
+flag_up = 1
+flag_fan_write = 2
+flag_fan_held = 4 # The hysteresis or the minimum dwell time held back a fan speed change
+flag_power_limit_write = 8
+flag_acoustic_limit_write = 16
+flag_device_error = 32
+
+flag_names = [
+    (flag_fan_write, 'fan write'),
+    (flag_fan_held, 'fan speed held'),
+    (flag_power_limit_write, 'power limit write'),
+    (flag_acoustic_limit_write, 'acoustic limit write'),
+    (flag_device_error, 'device error'),
+]
+
+class InvalidRecordFile(Exception):
+    pass
+
+def capacity_for_size(size_bytes):
+    return max(1, (size_bytes - data_offset) // record_struct.size)
+
+def clamp(value, minimum, maximum):
+    return max(minimum, min(maximum, int(value)))
+
+# A decoded record
+class TelemetrySample:
+    __slots__ = ('sequence', 'time', 'gpu_index', 'gpu', 'flags', 'temperature', 'acoustic_limit', 'fan_target', 'fan_speeds',
+                 'power_limit', 'enforced_power_limit', 'power_usage')
+
+    def __init__(self, values, gpu_labels):
+        self.sequence = values[0]
+        self.time = values[1]
+        self.gpu_index = values[2]
+        self.gpu = gpu_labels[self.gpu_index] if self.gpu_index < len(gpu_labels) else str(self.gpu_index)
+        self.flags = values[3]
+        self.temperature = values[4] if values[4] != no_temperature else None
+        self.acoustic_limit = values[5] if values[5] != no_temperature else None
+        self.fan_target = values[6] if values[6] != no_fan_target else None
+        self.fan_speeds = list(values[8:8 + values[7]])
+        self.power_limit = values[8 + max_fans] if values[8 + max_fans] != no_power_limit else None
+        self.enforced_power_limit = values[9 + max_fans] if values[9 + max_fans] != no_power_limit else None
+        self.power_usage = values[10 + max_fans] if math.isnan(values[10 + max_fans]) != True else None
+
+    def actions(self):
+        return [name for flag, name in flag_names if self.flags & flag != 0]
+
+# Written by the control loop, one record per device and tick
+class TelemetryRecorder:
+
+    def __init__(self, path, size_mb, gpu_labels):
+        self.path = path
+        self.gpu_labels = list(gpu_labels)
+        self.capacity = capacity_for_size(int(size_mb * 1024 * 1024))
+        self.last_counters = [(0, 0, 0, 0, 0)] * len(self.gpu_labels) # Counters of the previous tick (they start at 0 in each worker), to tell what was done in this one
+
+        size = data_offset + self.capacity * record_struct.size
+        metadata = json.dumps({'gpus': self.gpu_labels}).encode('utf-8')
+
+        if len(metadata) > data_offset - header_size:
+            raise InvalidRecordFile('Too many GPUs to record in a single file')
+
+        # Keep the history of the previous runs (e.g. a restarted worker) when the file has the same layout and devices
+        self.written = self.existing_records(size, metadata)
+
+        self.file = open(path, 'r+b' if self.written != None else 'w+b')
+
+        if self.written == None:
+            self.written = 0
+            self.file.truncate(size)
+
+        self.map = mmap.mmap(self.file.fileno(), size)
+
+        header_struct.pack_into(self.map, 0, magic, format_version, max_fans, record_struct.size, self.capacity, self.written)
+        self.map[header_size:header_size + len(metadata)] = metadata
+
+    def existing_records(self, size, metadata):
+
+        try:
+            if os.path.getsize(self.path) != size:
+                return None
+
+            reader = TelemetryReader(self.path)
+        except (OSError, InvalidRecordFile):
+            return None
+
+        try:
+            if reader.capacity != self.capacity or reader.gpu_labels != self.gpu_labels:
+                return None
+
+            return reader.written()
+        finally:
+            reader.close()
+
+    # Only packs values the control loop already sampled, it doesn't make any NVML calls
+    def record_tick(self, controlled_gpus, now):
+
+        for gpu_index, controlled_gpu in enumerate(controlled_gpus):
+            snapshot = controlled_gpu.snapshot
+            counters = (controlled_gpu.fan_writes_issued, controlled_gpu.fan_writes_suppressed, controlled_gpu.power_limit_writes,
+                        controlled_gpu.acoustic_limit_writes, controlled_gpu.device_errors)
+            last_counters = self.last_counters[gpu_index]
+            self.last_counters[gpu_index] = counters
+
+            flags = 0
+
+            if controlled_gpu.last_error is None and controlled_gpu.handle != None:
+                flags |= flag_up
+
+            for flag, counter, last_counter in zip((flag_fan_write, flag_fan_held, flag_power_limit_write, flag_acoustic_limit_write, flag_device_error), counters, last_counters):
+                if counter != last_counter:
+                    flags |= flag
+
+            temperature = no_temperature
+            acoustic_limit = no_temperature
+            fan_speeds = []
+            power_limit = no_power_limit
+            enforced_power_limit = no_power_limit
+            power_usage = math.nan
+
+            # A failed device keeps its last snapshot, which is not a new sample
+            if snapshot != None and flags & flag_up != 0:
+                if snapshot.temperature != None:
+                    temperature = clamp(snapshot.temperature, -32767, 32767)
+
+                if snapshot.temperature_thresholds != None:
+                    acoustic_limit = clamp(snapshot.temperature_thresholds.current_acoustic, -32767, 32767)
+
+                fan_speeds = snapshot.fan_speeds[:max_fans]
+
+                if snapshot.power_limit_constraints != None:
+                    power_limit = clamp(snapshot.current_power_limit, 0, no_power_limit - 1)
+                    enforced_power_limit = clamp(snapshot.enforced_power_limit, 0, no_power_limit - 1)
+
+                if snapshot.power_usage != None:
+                    power_usage = snapshot.power_usage
+
+            fan_target = no_fan_target if controlled_gpu.fan_target == None else clamp(controlled_gpu.fan_target, 0, 100)
+
+            self.write(now, gpu_index, flags, temperature, acoustic_limit, fan_target, fan_speeds, power_limit, enforced_power_limit, power_usage)
+
+    def write(self, now, gpu_index, flags, temperature, acoustic_limit, fan_target, fan_speeds, power_limit, enforced_power_limit, power_usage):
+        offset = data_offset + (self.written % self.capacity) * record_struct.size
+        padded_fan_speeds = [clamp(fan_speed, 0, 255) for fan_speed in fan_speeds] + [0] * (max_fans - len(fan_speeds))
+
+        # Mark the slot as being written before changing it, then publish it with its sequence and the new count
+        sequence_struct.pack_into(self.map, offset, 0)
+        record_struct.pack_into(self.map, offset, 0, now, gpu_index, flags, temperature, acoustic_limit, fan_target, len(fan_speeds),
+                                *padded_fan_speeds, power_limit, enforced_power_limit, power_usage)
+        sequence_struct.pack_into(self.map, offset, self.written + 1)
+
+        self.written += 1
+        sequence_struct.pack_into(self.map, written_offset, self.written)
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+# Can be used while the file is being recorded
+class TelemetryReader:
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # Empty file
+            self.file.close()
+            raise InvalidRecordFile(f'{path} is not a telemetry record')
+
+        try:
+            file_magic, version, file_max_fans, record_size, self.capacity, _ = header_struct.unpack_from(self.map, 0)
+        except struct.error:
+            self.close()
+            raise InvalidRecordFile(f'{path} is not a telemetry record')
+
+        if file_magic != magic or version != format_version or file_max_fans != max_fans or record_size != record_struct.size:
+            self.close()
+            raise InvalidRecordFile(f'{path} is not a telemetry record or was written by another version')
+
+        metadata = bytes(self.map[header_size:data_offset]).rstrip(b'\x00')
+        self.gpu_labels = json.loads(metadata.decode('utf-8'))['gpus']
+
+    def written(self):
+        return sequence_struct.unpack_from(self.map, written_offset)[0]
+
+    # Oldest first. Slots that are overwritten while they are read are skipped
+    def samples(self):
+        written = self.written()
+        samples = []
+
+        for number in range(max(0, written - self.capacity), written):
+            offset = data_offset + (number % self.capacity) * record_struct.size
+
+            values = record_struct.unpack_from(self.map, offset)
+
+            if values[0] != number + 1 or sequence_struct.unpack_from(self.map, offset)[0] != number + 1:
+                continue
+
+            samples.append(TelemetrySample(values, self.gpu_labels))
+
+        return samples
+
+    def close(self):
+        self.map.close()
+        self.file.close()
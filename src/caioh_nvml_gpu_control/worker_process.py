@@ -0,0 +1,318 @@
+import sys
+import helper_functions as main_funcs
+import metrics_server
+import info_server
+import time
+import multiprocessing
+import multiprocessing.connection
+import random
+import traceback
+import signal
+import os
+import atexit
+
+# The control loop (control and record actions) runs in worker processes, which are restarted when they fail
+
+# The worker side of the connection with the parent process
+class WorkerLink:
+    def __init__(self, activate_event, sender):
+        self.activate_event = activate_event
+        self.sender = sender
+        self.ticks = 0
+
+    # Standby workers stay here (already initialized) until the active worker fails
+    def wait_for_activation(self):
+        self.activate_event.wait()
+
+    # Heartbeat for the watchdog, the first one also tells the parent that the GPUs are being controlled again (the recovery gap ends here)
+    # It also carries the metrics sample when the metrics endpoint is enabled
+    def tick_done(self, metrics_sample=None):
+        self.ticks += 1
+        self.sender.send(('tick', time.monotonic(), metrics_sample))
+
+    # The parent decides whether it is printed, since repeated failures are summarized
+    def error(self, error_text):
+        self.sender.send(('error', error_text))
+
+# The parent side of a worker process
+class Worker:
+    def __init__(self, config, standby, task):
+        self.activate_event = multiprocessing.Event()
+        self.receiver, sender = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=task, args=(config, WorkerLink(self.activate_event, sender)), daemon=True)
+        self.process.start()
+        self.recovery_start = None # time.monotonic() value of when the previous worker exited
+        self.ticked = False
+        self.error = '' # Traceback of the failure
+
+        # Watchdog: a worker that doesn't finish a tick in time is considered hung (e.g. blocked inside of the driver) and is killed
+        self.heartbeat_timeout_s = config.watchdog_timeout_s
+        self.last_heartbeat = time.monotonic()
+        self.hung = False
+        self.hang_detection_s = 0.0 # Time without heartbeats when the hang was detected
+
+        # Only the worker writes to the pipe, so we get EOF when it exits
+        sender.close()
+
+        if standby != True:
+            self.activate_event.set()
+
+    def activate(self, recovery_start):
+        self.recovery_start = recovery_start
+        self.last_heartbeat = time.monotonic()
+        self.activate_event.set()
+
+    def heartbeat_wait_time(self):
+        if self.heartbeat_timeout_s <= 0 or self.hung == True:
+            return None
+
+        return max(0.0, self.last_heartbeat + self.heartbeat_timeout_s - time.monotonic())
+
+    def kill_hung(self, silence_s):
+        self.hung = True
+        self.hang_detection_s = silence_s
+        self.error = f'Watchdog: no heartbeat for {silence_s:.1f}s (deadline {self.heartbeat_timeout_s}s)'
+        self.process.kill()
+
+    # Does nothing if the worker already exited
+    def send_signal(self, signal_number):
+        try:
+            os.kill(self.process.pid, signal_number)
+        except (ValueError, ProcessLookupError):
+            pass
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+        self.close()
+
+    def close(self):
+        self.receiver.close()
+        self.process.close()
+
+    # Wait until the worker exits, while handling its messages
+    def join(self, on_first_tick=None, on_metrics_sample=None):
+        waiting = [self.process.sentinel, self.receiver]
+
+        while self.process.sentinel in waiting:
+            ready_list = multiprocessing.connection.wait(waiting, self.heartbeat_wait_time())
+
+            if len(ready_list) == 0:
+                silence_s = time.monotonic() - self.last_heartbeat
+
+                if silence_s >= self.heartbeat_timeout_s:
+                    self.kill_hung(silence_s)
+
+            for ready in ready_list:
+
+                if ready == self.process.sentinel:
+                    self.process.join()
+                    waiting.remove(ready)
+                    continue
+
+                try:
+                    message = self.receiver.recv()
+                except EOFError:
+                    waiting.remove(ready)
+                    continue
+
+                if message[0] == 'tick':
+                    self.last_heartbeat = time.monotonic()
+
+                    if self.ticked != True and on_first_tick != None:
+                        on_first_tick(self, message[1])
+
+                    self.ticked = True
+
+                    if on_metrics_sample != None and message[2] != None:
+                        on_metrics_sample(message[2])
+
+                elif message[0] == 'error':
+                    self.error = message[1]
+
+        return self.process.exitcode
+
+    # Last line of the traceback (exception type and message), used to tell if failures are the same
+    def error_summary(self):
+        lines = self.error.strip().splitlines()
+
+        if len(lines) == 0:
+            return f'Exit code: {self.process.exitcode}'
+
+        return lines[-1]
+
+# Jittered exponential backoff for restarting the worker, with a circuit breaker
+# After too many identical failures in a row, it switches to a slow probe mode until a worker works again
+class RetryBackoff:
+
+    # Identical failures in a row before switching to the probe mode
+    breaker_threshold = 5
+
+    def __init__(self, base_s, max_s, probe_interval_s, random_function=random.random):
+        self.base_s = base_s
+        self.max_s = max_s
+        self.probe_interval_s = probe_interval_s
+        self.random_function = random_function
+        self.reset()
+
+    def reset(self):
+        self.failures = 0 # Identical failures in a row
+        self.last_failure = None
+        self.probing = False
+
+    # Returns how long to wait before starting the next worker
+    def failure(self, failure_summary):
+
+        if failure_summary != self.last_failure:
+            self.failures = 0
+            self.last_failure = failure_summary
+            self.probing = False
+
+        self.failures += 1
+
+        if self.failures >= RetryBackoff.breaker_threshold:
+            self.probing = True
+            return self.probe_interval_s
+
+        delay = min(self.max_s, self.base_s * 2 ** (self.failures - 1))
+
+        # Keep at least half of the delay, the random part avoids restarting in lockstep with other failures
+        return delay / 2 + self.random_function() * delay / 2
+
+# SIGUSR1 is used to print the NVML trace (--trace-nvml) without stopping the program. Windows doesn't have it, so the trace is only printed at exit there
+def handle_trace_signal(config, handler):
+
+    if config.trace_nvml == True and hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signal_number, frame: handler())
+
+# SIGHUP reloads the settings file (--config), like most daemons. Windows doesn't have it, so the file is only reloaded when it changes there
+def handle_reload_signal(config, handler):
+
+    if config.config_path != '' and hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signal_number, frame: handler())
+
+# This is working in a separate process
+def worker_task(config, worker_link):
+
+    try:
+        # So we need to reinitialize nvml (and the backend, since the process may not inherit it)
+        main_funcs.configure_logging(config, asynchronous=True)
+        main_funcs.select_backend(config)
+        handle_trace_signal(config, main_funcs.print_nvml_trace)
+        handle_reload_signal(config, main_funcs.request_reload)
+        main_funcs.nvml.nvmlInit()
+        main_funcs.control_all(config, worker_link)
+        main_funcs.nvml.nvmlShutdown()
+
+    except Exception:
+        worker_link.error(traceback.format_exc())
+        sys.exit(1)
+
+    # Worker processes skip atexit
+    finally:
+        main_funcs.print_nvml_trace()
+        main_funcs.logger.close()
+
+def control_worker(config, task=worker_task):
+
+    backoff = RetryBackoff(config.retry_interval_s, config.retry_max_interval_s, config.probe_interval_s)
+    hangs = 0
+
+    # The endpoint is served from here, so it keeps working while the worker restarts
+    metrics = metrics_server.ControllerMetrics(main_funcs.caioh_gpu_control_version)
+    sample_handlers = []
+
+    if config.metrics_port != 0:
+        metrics_server.start_metrics_server(metrics, config.metrics_port)
+        sample_handlers.append(metrics.update)
+        main_funcs.log_helper(f'Serving metrics at http://127.0.0.1:{config.metrics_port}/metrics')
+
+    # Same for the info socket, the info actions get the latest sample even while the worker restarts (they ask the driver once it is stale)
+    if config.socket_path != '':
+        info = info_server.ControllerInfo(config.longest_interval())
+        info_socket = info_server.start_info_server(info, config.socket_path)
+        atexit.register(info_server.stop_info_server, info_socket, config.socket_path)
+        sample_handlers.append(info.update)
+        main_funcs.log_helper(f'Answering the info actions at {config.socket_path}')
+
+    def on_metrics_sample(sample):
+        for handler in sample_handlers:
+            handler(sample)
+
+    def on_first_tick(worker, tick_time):
+        if worker.recovery_start != None:
+            main_funcs.log_helper(f'Recovery gap: {tick_time - worker.recovery_start:.3f}s from the worker exit to the first control tick')
+
+        if backoff.probing == True:
+            main_funcs.log_helper(f'Worker recovered after {backoff.failures} identical failures, back to normal retries')
+
+        backoff.reset()
+
+    # Execute the GPU queries in a separate process, so it can be restarted on errors
+    worker = Worker(config, False, task)
+
+    # The standby worker is already initialized, so it can take over right after a failure
+    standby = None
+    if config.standby == True:
+        standby = Worker(config, True, task)
+
+    # The NVML calls happen in the active worker, so it is the one that prints the trace
+    handle_trace_signal(config, lambda: worker.send_signal(signal.SIGUSR1))
+    handle_reload_signal(config, lambda: worker.send_signal(signal.SIGHUP))
+
+    while(True):
+        exitcode = worker.join(on_first_tick, on_metrics_sample)
+        exit_time = time.monotonic()
+
+        # If everything works fine, we don't need to retry
+        if exitcode == 0:
+            worker.close()
+            break
+
+        failure_summary = worker.error_summary()
+        worker.close()
+
+        if worker.hung == True:
+            hangs += 1
+            main_funcs.log_helper(f'Watchdog: killed a hung worker after {worker.hang_detection_s:.3f}s without a heartbeat. Hangs so far: {hangs}')
+
+        was_probing = backoff.probing
+        retry_delay = backoff.failure(failure_summary)
+
+        # Only one line for a failure that keeps repeating
+        if backoff.probing != True:
+            print(f"Worker failed. Exit code: {exitcode}")
+            main_funcs.error_print(worker.error)
+
+        elif was_probing != True:
+            print(f"Worker failed {backoff.failures} times in a row with the same error: {failure_summary}")
+            print(f"Probing every {retry_delay} seconds, further identical failures are not logged\n")
+
+        if config.retry != True:
+            break
+
+        metrics.worker_restarted(worker.hung)
+
+        # A worker that was working is replaced right away
+        if standby != None and backoff.failures == 1:
+            print(f"Standby worker is taking over\n")
+            worker = standby
+            worker.activate(exit_time)
+            standby = Worker(config, True, task)
+            continue
+
+        if backoff.probing != True:
+            print(f"Retrying in {retry_delay:.2f} seconds\n")
+
+        time.sleep(retry_delay)
+
+        if standby != None:
+            worker = standby
+            worker.activate(exit_time)
+            standby = Worker(config, True, task)
+        else:
+            worker = Worker(config, False, task)
+            worker.recovery_start = exit_time
+
+    if standby != None:
+        standby.stop()
@@ -1,14 +1,80 @@
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 import sys
 import ctypes
 import pynvml
 sys.path.append('./src/caioh_nvml_gpu_control/') # Necessary so the tested files can all find each other from the projects root
 import parse_args
 import helper_functions as main_funcs
+import control_subroutines
+import fan_curve
+import nvml_gpu_control
+import worker_process
+import metrics_server
+import telemetry_replay
+import curve_tuner
+import info_server
+import config_file
+import async_engine
+import multiprocessing
+import io
+import contextlib
+import threading
+import concurrent.futures
+import urllib.request
+import urllib.error
+import json
+import time
+import tempfile
+import os
+import subprocess
+import socket
 
 # Test command: python.exe .\tests.py -b
 
+# Fake control worker: the first run fails after its first tick and the next ones succeed
+def fake_worker_task(config, worker_link):
+    worker_link.wait_for_activation()
+    worker_link.tick_done()
+
+    with config.test_runs.get_lock():
+        config.test_runs.value += 1
+        run = config.test_runs.value
+
+    sys.exit(1 if run == 1 else 0)
+
+# Fake control worker: the first run gets stuck in a NVML call that never returns, the next ones succeed
+def fake_hanging_worker_task(config, worker_link):
+    worker_link.wait_for_activation()
+    worker_link.tick_done()
+
+    with config.test_runs.get_lock():
+        config.test_runs.value += 1
+        run = config.test_runs.value
+
+    if run == 1:
+        never_returning_nvml_call = threading.Event().wait
+        never_returning_nvml_call()
+
+# Fake control worker that keeps failing with the same error before working again
+def fake_failing_worker_task(config, worker_link):
+    worker_link.wait_for_activation()
+
+    with config.test_runs.get_lock():
+        config.test_runs.value += 1
+        run = config.test_runs.value
+
+    if run <= 7:
+        worker_link.error('Traceback (most recent call last):\npynvml.NVMLError_GpuIsLost: GPU is lost')
+        sys.exit(1)
+
+    worker_link.tick_done()
+
+# Fake control worker that sends a metrics sample with its tick
+def fake_metrics_worker_task(config, worker_link):
+    worker_link.wait_for_activation()
+    worker_link.tick_done({'tick_work_s': 0.003, 'gpus': [{'label': 'GPU-A', 'up': True, 'temperature': 61}]})
+
 class TestMethods(unittest.TestCase):
 
     def test_parse_args_inssuficient_args(self):
@@ -344,6 +410,2001 @@ class TestMethods(unittest.TestCase):
         with self.assertRaises(parse_args.InvalidConfig):
             parse_args.parse_cmd_args(['.python_script', 'control','--name', 'RTX 4080'])
 
+    def test_parse_args_multiple_gpus(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-id', 'GPU-A', '-sp', '0:50,40:100', '-pl', '250', '-id', 'GPU-B', '-tl', '65', '-ds', '40', '-ti', '2'])
+
+        self.assertEqual(len(config.gpus), 2)
+        self.assertEqual(config.gpus[0].gpu_uuid, 'GPU-A')
+        self.assertEqual(config.gpus[0].power_limit, 250)
+        self.assertEqual(config.gpus[0].acoustic_temp_limit, 0)
+        self.assertEqual(config.gpus[0].temp_speed_pair, [parse_args.TempSpeedPair(40, 100), parse_args.TempSpeedPair(0, 50)])
+        self.assertEqual(config.gpus[1].gpu_uuid, 'GPU-B')
+        self.assertEqual(config.gpus[1].acoustic_temp_limit, 65)
+        self.assertEqual(config.gpus[1].default_speed, 40)
+        self.assertEqual(config.gpus[1].temp_speed_pair, [])
+
+        # Global options are shared
+        self.assertEqual(config.time_interval, 2.0)
+
+        # The configuration still exposes the first GPU directly
+        self.assertEqual(config.gpu_uuid, 'GPU-A')
+        self.assertEqual(config.power_limit, 250)
+
+    def test_parse_args_multiple_gpus_same_gpu_selectors(self):
+        # Name and UUID of the same GPU don't start a new one
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 4080', '-id', 'GPU-A', '-pl', '250'])
+        self.assertEqual(len(config.gpus), 1)
+
+    def test_parse_args_multiple_gpus_needs_settings(self):
+        with self.assertRaises(parse_args.InvalidConfig):
+            parse_args.parse_cmd_args(['.python_script', 'control', '-id', 'GPU-A', '-pl', '250', '-id', 'GPU-B'])
+
+    def test_parse_args_multiple_gpus_duplicate(self):
+        with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(parse_args.InvalidConfig):
+            parse_args.parse_cmd_args(['.python_script', 'control', '-id', 'GPU-A', '-pl', '250', '-id', 'GPU-A', '-tl', '70'])
+
+    def test_parse_args_multiple_gpus_only_control(self):
+        with self.assertRaises(parse_args.InvalidConfig):
+            parse_args.parse_cmd_args(['.python_script', 'fan-info', '-id', 'GPU-A', '-id', 'GPU-B'])
+
+    def test_parse_args_curve_type(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50'])
+        self.assertEqual(config.curve_type, 'step')
+
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '--curve-type', 'linear'])
+        self.assertEqual(config.curve_type, 'linear')
+
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '-ct', 'spline'])
+        self.assertEqual(config.curve_type, 'spline')
+
+        with self.assertRaises(parse_args.InvalidCurveType):
+            parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '-ct', 'cubic'])
+
+    def test_parse_args_hysteresis_and_dwell(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50'])
+        self.assertEqual(config.hysteresis, 0)
+        self.assertEqual(config.min_dwell_s, 0)
+
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '--hysteresis', '3', '--min-dwell', '10'])
+        self.assertEqual(config.hysteresis, 3)
+        self.assertEqual(config.min_dwell_s, 10.0)
+
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '-hy', '2', '-md', '0.5'])
+        self.assertEqual(config.hysteresis, 2)
+        self.assertEqual(config.min_dwell_s, 0.5)
+
+        with self.assertRaises(parse_args.InvalidTemperatureParameter):
+            parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '-hy', '-2'])
+
+        with self.assertRaises(parse_args.InvalidTimeParameter):
+            parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '-md', '-2'])
+
+    def test_parse_args_adaptive_interval(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50'])
+        self.assertEqual(config.adaptive_interval, False)
+
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '--adaptive-interval', '0.5:10'])
+        self.assertEqual(config.adaptive_interval, True)
+        self.assertEqual(config.min_interval_s, 0.5)
+        self.assertEqual(config.max_interval_s, 10.0)
+
+        with self.assertRaises(parse_args.InvalidTimeParameter):
+            parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '-ai', '10:1'])
+
+        with self.assertRaises(parse_args.InvalidTimeParameter):
+            parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '-ai', '-1:1'])
+
+        with self.assertRaises(parse_args.InvalidTimeParameter):
+            parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '-ai', '1'])
+
+# ------------------------------ Fan curve tests ------------------------------ #
+
+    def curve_pairs(self, speed_pairs):
+        return parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', speed_pairs]).temp_speed_pair
+
+    def test_fan_curve_step_same_as_scan(self):
+        pairs = self.curve_pairs('20:30,30:50,40:100,30:60')
+        curve = fan_curve.CompiledFanCurve(pairs, 45, 'step')
+
+        # The original linear scan over the pairs
+        def scan(temperature):
+            for pair in pairs:
+                if temperature >= pair.temperature:
+                    return pair.speed
+            return 45
+
+        for temperature in range(-10, 120):
+            self.assertEqual(curve.speed(temperature), scan(temperature), temperature)
+
+        self.assertFalse(curve.has_match(19))
+        self.assertTrue(curve.has_match(20))
+
+    def test_fan_curve_linear(self):
+        curve = fan_curve.CompiledFanCurve(self.curve_pairs('20:30,40:70,60:100'), 25, 'linear')
+
+        self.assertEqual(curve.speed(10), 25)
+        self.assertEqual(curve.speed(20), 30)
+        self.assertEqual(curve.speed(30), 50)
+        self.assertEqual(curve.speed(40), 70)
+        self.assertEqual(curve.speed(50), 85)
+        self.assertEqual(curve.speed(60), 100)
+        self.assertEqual(curve.speed(90), 100)
+
+    def test_fan_curve_spline_monotone(self):
+        curve = fan_curve.CompiledFanCurve(self.curve_pairs('20:30,35:40,40:80,50:80,70:100'), 30, 'spline')
+
+        # It goes through every pair
+        for temperature, speed in [(20, 30), (35, 40), (40, 80), (50, 80), (70, 100)]:
+            self.assertEqual(curve.speed(temperature), speed)
+
+        # It never goes down when the pairs don't and it doesn't overshoot the flat segment
+        speeds = [curve.speed(temperature) for temperature in range(20, 80)]
+        self.assertEqual(speeds, sorted(speeds))
+        self.assertEqual([curve.speed(temperature) for temperature in range(40, 51)], [80] * 11)
+
+    def test_fan_curve_speed_array(self):
+        pairs = self.curve_pairs('20:30,40:70,60:100')
+
+        for curve_type in fan_curve.curve_types:
+            curve = fan_curve.CompiledFanCurve(pairs, 25, curve_type)
+            temperatures = [-5, 0, 19.5, 20, 33.7, 59, 60, 150]
+
+            self.assertEqual(list(curve.speed_array(temperatures)), [curve.speed(temperature) for temperature in temperatures])
+
+    def test_fan_curve_empty(self):
+        curve = fan_curve.CompiledFanCurve([], 40, 'linear')
+        self.assertEqual(curve.speed(80), 40)
+        self.assertFalse(curve.has_match(80))
+
+# ------------------------------ Control loop tests ------------------------------ #
+
+    # Fake NVML devices, so the control loop can run without hardware
+    # Each device is a dict with its state. Devices with 'lost' set raise GPU_IS_LOST for every query
+    def mock_nvml(self, devices):
+
+        def device(handle):
+            if devices[handle].get('lost', False):
+                raise pynvml.NVMLError(pynvml.NVML_ERROR_GPU_IS_LOST)
+            return devices[handle]
+
+        def get_policy(handle, fan_idx, policy_ref):
+            device(handle)
+
+        def set_fan_speed(handle, fan_idx, speed):
+            device(handle)['fan_speed'] = speed
+            device(handle).setdefault('fan_writes', []).append(speed)
+
+        def set_power_limit(handle, limit_mw):
+            device(handle)['power_limit_mw'] = limit_mw
+
+        def set_threshold(handle, threshold_type, temperature):
+            device(handle)['acoustic'] = temperature
+
+        power_fields = {
+            pynvml.NVML_FI_DEV_POWER_REQUESTED_LIMIT: lambda handle: device(handle)['power_limit_mw'],
+            pynvml.NVML_FI_DEV_POWER_CURRENT_LIMIT: lambda handle: device(handle)['power_limit_mw'],
+            pynvml.NVML_FI_DEV_POWER_INSTANT: lambda handle: device(handle).get('power_usage_mw', 150000),
+            pynvml.NVML_FI_DEV_POWER_MIN_LIMIT: lambda handle: 100000,
+            pynvml.NVML_FI_DEV_POWER_MAX_LIMIT: lambda handle: 300000,
+        }
+
+        def get_field_values(handle, field_ids):
+            if device(handle).get('no_field_values', False):
+                raise pynvml.NVMLError(pynvml.NVML_ERROR_NOT_SUPPORTED)
+
+            field_values = (pynvml.c_nvmlFieldValue_t * len(field_ids))()
+            for field_value, field_id in zip(field_values, field_ids):
+                field_value.fieldId = field_id
+
+                if field_id in device(handle).get('unsupported_fields', []):
+                    field_value.nvmlReturn = pynvml.NVML_ERROR_NOT_SUPPORTED
+                    continue
+
+                field_value.nvmlReturn = pynvml.NVML_SUCCESS
+                field_value.valueType = pynvml.NVML_VALUE_TYPE_UNSIGNED_INT
+                field_value.value.uiVal = power_fields[field_id](handle)
+            return field_values
+
+        thresholds = {
+            pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_CURR: lambda handle: device(handle)['acoustic'],
+            pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_MIN: lambda handle: 40,
+            pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_MAX: lambda handle: 90,
+        }
+
+        return patch.multiple(pynvml,
+            nvmlSystemGetDriverVersion=Mock(return_value='580.00'),
+            nvmlSystemGetNVMLVersion=Mock(return_value='13.580.00'),
+            nvmlDeviceGetCount=Mock(side_effect=lambda: len(devices)),
+            nvmlDeviceGetHandleByIndex=Mock(side_effect=lambda idx: list(devices)[idx]),
+            nvmlDeviceGetHandleByUUID=Mock(side_effect=lambda uuid: uuid),
+            nvmlDeviceGetName=Mock(side_effect=lambda handle: device(handle)['name']),
+            nvmlDeviceGetUUID=Mock(side_effect=lambda handle: (device(handle), handle)[1]),
+            nvmlDeviceGetFanControlPolicy_v2=Mock(side_effect=get_policy),
+            nvmlDeviceGetNumFans=Mock(side_effect=lambda handle: device(handle)['fans']),
+            nvmlDeviceGetFanSpeed=Mock(side_effect=lambda handle: device(handle)['fan_speed']),
+            nvmlDeviceGetFanSpeed_v2=Mock(side_effect=lambda handle, fan_idx: device(handle)['fan_speed']),
+            nvmlDeviceSetFanSpeed_v2=Mock(side_effect=set_fan_speed),
+            nvmlDeviceGetTemperatureV=Mock(side_effect=lambda handle, sensor: device(handle)['temp']),
+            nvmlDeviceGetPowerManagementLimit=Mock(side_effect=lambda handle: device(handle)['power_limit_mw']),
+            nvmlDeviceGetEnforcedPowerLimit=Mock(side_effect=lambda handle: device(handle)['power_limit_mw']),
+            nvmlDeviceGetPowerManagementLimitConstraints=Mock(side_effect=lambda handle: (device(handle), [100000, 300000])[1]),
+            nvmlDeviceSetPowerManagementLimit=Mock(side_effect=set_power_limit),
+            nvmlDeviceGetTemperatureThreshold=Mock(side_effect=lambda handle, threshold_type: thresholds[threshold_type](handle)),
+            nvmlDeviceSetTemperatureThreshold=Mock(side_effect=set_threshold),
+            nvmlDeviceGetFieldValues=Mock(side_effect=get_field_values),
+        )
+
+    def fake_device(self, name='RTX 4080', temp=50, fan_speed=30, fans=2, power_limit_mw=200000, acoustic=80):
+        return {'name': name, 'temp': temp, 'fan_speed': fan_speed, 'fans': fans, 'power_limit_mw': power_limit_mw, 'acoustic': acoustic}
+
+    def test_control_all_multiple_gpus(self):
+        devices = {'GPU-A': self.fake_device(temp=45), 'GPU-B': self.fake_device(temp=20)}
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-id', 'GPU-A', '-sp', '0:40,40:80', '-pl', '250', '-id', 'GPU-B', '-sp', '0:35', '-tl', '70', '-su'])
+
+        with self.mock_nvml(devices):
+            main_funcs.control_all(config)
+
+        self.assertEqual(devices['GPU-A']['fan_writes'], [80, 80])
+        self.assertEqual(devices['GPU-A']['power_limit_mw'], 250000)
+        self.assertEqual(devices['GPU-A']['acoustic'], 80)
+        self.assertEqual(devices['GPU-B']['fan_writes'], [35, 35])
+        self.assertEqual(devices['GPU-B']['power_limit_mw'], 200000)
+        self.assertEqual(devices['GPU-B']['acoustic'], 70)
+
+    def test_control_all_device_fault_isolation(self):
+        devices = {'GPU-A': self.fake_device(), 'GPU-B': self.fake_device(temp=60)}
+        devices['GPU-A']['lost'] = True
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-id', 'GPU-A', '-sp', '0:40', '-id', 'GPU-B', '-sp', '0:60', '-su'])
+
+        # The failure is still reported, but only after the other GPU was controlled
+        with self.mock_nvml(devices), self.assertRaises(pynvml.NVMLError_GpuIsLost):
+            main_funcs.control_all(config)
+
+        self.assertEqual(devices['GPU-B']['fan_writes'], [60, 60])
+
+    def test_control_all_device_fault_without_retry(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-ix', '0', '-sp', '0:40', '-ix', '1', '-sp', '0:60', '-ti', '5', '-ri', '10'])
+        backend = main_funcs.nvml_backend.SimulatedBackend(2, main_funcs.nvml_backend.SimulatedClock(end_time=60))
+        backend.gpus[0].lost = True
+
+        main_funcs.set_backend(backend, backend.clock)
+        try:
+            backend.nvmlInit()
+            errors = io.StringIO()
+
+            # Even without --retry, the healthy GPU keeps being controlled until the end of the simulation
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(errors), self.assertRaises(main_funcs.nvml_backend.SimulationFinished):
+                main_funcs.control_all(config)
+
+            self.assertEqual(backend.gpus[1].fan_speeds, [60, 60])
+            self.assertEqual(errors.getvalue().count('Device index 0 failed'), 6) # Reported each time it is probed again, every 10 seconds
+
+            # The program only closes when every GPU is failing, with the error of the first one
+            backend.clock.end_time = None
+            backend.gpus[1].lost = True
+
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()), self.assertRaises(main_funcs.GpuNotFound):
+                main_funcs.control_all(config)
+
+        finally:
+            main_funcs.set_backend(main_funcs.nvml_backend.PynvmlBackend(), main_funcs.nvml_backend.SystemClock())
+
+    def test_control_all_duplicate_device(self):
+        devices = {'GPU-A': self.fake_device(), 'GPU-B': self.fake_device(name='RTX 4090')}
+        path = self.config_path('gpus.json', '{"gpus": [{"uuid": "GPU-A", "speed-pair": "0:40"}, {"index": 0, "speed-pair": "0:60"}]}')
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-cf', path, '-su'])
+
+        error_output = io.StringIO()
+        with self.mock_nvml(devices), contextlib.redirect_stderr(error_output), self.assertRaises(main_funcs.DuplicateDevice):
+            main_funcs.control_all(config)
+
+        self.assertIn('GPU-A and index 0 select the same device (GPU-A)', error_output.getvalue())
+        self.assertNotIn('fan_writes', devices['GPU-A'])
+
+    def control_single_tick(self, devices, args, ticks=1):
+        config = parse_args.parse_cmd_args(['.python_script', 'control'] + args + ['-su'])
+        controlled_gpu = main_funcs.ControlledGpu(config.gpus[0])
+
+        with self.mock_nvml(devices):
+            main_funcs.attach_gpu(controlled_gpu)
+
+            for tick in range(ticks):
+                main_funcs.control_gpu(controlled_gpu, config)
+
+        return controlled_gpu
+
+    def test_device_snapshot(self):
+        devices = {'GPU-A': self.fake_device(temp=45, fan_speed=40, power_limit_mw=250000, acoustic=70)}
+        controlled_gpu = self.control_single_tick(devices, ['-id', 'GPU-A', '-sp', '0:40', '-pl', '250', '-tl', '70'])
+
+        snapshot = controlled_gpu.snapshot
+        self.assertEqual(snapshot.temperature, 45)
+        self.assertEqual(snapshot.fan_speed, 40)
+        self.assertEqual(snapshot.fan_speeds, [40, 40])
+        self.assertEqual(snapshot.current_power_limit, 250)
+        self.assertEqual(snapshot.enforced_power_limit, 250)
+        self.assertEqual(snapshot.power_limit_constraints.min, 100)
+        self.assertEqual(snapshot.power_limit_constraints.max, 300)
+        self.assertEqual(snapshot.temperature_thresholds.current_acoustic, 70)
+
+        # Fan controller count + temperature + 2 fan speeds + power field values + power constraints + 3 thresholds, and nothing to write
+        self.assertEqual(snapshot.nvml_calls, 9)
+        self.assertEqual(controlled_gpu.nvml_calls_last_tick, 9)
+        self.assertTrue(controlled_gpu.field_values_supported)
+        self.assertNotIn('fan_writes', devices['GPU-A'])
+
+    def test_device_snapshot_no_field_values(self):
+        devices = {'GPU-A': self.fake_device(power_limit_mw=250000)}
+        devices['GPU-A']['no_field_values'] = True
+        controlled_gpu = self.control_single_tick(devices, ['-id', 'GPU-A', '-pl', '250'])
+
+        self.assertFalse(controlled_gpu.field_values_supported)
+        self.assertEqual(controlled_gpu.snapshot.current_power_limit, 250)
+        self.assertEqual(controlled_gpu.snapshot.power_limit_constraints.max, 300)
+
+    def test_device_snapshot_no_power_usage_field(self):
+        devices = {'GPU-A': self.fake_device(power_limit_mw=250000)}
+        devices['GPU-A']['unsupported_fields'] = [pynvml.NVML_FI_DEV_POWER_INSTANT]
+        controlled_gpu = self.control_single_tick(devices, ['-id', 'GPU-A', '-pl', '250'])
+
+        # The limits still come from the field values
+        self.assertTrue(controlled_gpu.field_values_supported)
+        self.assertEqual(controlled_gpu.snapshot.current_power_limit, 250)
+        self.assertIsNone(controlled_gpu.snapshot.power_usage)
+
+        # Field values + power constraints
+        self.assertEqual(controlled_gpu.snapshot.nvml_calls, 2)
+
+    def test_device_snapshot_adaptive_power_usage(self):
+        devices = {'GPU-A': self.fake_device()}
+        devices['GPU-A']['power_usage_mw'] = 180000
+        controlled_gpu = self.control_single_tick(devices, ['-id', 'GPU-A', '-sp', '0:40', '-ai', '1:10'])
+
+        # Only the power usage, the limits are not needed: fan controller count + temperature + 2 fan speeds + power field values
+        self.assertEqual(controlled_gpu.snapshot.power_usage, 180)
+        self.assertIsNone(controlled_gpu.snapshot.power_limit_constraints)
+        self.assertEqual(controlled_gpu.snapshot.nvml_calls, 5)
+
+    def test_device_property_cache(self):
+        devices = {'GPU-A': self.fake_device(temp=45, fan_speed=40, power_limit_mw=250000, acoustic=70)}
+        controlled_gpu = self.control_single_tick(devices, ['-id', 'GPU-A', '-sp', '0:40', '-pl', '250', '-tl', '70'], ticks=2)
+
+        # Static properties are only queried on the first tick: temperature + 2 fan speeds + power field values + current acoustic threshold
+        self.assertEqual(controlled_gpu.nvml_calls_last_tick, 5)
+        self.assertEqual(controlled_gpu.snapshot.power_limit_constraints.max, 300)
+        self.assertEqual(controlled_gpu.snapshot.temperature_thresholds.max_acoustic, 90)
+        self.assertEqual(controlled_gpu.properties.values['fan_count'], 2)
+
+    def test_device_property_cache_invalidation(self):
+        cache = main_funcs.DevicePropertyCache()
+        query = Mock(return_value=2)
+
+        self.assertEqual(cache.get('fan_count', query, 'handle'), 2)
+        self.assertEqual(cache.get('fan_count', query, 'handle'), 2)
+        query.assert_called_once_with('handle')
+
+        # Errors that don't mean the device went away keep the values
+        self.assertFalse(cache.invalidate_on_error(pynvml.NVMLError(pynvml.NVML_ERROR_NO_PERMISSION)))
+        self.assertIn('fan_count', cache.values)
+
+        self.assertTrue(cache.invalidate_on_error(pynvml.NVMLError(pynvml.NVML_ERROR_GPU_IS_LOST)))
+        self.assertEqual(cache.values, {})
+
+        cache.get('fan_count', query, 'handle')
+        self.assertEqual(query.call_count, 2)
+
+    # Runs one tick per temperature and returns the controlled GPU
+    def control_temperatures(self, args, temperatures, times=None):
+        devices = {'GPU-A': self.fake_device(fan_speed=30, fans=1)}
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-id', 'GPU-A'] + args)
+        controlled_gpu = main_funcs.ControlledGpu(config.gpus[0])
+        times = times if times != None else range(len(temperatures))
+
+        with self.mock_nvml(devices), patch('time.monotonic', Mock(side_effect=list(times))):
+            main_funcs.attach_gpu(controlled_gpu)
+
+            for temperature in temperatures:
+                devices['GPU-A']['temp'] = temperature
+                main_funcs.control_gpu(controlled_gpu, config)
+
+        return controlled_gpu, devices['GPU-A'].get('fan_writes', [])
+
+    def test_fan_hysteresis(self):
+        jitter = [40, 39, 40, 39, 40, 39, 38, 37]
+
+        # Without hysteresis every flip is a write
+        controlled_gpu, fan_writes = self.control_temperatures(['-sp', '0:30,40:60'], jitter)
+        self.assertEqual(fan_writes, [60, 30, 60, 30, 60, 30])
+        self.assertEqual(controlled_gpu.fan_writes_issued, 6)
+        self.assertEqual(controlled_gpu.fan_writes_suppressed, 0)
+
+        # With 2°C, it only goes down at 37°C
+        controlled_gpu, fan_writes = self.control_temperatures(['-sp', '0:30,40:60', '-hy', '2'], jitter)
+        self.assertEqual(fan_writes, [60, 30])
+        self.assertEqual(controlled_gpu.fan_writes_issued, 2)
+        self.assertEqual(controlled_gpu.fan_writes_suppressed, 3) # The drops at 39°C, 38°C is still the same held drop
+
+    def test_fan_min_dwell(self):
+        temperatures = [40, 39, 40, 39, 39, 39]
+        times = [0, 1, 2, 3, 4, 12]
+
+        controlled_gpu, fan_writes = self.control_temperatures(['-sp', '0:30,40:60', '-md', '10'], temperatures, times)
+
+        # Going up is never delayed, going down waits 10s since the last change
+        self.assertEqual(fan_writes, [60, 30])
+        self.assertEqual(controlled_gpu.fan_writes_suppressed, 2) # Without the dwell time: 60, 30, 60, 30
+
+    def test_fan_held_speed_counted_once(self):
+        temperatures = [40] + [39] * 20 + [37] + [39] * 20
+
+        controlled_gpu, fan_writes = self.control_temperatures(['-sp', '0:30,40:60', '-hy', '2'], temperatures)
+
+        # Only one write was avoided, no matter how many ticks the speed stays held
+        self.assertEqual(fan_writes, [60, 30])
+        self.assertEqual(controlled_gpu.fan_writes_suppressed, 1)
+
+    def test_adaptive_polling(self):
+        polling = main_funcs.AdaptivePolling(0.5, 4.0, 0.0)
+        controlled_gpu = main_funcs.ControlledGpu(parse_args.GpuConfiguration())
+        controlled_gpu.handle = 'GPU-A'
+
+        def tick(now, temperature, power_usage=None):
+            controlled_gpu.snapshot = main_funcs.DeviceSnapshot()
+            controlled_gpu.snapshot.time = now
+            controlled_gpu.snapshot.temperature = temperature
+            controlled_gpu.snapshot.power_usage = power_usage
+            return polling.update([controlled_gpu], now)
+
+        # Stable readings back off up to the maximum interval
+        self.assertEqual(tick(0.0, 50), 1.0)
+        self.assertEqual(tick(1.0, 50), 2.0)
+        self.assertEqual(tick(3.0, 50), 4.0)
+        self.assertEqual(tick(7.0, 51), 4.0)
+
+        # A fast temperature change goes back to the minimum interval
+        self.assertEqual(tick(11.0, 60), 0.5)
+        self.assertEqual(tick(11.5, 60), 1.0)
+
+        # Same for the power usage
+        self.assertEqual(tick(12.5, 60, 100.0), 2.0)
+        self.assertEqual(tick(14.5, 60, 250.0), 0.5)
+
+        self.assertEqual(polling.effective_sample_rate(14.5), 8 / 14.5)
+
+    def test_tick_scheduler(self):
+        scheduler = main_funcs.TickScheduler(100.0)
+
+        # The work time is taken out of the sleep, so the period stays the same
+        scheduler.start_tick(100.0)
+        self.assertAlmostEqual(scheduler.finish_tick(1.0, 100.25), 0.75)
+        scheduler.start_tick(101.125)
+        self.assertAlmostEqual(scheduler.finish_tick(1.0, 101.5), 0.5)
+        self.assertAlmostEqual(scheduler.max_jitter_s, 0.125)
+
+        # An overrun skips the missed deadlines instead of catching up
+        scheduler.start_tick(102.0)
+        self.assertAlmostEqual(scheduler.finish_tick(1.0, 105.5), 0.5)
+        self.assertEqual(scheduler.overruns, 1)
+        self.assertEqual(scheduler.skipped_ticks, 3)
+        self.assertAlmostEqual(scheduler.next_deadline, 106.0)
+        self.assertAlmostEqual(scheduler.max_work_s, 3.5)
+        self.assertEqual(scheduler.ticks, 3)
+
+        # No interval means no waiting
+        scheduler.start_tick(106.0)
+        self.assertEqual(scheduler.finish_tick(0, 106.5), 0.0)
+
+    def test_control_worker_standby(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 4080', '-pl', '250', '--retry', '--standby'])
+        config.test_runs = multiprocessing.Value('i', 0)
+
+        with patch.object(main_funcs, 'log_helper') as log_helper:
+            worker_process.control_worker(config, fake_worker_task)
+
+        # The standby worker took over and the recovery gap was reported
+        self.assertEqual(config.test_runs.value, 2)
+        self.assertTrue(any('Recovery gap' in call.args[0] for call in log_helper.call_args_list))
+
+    def test_retry_backoff(self):
+        backoff = worker_process.RetryBackoff(1.0, 5.0, 300.0, random_function=lambda: 1.0)
+
+        # Doubles up to the maximum
+        self.assertEqual([backoff.failure('GPU is lost') for i in range(4)], [1.0, 2.0, 4.0, 5.0])
+        self.assertFalse(backoff.probing)
+
+        # Too many identical failures opens the circuit
+        self.assertEqual(backoff.failure('GPU is lost'), 300.0)
+        self.assertTrue(backoff.probing)
+        self.assertEqual(backoff.failure('GPU is lost'), 300.0)
+
+        # A different failure starts over
+        self.assertEqual(backoff.failure('Driver not loaded'), 1.0)
+        self.assertFalse(backoff.probing)
+
+        backoff.reset()
+        self.assertEqual(backoff.failures, 0)
+
+        # The jitter keeps at least half of the delay
+        backoff = worker_process.RetryBackoff(4.0, 60.0, 300.0, random_function=lambda: 0.0)
+        self.assertEqual(backoff.failure('GPU is lost'), 2.0)
+
+    def test_control_worker_circuit_breaker(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 4080', '-pl', '250', '--retry', '-ri', '0', '-pi', '0'])
+        config.test_runs = multiprocessing.Value('i', 0)
+        output = io.StringIO()
+
+        with patch.object(main_funcs, 'log_helper') as log_helper, patch.object(main_funcs, 'error_print'), contextlib.redirect_stdout(output):
+            worker_process.control_worker(config, fake_failing_worker_task)
+
+        self.assertEqual(config.test_runs.value, 8)
+
+        # Only the failures before the circuit opened are logged, then a single summary line
+        self.assertEqual(output.getvalue().count('Worker failed. Exit code'), 4)
+        self.assertEqual(output.getvalue().count('times in a row with the same error: pynvml.NVMLError_GpuIsLost: GPU is lost'), 1)
+        self.assertTrue(any('Worker recovered after 7 identical failures' in call.args[0] for call in log_helper.call_args_list))
+
+    def test_control_worker_watchdog(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 4080', '-pl', '250', '--retry', '-ri', '0', '-ti', '0.1', '--watchdog', '0.5'])
+        config.test_runs = multiprocessing.Value('i', 0)
+
+        with patch.object(main_funcs, 'log_helper') as log_helper, patch.object(main_funcs, 'error_print'), contextlib.redirect_stdout(io.StringIO()):
+            worker_process.control_worker(config, fake_hanging_worker_task)
+
+        # The hung worker was killed and replaced
+        self.assertEqual(config.test_runs.value, 2)
+        self.assertTrue(any('Watchdog: killed a hung worker' in call.args[0] and 'Hangs so far: 1' in call.args[0] for call in log_helper.call_args_list))
+
+    def test_parse_args_watchdog(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50'])
+        self.assertEqual(config.watchdog_timeout_s, 0)
+
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '-wd', '10'])
+        self.assertEqual(config.watchdog_timeout_s, 10.0)
+
+        with self.assertRaises(parse_args.InvalidTimeParameter):
+            parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '--watchdog', '-1'])
+
+    def test_nvml_call_counter(self):
+        library = Mock()
+        library.nvmlDeviceGetCount = Mock(return_value=3)
+        counter = main_funcs.NvmlCallCounter(library)
+
+        self.assertEqual(counter.nvmlDeviceGetCount(), 3)
+        self.assertEqual(counter.nvmlDeviceGetCount(), 3)
+        self.assertEqual(counter.call_count, 2)
+
+        # Replacing the library function is still seen by the counter
+        library.nvmlDeviceGetCount = Mock(return_value=1)
+        self.assertEqual(counter.nvmlDeviceGetCount(), 1)
+
+# ------------------------------ Simulated backend tests ------------------------------ #
+
+    # Runs the control loop on simulated GPUs until the simulated clock reaches end_time
+    def run_simulation(self, args, end_time, gpu_count=1, load=0.5, action='control'):
+        config = parse_args.parse_cmd_args(['.python_script', action] + args)
+        backend = main_funcs.nvml_backend.SimulatedBackend(gpu_count, main_funcs.nvml_backend.SimulatedClock(end_time=end_time))
+
+        for gpu in backend.gpus:
+            gpu.load = load
+
+        main_funcs.set_backend(backend, backend.clock)
+        try:
+            backend.nvmlInit()
+            with contextlib.redirect_stdout(io.StringIO()), self.assertRaises(main_funcs.nvml_backend.SimulationFinished):
+                main_funcs.control_all(config)
+
+        finally:
+            main_funcs.set_backend(main_funcs.nvml_backend.PynvmlBackend(), main_funcs.nvml_backend.SystemClock())
+
+        return backend
+
+    def test_simulated_backend_has_all_functions(self):
+        backend = main_funcs.nvml_backend.SimulatedBackend()
+
+        for function_name in main_funcs.nvml_backend.backend_functions:
+            self.assertTrue(callable(getattr(backend, function_name, None)), function_name)
+
+    def test_simulated_gpu_thermal_model(self):
+        clock = main_funcs.nvml_backend.SimulatedClock()
+        backend = main_funcs.nvml_backend.SimulatedBackend(2, clock)
+        backend.nvmlInit()
+        quiet, loud = backend.gpus
+
+        quiet.load = loud.load = 1.0
+        for fan_idx in range(2):
+            backend.nvmlDeviceSetFanSpeed_v2(quiet, fan_idx, 30)
+            backend.nvmlDeviceSetFanSpeed_v2(loud, fan_idx, 100)
+
+        clock.sleep(1800)
+        quiet_temp = backend.nvmlDeviceGetTemperatureV(quiet, pynvml.NVML_TEMPERATURE_GPU)
+        loud_temp = backend.nvmlDeviceGetTemperatureV(loud, pynvml.NVML_TEMPERATURE_GPU)
+
+        # Close to the equilibrium: 25°C + 300W (the power limit) / 12W/°C with the fans at 100%
+        self.assertEqual(loud_temp, 50)
+        self.assertGreater(quiet_temp, loud_temp)
+
+        # A lower power limit means less heat
+        backend.nvmlDeviceSetPowerManagementLimit(loud, 100000)
+        clock.sleep(1800)
+        self.assertLess(backend.nvmlDeviceGetTemperatureV(loud, pynvml.NVML_TEMPERATURE_GPU), loud_temp)
+
+        # The acoustic threshold throttles the GPU
+        backend.nvmlDeviceSetTemperatureThreshold(quiet, pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_CURR, 60)
+        clock.sleep(1800)
+        self.assertLess(backend.nvmlDeviceGetTemperatureV(quiet, pynvml.NVML_TEMPERATURE_GPU), quiet_temp)
+
+    def test_simulated_backend_errors(self):
+        backend = main_funcs.nvml_backend.SimulatedBackend()
+
+        with self.assertRaises(pynvml.NVMLError_Uninitialized):
+            backend.nvmlDeviceGetCount()
+
+        backend.nvmlInit()
+        gpu = backend.nvmlDeviceGetHandleByIndex(0)
+
+        with self.assertRaises(pynvml.NVMLError_InvalidArgument):
+            backend.nvmlDeviceSetPowerManagementLimit(gpu, 1000)
+
+        with self.assertRaises(pynvml.NVMLError_NotFound):
+            backend.nvmlDeviceGetHandleByUUID('GPU-unknown')
+
+        gpu.lost = True
+        with self.assertRaises(pynvml.NVMLError_GpuIsLost):
+            backend.nvmlDeviceGetName(gpu)
+
+    def test_simulated_control_loop(self):
+        args = ['-id', 'GPU-00000000-0000-0000-0000-000000000001', '-sp', '40:40,55:70,65:100', '-ct', 'linear', '-pl', '250', '-tl', '80']
+        backend = self.run_simulation(args, end_time=3600, gpu_count=2, load=1.0)
+        idle_gpu, controlled_gpu = backend.gpus
+
+        self.assertEqual(controlled_gpu.power_limit_mw, 250000)
+        self.assertEqual(controlled_gpu.acoustic_threshold, 80)
+        self.assertEqual(controlled_gpu.fan_policies, [pynvml.NVML_FAN_POLICY_MANUAL] * 2)
+
+        # The loop reaches a steady state where the fan speed matches the curve
+        temperature = int(controlled_gpu.temperature)
+        curve = fan_curve.CompiledFanCurve(parse_args.parse_cmd_args(['.python_script', 'control'] + args).temp_speed_pair, 50, 'linear')
+        self.assertEqual(controlled_gpu.fan_speeds, [curve.speed(temperature)] * 2)
+
+        # The other GPU was never touched
+        self.assertEqual(idle_gpu.power_limit_mw, 300000)
+        self.assertEqual(idle_gpu.fan_policies, [pynvml.NVML_FAN_POLICY_TEMPERATURE_CONTINOUS_SW] * 2)
+
+    def test_simulate_option(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'NVIDIA Simulated GPU', '-sp', '0:50', '--simulate', '2'])
+        self.assertEqual(config.simulated_gpus, 2)
+
+        with self.assertRaises(parse_args.InvalidGpuCount):
+            parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'NVIDIA Simulated GPU', '-sp', '0:50', '-sim', '0'])
+
+    def test_trace_nvml_option(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '--trace-nvml'])
+        self.assertEqual(config.trace_nvml, True)
+
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50'])
+        self.assertEqual(config.trace_nvml, False)
+
+    def test_tracing_backend(self):
+        backend = main_funcs.nvml_backend.SimulatedBackend()
+        tracer = main_funcs.nvml_trace.TracingBackend(backend)
+
+        tracer.nvmlInit()
+        handle = tracer.nvmlDeviceGetHandleByIndex(0)
+        for fan_idx in range(2):
+            tracer.nvmlDeviceGetFanSpeed_v2(handle, fan_idx)
+
+        backend.gpus[0].lost = True
+        with self.assertRaises(pynvml.NVMLError_GpuIsLost):
+            tracer.nvmlDeviceGetFanSpeed_v2(handle, 0)
+
+        trace = tracer.traces['nvmlDeviceGetFanSpeed_v2']
+        self.assertEqual(trace.calls, 3)
+        self.assertEqual(trace.errors, {'NVML_ERROR_GPU_IS_LOST': 1})
+        self.assertEqual(sum(trace.histogram), 3)
+        self.assertEqual(tracer.traces['nvmlInit'].calls, 1)
+
+        report = tracer.report()
+        self.assertIn('nvmlDeviceGetFanSpeed_v2', report)
+        self.assertIn('NVML_ERROR_GPU_IS_LOST: 1', report)
+
+    def test_function_trace_histogram(self):
+        trace = main_funcs.nvml_trace.FunctionTrace()
+
+        for elapsed_us in [1, 3, 3, 3, 40, 40, 40, 40, 40, 200000]:
+            trace.record(elapsed_us * 1000)
+
+        self.assertEqual(trace.histogram[0], 1) # <= 1us
+        self.assertEqual(trace.histogram[2], 3) # <= 5us
+        self.assertEqual(trace.histogram[5], 5) # <= 50us
+        self.assertEqual(trace.histogram[-1], 1) # Slower than the last bucket
+        self.assertEqual(trace.percentile_us(50), 50)
+        self.assertEqual(trace.percentile_us(100), 200000)
+
+    def test_select_backend_with_trace(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'NVIDIA Simulated GPU', '-sp', '0:50', '-sim', '1', '-tn'])
+
+        try:
+            main_funcs.select_backend(config)
+            self.assertIsInstance(main_funcs.nvml.library, main_funcs.nvml_trace.TracingBackend)
+            self.assertIsInstance(main_funcs.clock, main_funcs.nvml_backend.SimulatedClock)
+
+            main_funcs.nvml.nvmlInit()
+
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                main_funcs.list_gpus()
+                main_funcs.print_nvml_trace()
+
+            self.assertIn('nvmlDeviceGetName', output.getvalue())
+
+        finally:
+            main_funcs.set_backend(main_funcs.nvml_backend.PynvmlBackend(), main_funcs.nvml_backend.SystemClock())
+
+        # Nothing is printed without --trace-nvml
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            main_funcs.print_nvml_trace()
+
+        self.assertEqual(output.getvalue(), '')
+
+# ------------------------------ Metrics endpoint tests ------------------------------ #
+
+    def test_metrics_port_option(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '--metrics-port', '9400'])
+        self.assertEqual(config.metrics_port, 9400)
+
+        with self.assertRaises(parse_args.InvalidPort):
+            parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '-mp', '70000'])
+
+    def test_collect_metrics_sample(self):
+        devices = {'GPU-A': self.fake_device(temp=65, fan_speed=30, fans=2, power_limit_mw=300000, acoustic=83)}
+        controlled_gpu = self.control_single_tick(devices, ['-id', 'GPU-A', '-sp', '60:80', '-pl', '250', '-tl', '80'])
+
+        sample = main_funcs.collect_metrics_sample([controlled_gpu], 0.004)
+        gpu_sample = sample['gpus'][0]
+
+        self.assertEqual(sample['tick_work_s'], 0.004)
+        self.assertEqual(gpu_sample['label'], 'GPU-A')
+        self.assertEqual(gpu_sample['up'], True)
+        self.assertEqual(gpu_sample['temperature'], 65)
+        self.assertEqual(gpu_sample['fan_speeds'], [30, 30])
+        self.assertEqual(gpu_sample['fan_target'], 80)
+        self.assertEqual(gpu_sample['fan_writes_issued'], 1)
+        self.assertEqual(gpu_sample['power_limit'], 300)
+        self.assertEqual(gpu_sample['power_limit_writes'], 1)
+        self.assertEqual(gpu_sample['acoustic_limit'], 83)
+        self.assertEqual(gpu_sample['acoustic_limit_writes'], 1)
+
+    def test_controller_metrics_render(self):
+        metrics = metrics_server.ControllerMetrics('1.0')
+
+        # Only the controller metrics before the first tick
+        text = metrics.render()
+        self.assertIn('nvml_gpu_control_ticks_total 0', text)
+        self.assertNotIn('nvml_gpu_control_up', text)
+
+        metrics.update({'tick_work_s': 0.003, 'gpus': [{'label': 'GPU-"A"', 'up': True, 'temperature': 61, 'fan_speeds': [40, 42], 'power_usage': None, 'fan_writes_issued': 1234567}]})
+        metrics.update({'tick_work_s': 0.2, 'gpus': [{'label': 'GPU-"A"', 'up': False, 'temperature': 62, 'fan_speeds': [40, 42], 'power_usage': None, 'fan_writes_issued': 1234568}]})
+        metrics.worker_restarted(hung=True)
+
+        text = metrics.render()
+        self.assertIn('nvml_gpu_control_ticks_total 2', text)
+        self.assertIn('nvml_gpu_control_worker_restarts_total 1', text)
+        self.assertIn('nvml_gpu_control_worker_hangs_total 1', text)
+        self.assertIn('nvml_gpu_control_tick_duration_seconds_bucket{le="0.005"} 1', text)
+        self.assertIn('nvml_gpu_control_tick_duration_seconds_bucket{le="0.25"} 2', text)
+        self.assertIn('nvml_gpu_control_tick_duration_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn('nvml_gpu_control_up{gpu="GPU-\\"A\\""} 0', text)
+        self.assertIn('nvml_gpu_control_temperature_celsius{gpu="GPU-\\"A\\""} 62', text)
+        self.assertIn('nvml_gpu_control_fan_speed_percent{gpu="GPU-\\"A\\"",fan="1"} 42', text)
+        self.assertIn('nvml_gpu_control_fan_writes_total{gpu="GPU-\\"A\\""} 1234568', text)
+
+        # Values that were not sampled are left out
+        self.assertNotIn('power_usage_watts', text)
+
+    def test_metrics_endpoint(self):
+        metrics = metrics_server.ControllerMetrics('1.0')
+        server = metrics_server.start_metrics_server(metrics, 0)
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+
+        try:
+            # The worker's tick feeds the metrics through the parent
+            config = parse_args.parse_cmd_args(['.python_script', 'control', '-id', 'GPU-A', '-sp', '0:50'])
+            worker = worker_process.Worker(config, False, fake_metrics_worker_task)
+            self.assertEqual(worker.join(None, metrics.update), 0)
+            worker.close()
+
+            with urllib.request.urlopen(url + '/metrics') as response:
+                self.assertEqual(response.status, 200)
+                self.assertIn('text/plain', response.headers['Content-Type'])
+                text = response.read().decode('utf-8')
+
+            self.assertIn('nvml_gpu_control_ticks_total 1', text)
+            self.assertIn('nvml_gpu_control_temperature_celsius{gpu="GPU-A"} 61', text)
+
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(url + '/other')
+
+        finally:
+            server.shutdown()
+            server.server_close()
+
+# ------------------------------ Logging tests ------------------------------ #
+
+    def test_log_format_option(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '--log-format', 'json'])
+        self.assertEqual(config.log_format, 'json')
+
+        with patch.object(parse_args, 'error_print'), self.assertRaises(parse_args.InvalidLogFormat):
+            parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '-lf', 'xml'])
+
+    def test_log_record_lazy_format(self):
+        self.assertEqual(main_funcs.log_writer.LogRecord('info', '{}: {} calls', ('GPU-A', 5)).text(), 'GPU-A: 5 calls')
+
+        # Without arguments, the message is used as it is
+        self.assertEqual(main_funcs.log_writer.LogRecord('info', 'Curve {0:50}', ()).text(), 'Curve {0:50}')
+
+    def test_log_writer_formats(self):
+        output = io.StringIO()
+        errors = io.StringIO()
+
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(errors):
+            main_funcs.log_writer.LogWriter('text').write(main_funcs.log_writer.LogRecord('info', 'Fan speed: {}%', (50,)))
+            main_funcs.log_writer.LogWriter('text').write(main_funcs.log_writer.LogRecord('error', 'Device failed', ()))
+            main_funcs.log_writer.LogWriter('json').write(main_funcs.log_writer.LogRecord('info', 'Line 1\nLine 2', (), repeated=3))
+
+        lines = output.getvalue().splitlines()
+        self.assertRegex(lines[0], r'^LOG\[\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\]: Fan speed: 50%$')
+        self.assertEqual(errors.getvalue(), 'Device failed\n')
+
+        # One JSON object per line, even for multi-line messages
+        self.assertEqual(len(lines), 2)
+        record = json.loads(lines[1])
+        self.assertEqual(record['level'], 'info')
+        self.assertEqual(record['message'], 'Line 1\nLine 2 (repeated 3 more times)')
+        self.assertEqual(record['repeated'], 3)
+
+    def test_logger_rate_limit(self):
+        logger = main_funcs.log_writer.Logger()
+        logger.configure('text', False, True)
+        output = io.StringIO()
+
+        with contextlib.redirect_stdout(output), patch('time.time', Mock(side_effect=[100.0, 101.0, 102.0, 103.0, 140.0])):
+            logger.log('info', 'Device {} failed', ('GPU-A',))
+            logger.log('info', 'Device {} failed', ('GPU-A',))
+            logger.log('info', 'Device {} failed', ('GPU-A',))
+            logger.log('info', 'Device {} failed', ('GPU-B',))
+            logger.log('info', 'Device {} failed', ('GPU-A',))
+
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].endswith('Device GPU-A failed'))
+        self.assertTrue(lines[1].endswith('Device GPU-B failed'))
+        self.assertTrue(lines[2].endswith('Device GPU-A failed (repeated 2 more times)'))
+
+    def test_logger_rate_limit_threads(self):
+        logger = main_funcs.log_writer.Logger()
+        logger.configure('text', False, True)
+        logger.writer = Mock()
+        writes = [] # Mock.call_count is not thread safe, list.append is
+        logger.writer.write = writes.append
+
+        # Enough different messages to prune the table while the other threads add to it
+        def log_messages(thread_idx):
+            for message_idx in range(600):
+                logger.log('info', 'Device {} message {}', (thread_idx, message_idx))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(log_messages, range(4)))
+
+        self.assertEqual(len(writes), 2400)
+
+    def test_logger_rate_limit_identical_gpus(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-ix', '0', '-sp', '0:40', '-ix', '1', '-sp', '0:40', '-su'])
+        backend = main_funcs.nvml_backend.SimulatedBackend(2, main_funcs.nvml_backend.SimulatedClock())
+        output = io.StringIO()
+
+        main_funcs.set_backend(backend, backend.clock)
+        main_funcs.logger.configure('text', False, True)
+        try:
+            backend.nvmlInit()
+            with contextlib.redirect_stdout(output):
+                main_funcs.control_all(config)
+
+        finally:
+            main_funcs.logger.configure('text', False, False)
+            main_funcs.set_backend(main_funcs.nvml_backend.PynvmlBackend(), main_funcs.nvml_backend.SystemClock())
+
+        # Same model and settings, but the attach lines of both GPUs are written
+        text = output.getvalue()
+        self.assertIn('index 0: Power limit : 300W', text)
+        self.assertIn('index 1: Power limit : 300W', text)
+        self.assertEqual(text.count('Device name : NVIDIA Simulated GPU'), 2)
+
+    def test_async_log_writer_drops_when_full(self):
+        release = threading.Event()
+
+        # Stands for a stuck journald
+        class BlockingStream(io.StringIO):
+            def write(self, text):
+                release.wait()
+                return super().write(text)
+
+        output = BlockingStream()
+
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            writer = main_funcs.log_writer.AsyncLogWriter('text')
+
+            # Never blocks the caller, even though nothing can be written
+            start = time.monotonic()
+            for idx in range(main_funcs.log_writer.AsyncLogWriter.queue_size + 100):
+                writer.write(main_funcs.log_writer.LogRecord('info', 'Message {}', (idx,)))
+            self.assertLess(time.monotonic() - start, 1.0)
+            self.assertGreaterEqual(writer.dropped, 100)
+
+            release.set()
+            writer.close()
+
+        self.assertIn(f'Log queue full: {writer.dropped} messages dropped', output.getvalue())
+        self.assertIn('Message 0', output.getvalue())
+
+    def test_subroutines_skip_unneeded_log_messages(self):
+        devices = {'GPU-A': self.fake_device(temp=50, fan_speed=80, power_limit_mw=250000, acoustic=70)}
+
+        # Nothing to change and no --verbose: the messages are not even built
+        with patch.object(control_subroutines, 'log_helper') as log_helper:
+            self.control_single_tick(devices, ['-id', 'GPU-A', '-sp', '40:80', '-pl', '250', '-tl', '70'])
+
+        self.assertFalse(any('Device: GPU-A' in call.args[0] for call in log_helper.call_args_list))
+
+        with patch.object(control_subroutines, 'log_helper') as log_helper:
+            self.control_single_tick(devices, ['-id', 'GPU-A', '-sp', '40:80', '-pl', '250', '-tl', '70', '-V'])
+
+        self.assertEqual(sum('Device: GPU-A' in call.args[0] for call in log_helper.call_args_list), 3)
+
+# ------------------------------ Telemetry record tests ------------------------------ #
+
+    def record_path(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return os.path.join(directory.name, 'gpu.ring')
+
+    def test_record_options(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '--record', 'gpu.ring', '-rs', '4'])
+        self.assertEqual(config.record_path, 'gpu.ring')
+        self.assertEqual(config.record_size_mb, 4)
+
+        config = parse_args.parse_cmd_args(['.python_script', 'record', '-n', 'RTX 3080', '-n', 'RTX 4080', '-rc', 'gpu.ring'])
+        self.assertEqual(config.action, 'record')
+        self.assertEqual(len(config.gpus), 2)
+
+        with patch.object(parse_args, 'error_print'):
+            with self.assertRaises(parse_args.InvalidConfig):
+                parse_args.parse_cmd_args(['.python_script', 'record', '-n', 'RTX 3080'])
+
+            # Recording doesn't change anything
+            with self.assertRaises(parse_args.InvalidConfig):
+                parse_args.parse_cmd_args(['.python_script', 'record', '-n', 'RTX 3080', '-rc', 'gpu.ring', '-pl', '250'])
+
+            with self.assertRaises(parse_args.InvalidRecordSize):
+                parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 3080', '-sp', '0:50', '-rc', 'gpu.ring', '-rs', '0'])
+
+    def test_record_simulated_control_loop(self):
+        path = self.record_path()
+        self.run_simulation(['-n', 'NVIDIA Simulated GPU', '-sp', '0:30,60:100', '-pl', '250', '-ti', '10', '-rc', path], end_time=300.5, load=1.0)
+
+        reader = main_funcs.telemetry_ring.TelemetryReader(path)
+        samples = reader.samples()
+        reader.close()
+
+        self.assertEqual(reader.gpu_labels, ['NVIDIA Simulated GPU'])
+        self.assertEqual(len(samples), 31) # One per tick: 0s, 10s, ... 300s
+        self.assertEqual([sample.time for sample in samples], [float(tick * 10) for tick in range(31)])
+
+        # The first tick sets the power limit, the fans only speed up when the GPU heats up
+        self.assertEqual(samples[0].actions(), ['power limit write'])
+        self.assertEqual(samples[0].fan_target, 30)
+        self.assertIn('fan write', [action for sample in samples for action in sample.actions()])
+        self.assertEqual(samples[0].power_limit, 300)
+        self.assertEqual(samples[1].power_limit, 250)
+        self.assertEqual(len(samples[0].fan_speeds), 2)
+        self.assertIsNone(samples[0].acoustic_limit)
+
+        # Heating up under full load
+        self.assertGreater(samples[-1].temperature, samples[0].temperature)
+        self.assertGreater(samples[-1].power_usage, 200)
+        self.assertTrue(all(sample.flags & main_funcs.telemetry_ring.flag_up != 0 for sample in samples))
+
+    def test_record_action_only_samples(self):
+        path = self.record_path()
+        backend = self.run_simulation(['-n', 'NVIDIA Simulated GPU', '-rc', path], end_time=3.5, action='record')
+
+        reader = main_funcs.telemetry_ring.TelemetryReader(path)
+        samples = reader.samples()
+        reader.close()
+
+        self.assertEqual(len(samples), 4)
+        self.assertTrue(all(sample.actions() == [] and sample.fan_target == None for sample in samples))
+        self.assertEqual(samples[0].power_limit, backend.gpus[0].power_limit_mw // 1000)
+        self.assertIsNotNone(samples[0].temperature)
+
+    def test_record_ring_wraps_and_is_readable_while_recording(self):
+        path = self.record_path()
+        recorder = main_funcs.telemetry_ring.TelemetryRecorder(path, 0.01, ['GPU-A'])
+        capacity = recorder.capacity
+
+        reader = main_funcs.telemetry_ring.TelemetryReader(path)
+
+        for number in range(capacity + 10):
+            recorder.write(float(number), 0, main_funcs.telemetry_ring.flag_up, 50, -32768, 40, [40, 41], 250, 250, 123.5)
+
+        # The file never grows and only the newest records are kept, oldest first
+        samples = reader.samples()
+        self.assertEqual(os.path.getsize(path), main_funcs.telemetry_ring.data_offset + capacity * main_funcs.telemetry_ring.record_struct.size)
+        self.assertEqual(len(samples), capacity)
+        self.assertEqual(samples[0].time, 10.0)
+        self.assertEqual(samples[-1].time, float(capacity + 9))
+        self.assertEqual(samples[-1].fan_speeds, [40, 41])
+        self.assertEqual(samples[-1].power_usage, 123.5)
+
+        # A slot that is being written is skipped
+        main_funcs.telemetry_ring.sequence_struct.pack_into(recorder.map, main_funcs.telemetry_ring.data_offset, 0)
+        self.assertEqual(len(reader.samples()), capacity - 1)
+
+        reader.close()
+        recorder.close()
+
+        # A new recorder (e.g. a restarted worker) continues the history
+        recorder = main_funcs.telemetry_ring.TelemetryRecorder(path, 0.01, ['GPU-A'])
+        self.assertEqual(recorder.written, capacity + 10)
+        recorder.close()
+
+        # Different devices start a new file
+        recorder = main_funcs.telemetry_ring.TelemetryRecorder(path, 0.01, ['GPU-B'])
+        self.assertEqual(recorder.written, 0)
+        recorder.close()
+
+    def test_record_invalid_file(self):
+        path = self.record_path()
+
+        with open(path, 'wb') as record_file:
+            record_file.write(b'not a record' * 1000)
+
+        with self.assertRaises(main_funcs.telemetry_ring.InvalidRecordFile):
+            main_funcs.telemetry_ring.TelemetryReader(path)
+
+# ------------------------------ Replay tests ------------------------------ #
+
+    def recorded_simulation(self, end_time=600.5):
+        path = self.record_path()
+        self.run_simulation(['-n', 'NVIDIA Simulated GPU', '-sp', '0:30,50:60,60:100', '-pl', '250', '-ti', '10', '-rc', path], end_time=end_time, load=1.0)
+        return path
+
+    def test_replay_options(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'replay', '-n', 'RTX 3080', '-sp', '0:50', '-rc', 'gpu.ring'])
+        self.assertEqual(config.action, 'replay')
+        self.assertEqual(config.record_path, 'gpu.ring')
+
+        with patch.object(parse_args, 'error_print'):
+            with self.assertRaises(parse_args.InvalidConfig):
+                parse_args.parse_cmd_args(['.python_script', 'replay', '-n', 'RTX 3080', '-sp', '0:50'])
+
+            # Nothing to try
+            with self.assertRaises(parse_args.InvalidConfig):
+                parse_args.parse_cmd_args(['.python_script', 'replay', '-n', 'RTX 3080', '-rc', 'gpu.ring'])
+
+    def test_replay_same_settings_matches_recording(self):
+        path = self.recorded_simulation()
+        config = parse_args.parse_cmd_args(['.python_script', 'replay', '-n', 'NVIDIA Simulated GPU', '-sp', '0:30,50:60,60:100', '-pl', '250', '-rc', path])
+
+        with patch.object(main_funcs, 'nvml', Mock(spec=[])): # Any NVML call fails
+            summary = telemetry_replay.replay_record(config)[0]
+
+        self.assertEqual(summary.samples, 61)
+        self.assertGreater(summary.recorded_fan_writes, 0)
+        self.assertEqual(summary.fan_writes, summary.recorded_fan_writes)
+        self.assertEqual(summary.power_limit_writes, 1)
+        self.assertEqual(summary.recorded_power_limit_writes, 1)
+        self.assertEqual(sum(summary.time_at_speed.values()), 600.0)
+        self.assertEqual(summary.start_time, 0.0)
+        self.assertEqual(summary.end_time, 600.0)
+
+        reader = main_funcs.telemetry_ring.TelemetryReader(path)
+        self.assertEqual(summary.peak_temperature, max(sample.temperature for sample in reader.samples()))
+        reader.close()
+
+    def test_replay_new_settings(self):
+        path = self.recorded_simulation()
+        config = parse_args.parse_cmd_args(['.python_script', 'replay', '-n', 'NVIDIA Simulated GPU', '-sp', '0:40', '-ds', '40', '-tl', '80', '-rc', path])
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            telemetry_replay.print_replay(config)
+
+        # A flat curve only writes once and the acoustic threshold was not recorded, so it is written on the first sample
+        summary = telemetry_replay.replay_record(config)[0]
+        self.assertEqual(summary.fan_writes, 1)
+        self.assertEqual(summary.acoustic_limit_writes, 1)
+        self.assertEqual(summary.power_limit_writes, 0)
+        self.assertEqual(summary.time_at_speed, {40: 600.0})
+
+        self.assertIn('Fan speed writes: 1 (recorded: ', output.getvalue())
+        self.assertIn('    40%: 600s (100.0%)', output.getvalue())
+
+        # The messages of the subroutines are muted only during the replay
+        self.assertFalse(main_funcs.logger.muted)
+        self.assertEqual(config.dry_run, False)
+
+    def test_replay_unknown_gpu(self):
+        path = self.recorded_simulation(end_time=20.5)
+        config = parse_args.parse_cmd_args(['.python_script', 'replay', '-n', 'RTX 3080', '-sp', '0:40', '-rc', path])
+
+        with patch.object(telemetry_replay, 'error_print') as error_print, self.assertRaises(main_funcs.GpuNotFound):
+            telemetry_replay.replay_record(config)
+
+        self.assertIn('NVIDIA Simulated GPU', error_print.call_args.args[0])
+
+# ------------------------------ Curve tuner tests ------------------------------ #
+
+    # 3 hours of a GPU running a fan curve with a load that changes every 20 minutes
+    def tune_recording(self, args=['-sp', '0:30,50:50,60:70,70:100', '-ct', 'linear'], action='control'):
+        path = self.record_path()
+        load = lambda now: [0.1, 1.0, 0.5, 0.8][int(now // 1200) % 4]
+        self.run_simulation(['-n', 'NVIDIA Simulated GPU', '-ti', '5', '-rc', path] + args, end_time=3 * 3600, load=load, action=action)
+        return path
+
+    def test_tune_options(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'tune', '-n', 'RTX 3080', '-rc', 'gpu.ring', '-st', '87', '-cn', '100'])
+        self.assertEqual(config.action, 'tune')
+        self.assertEqual(config.slowdown_temp, 87)
+        self.assertEqual(config.tune_candidates, 100)
+
+        with patch.object(parse_args, 'error_print'):
+            with self.assertRaises(parse_args.InvalidConfig):
+                parse_args.parse_cmd_args(['.python_script', 'tune', '-n', 'RTX 3080'])
+
+            with self.assertRaises(parse_args.InvalidCandidateCount):
+                parse_args.parse_cmd_args(['.python_script', 'tune', '-n', 'RTX 3080', '-rc', 'gpu.ring', '-cn', '0'])
+
+    @unittest.skipIf(curve_tuner.numpy == None, 'NumPy is not installed')
+    def test_tune_candidate_tables_match_compiled_curves(self):
+        temperatures = [0, 30, 47, 64, 83]
+        speeds = curve_tuner.numpy.sort(curve_tuner.numpy.random.default_rng(1).integers(30, 101, size=(50, len(temperatures))), axis=1)
+
+        for curve_type in fan_curve.curve_types:
+            tables = curve_tuner.candidate_tables(temperatures, speeds, curve_type)
+
+            for row, candidate_speeds in enumerate(speeds):
+                pairs = [parse_args.TempSpeedPair(int(temperature), int(speed)) for temperature, speed in zip(temperatures, candidate_speeds)]
+                curve = fan_curve.CompiledFanCurve(pairs, 50, curve_type)
+                self.assertEqual(list(tables[row]), [curve.speed(temperature) for temperature in range(curve_tuner.table_temperatures + 1)], curve_type)
+
+    @unittest.skipIf(curve_tuner.numpy == None, 'NumPy is not installed')
+    def test_tune_fits_the_thermal_model(self):
+        reader = main_funcs.telemetry_ring.TelemetryReader(self.tune_recording())
+        steps = curve_tuner.trace_steps(reader.samples())
+        reader.close()
+
+        model = curve_tuner.fit_thermal_model(steps)
+        gpu = main_funcs.nvml_backend.SimulatedGpu(0, main_funcs.nvml_backend.SimulatedClock())
+
+        # The recorded temperatures are whole degrees, so it is only close to the simulated GPU
+        self.assertAlmostEqual(model.heating, 1 / gpu.heat_capacity_j, delta=0.3 / gpu.heat_capacity_j)
+        self.assertAlmostEqual(model.fan_cooling, gpu.fan_cooling_w / gpu.heat_capacity_j, delta=0.3 * gpu.fan_cooling_w / gpu.heat_capacity_j)
+        self.assertLess(curve_tuner.recorded_fit_error(model, steps), 1.5)
+
+    @unittest.skipIf(curve_tuner.numpy == None, 'NumPy is not installed')
+    def test_tune_recording(self):
+        path = self.tune_recording()
+        config = parse_args.parse_cmd_args(['.python_script', 'tune', '-n', 'NVIDIA Simulated GPU', '-rc', path, '-st', '70', '-cn', '300',
+                                            '-sp', '0:30,50:50,60:70,70:100', '-ct', 'linear'])
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            curve_tuner.print_tune(config)
+
+        result = curve_tuner.tune_record(config)
+        scores = result.scores
+
+        # The chosen curve is safe and no safe curve uses the fans less
+        self.assertTrue(result.safe)
+        self.assertLessEqual(scores.peak_temperature[result.best], 70 - curve_tuner.safety_margin)
+        safe = scores.peak_temperature <= 70 - curve_tuner.safety_margin
+        self.assertEqual(scores.average_fan_speed()[result.best], scores.average_fan_speed()[safe].min())
+        self.assertIn(result.best, result.front)
+
+        # Nothing on the front is beaten by another candidate on all the scores
+        values = curve_tuner.numpy.column_stack([scores.average_fan_speed(), scores.peak_temperature, scores.time_above_slowdown])
+        for candidate in result.front:
+            dominated = curve_tuner.numpy.all(values <= values[candidate], axis=1) & curve_tuner.numpy.any(values < values[candidate], axis=1)
+            self.assertFalse(dominated.any())
+
+        self.assertIsNotNone(result.current_scores)
+        self.assertTrue(output.getvalue().endswith(f'-sp "{result.candidates.speed_pair(result.best)}" -ct linear\n'))
+
+        # The same recording always gives the same curve
+        self.assertEqual(curve_tuner.tune_record(config).best, result.best)
+
+    @unittest.skipIf(curve_tuner.numpy == None, 'NumPy is not installed')
+    def test_tune_needs_fan_speed_changes(self):
+        path = self.tune_recording([], action='record')
+        config = parse_args.parse_cmd_args(['.python_script', 'tune', '-n', 'NVIDIA Simulated GPU', '-rc', path])
+
+        with patch.object(curve_tuner, 'error_print') as error_print, self.assertRaises(curve_tuner.ThermalModelFitFailed):
+            curve_tuner.tune_record(config)
+
+        self.assertIn('fan speed', error_print.call_args.args[0])
+
+    def test_tune_without_numpy(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'tune', '-n', 'NVIDIA Simulated GPU', '-rc', 'gpu.ring'])
+
+        with patch.object(curve_tuner, 'numpy', None), patch.object(curve_tuner, 'error_print'), self.assertRaises(curve_tuner.NumpyNotInstalled):
+            curve_tuner.tune_record(config)
+
+# ------------------------------ Info socket tests ------------------------------ #
+
+    def socket_path(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return os.path.join(directory.name, 'info.sock')
+
+    # Serves the sample of a control tick on simulated GPUs, the backend stays selected until the end of the test
+    def serve_simulated_tick(self, args, gpu_count=1):
+        path = self.socket_path()
+        config = parse_args.parse_cmd_args(['.python_script', 'control'] + args + ['-so', path, '-su'])
+        backend = main_funcs.nvml_backend.SimulatedBackend(gpu_count, main_funcs.nvml_backend.SimulatedClock())
+
+        main_funcs.set_backend(backend, backend.clock)
+        self.addCleanup(main_funcs.set_backend, main_funcs.nvml_backend.PynvmlBackend(), main_funcs.nvml_backend.SystemClock())
+        backend.nvmlInit()
+
+        controlled_gpus = [main_funcs.ControlledGpu(gpu_config) for gpu_config in config.gpus]
+
+        # The snapshot is taken before the writes of the tick, so the second one reads the settings written by the first one
+        with contextlib.redirect_stdout(io.StringIO()):
+            for tick in range(2):
+                for controlled_gpu in controlled_gpus:
+                    main_funcs.control_gpu_tick(controlled_gpu, config)
+
+        info = info_server.ControllerInfo(config.time_interval)
+        info.update(main_funcs.collect_metrics_sample(controlled_gpus, 0.001, include_info=True))
+
+        server = info_server.start_info_server(info, path)
+        self.addCleanup(info_server.stop_info_server, server, path)
+
+        return path, info, controlled_gpus
+
+    def info_output(self, args, socket_path=None):
+        config = parse_args.parse_cmd_args(['.python_script'] + args)
+        output = io.StringIO()
+
+        with contextlib.redirect_stdout(output):
+            if socket_path == None:
+                printers = {'fan-info': main_funcs.print_fan_info, 'fan-policy-info': main_funcs.print_fan_policy_info,
+                            'get-power-limit-info': main_funcs.print_power_limit_info, 'get-thresholds-info': main_funcs.print_thresholds_info}
+                printers[config.action](config)
+
+            else:
+                config.socket_path = socket_path
+                self.assertTrue(info_server.print_daemon_info(config))
+
+        return output.getvalue()
+
+    def test_socket_option(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'fan-info', '-n', 'RTX 3080', '--socket', '/run/gpu.sock'])
+        self.assertEqual(config.socket_path, '/run/gpu.sock')
+
+    @unittest.skipIf(info_server.supported() != True, 'Unix sockets are not available')
+    def test_info_socket_matches_driver(self):
+        uuid = main_funcs.nvml_backend.simulated_gpu_uuid(1)
+        path, info, controlled_gpus = self.serve_simulated_tick(['-id', main_funcs.nvml_backend.simulated_gpu_uuid(0), '-pl', '250', '-id', uuid, '-sp', '0:60'], gpu_count=2)
+
+        # Same output as asking the driver, by UUID, by name (the first device with that name) or by the other selectors of the device
+        for action in ['fan-info', 'fan-policy-info', 'power-limit-info', 'thresholds-info']:
+            for selector in [['-id', uuid], ['-n', 'NVIDIA Simulated GPU'], ['-pci', '02:00.0'], ['-ix', '1'], ['-sn', '1320000000001']]:
+                self.assertEqual(self.info_output([action] + selector, path), self.info_output([action] + selector))
+
+        # The sample of the tick, not a new query
+        self.assertIn('Current speed: 60%', self.info_output(['fan-info', '-id', uuid], path))
+        self.assertIn('Current speed: 30%', self.info_output(['fan-info', '-n', 'NVIDIA Simulated GPU'], path))
+        self.assertIn('Current power limit: 250W', self.info_output(['power-limit-info', '-n', 'NVIDIA Simulated GPU'], path))
+
+    @unittest.skipIf(info_server.supported() != True, 'Unix sockets are not available')
+    def test_info_socket_fallback(self):
+        path, info, controlled_gpus = self.serve_simulated_tick(['-n', 'NVIDIA Simulated GPU', '-sp', '0:60'])
+
+        def answer(gpu_name='NVIDIA Simulated GPU', socket_path=path):
+            return info_server.query_device_info(socket_path, 'fan-info', 'gpu_name', gpu_name)
+
+        self.assertIn('device', answer())
+
+        # No daemon
+        self.assertIn('No answer', answer(socket_path=path + '.missing')['error'])
+        config = parse_args.parse_cmd_args(['.python_script', 'fan-info', '-n', 'NVIDIA Simulated GPU', '-so', path + '.missing'])
+        self.assertFalse(info_server.print_daemon_info(config))
+
+        # Not controlled by the daemon
+        self.assertIn('not controlled', answer('NVIDIA Other GPU')['error'])
+
+        # Failing device
+        controlled_gpus[0].last_error = pynvml.NVMLError_GpuIsLost()
+        info.update(main_funcs.collect_metrics_sample(controlled_gpus, 0.001, include_info=True))
+        self.assertIn('failing', answer()['error'])
+
+        # Stale sample (e.g. the worker is restarting)
+        info.sample_time -= info.max_age_s + 1
+        self.assertIn('old', answer()['error'])
+
+    def test_info_socket_snapshot_calls(self):
+        backend = self.simulated_resolver(1)
+        backend.nvmlDeviceGetMinMaxFanSpeed = Mock(side_effect=pynvml.NVMLError(pynvml.NVML_ERROR_NOT_SUPPORTED))
+        backend.nvmlDeviceGetFanControlPolicy_v2 = Mock(wraps=backend.nvmlDeviceGetFanControlPolicy_v2)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            config = parse_args.parse_cmd_args(['.python_script', 'control', '-id', main_funcs.nvml_backend.simulated_gpu_uuid(0), '-sp', '0:60', '-so', 'gpu.sock'])
+
+        controlled_gpu = main_funcs.ControlledGpu(config.gpus[0])
+
+        def tick():
+            with contextlib.redirect_stdout(io.StringIO()):
+                main_funcs.control_gpu_tick(controlled_gpu, config)
+
+        # The fan policy is read again after the fan speed was set, then it can't change anymore (the attach reads it once too)
+        for tick_number in range(3):
+            tick()
+
+        self.assertEqual(backend.nvmlDeviceGetFanControlPolicy_v2.call_count, 1 + 2)
+        self.assertEqual(controlled_gpu.fan_writes_issued, 1)
+        self.assertEqual(controlled_gpu.snapshot.fan_policy, pynvml.NVML_FAN_POLICY_MANUAL)
+
+        # Unsupported fan constraints are only asked once
+        self.assertEqual(backend.nvmlDeviceGetMinMaxFanSpeed.call_count, 1)
+        self.assertIsNone(controlled_gpu.snapshot.fan_constraints)
+
+        # Other programs can change the policy too
+        backend.clock.sleep(main_funcs.fan_policy_max_age_s)
+        tick()
+        self.assertEqual(backend.nvmlDeviceGetFanControlPolicy_v2.call_count, 1 + 3)
+
+    @unittest.skipIf(info_server.supported() != True, 'Unix sockets are not available')
+    def test_info_socket_path_in_use(self):
+        path, info, controlled_gpus = self.serve_simulated_tick(['-n', 'NVIDIA Simulated GPU', '-sp', '0:60'])
+
+        # A working daemon is never replaced
+        with self.assertRaises(info_server.SocketInUse):
+            info_server.start_info_server(info, path)
+
+        # Neither is a regular file
+        file_path = path + '.txt'
+        with open(file_path, 'w') as file:
+            file.write('data')
+
+        with self.assertRaises(info_server.SocketInUse):
+            info_server.start_info_server(info, file_path)
+
+        self.assertTrue(os.path.isfile(file_path))
+
+        # A socket left behind by a process that was killed is replaced
+        stale_path = path + '.stale'
+        stale_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale_socket.bind(stale_path)
+        stale_socket.close()
+
+        server = info_server.start_info_server(info, stale_path)
+        self.addCleanup(info_server.stop_info_server, server, stale_path)
+        self.assertIn('device', info_server.query_device_info(stale_path, 'fan-info', 'gpu_name', 'NVIDIA Simulated GPU'))
+
+# ------------------------------ Config file tests ------------------------------ #
+
+    # Replaces the file like most editors do (a new file is renamed over the old one)
+    def write_config(self, path, content):
+        with open(path + '.new', 'w') as config:
+            config.write(content)
+
+        os.replace(path + '.new', path)
+
+    def config_path(self, name, content):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, name)
+        self.write_config(path, content)
+        return path
+
+    @unittest.skipIf(config_file.load_tomllib() == None, 'tomllib needs Python 3.11')
+    def test_config_file_toml(self):
+        path = self.config_path('gpu.toml', 'time-interval = 2\nhysteresis = 3\ndry-run = true\n\n'
+                                            '[[gpus]]\nuuid = "GPU-A"\nspeed-pair = "40:30,60:70"\ncurve-type = "linear"\npower-limit = 250\n\n'
+                                            '[[gpus]]\nname = "RTX 4080"\nspeed_pair = [[0, 50], [60, 100]]\nacoustic-temp-limit = 80\n')
+
+        # The options after --config override the file
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '--config', path, '-ti', '5'])
+
+        self.assertEqual(config.config_path, path)
+        self.assertEqual(config.time_interval, 5)
+        self.assertEqual(config.hysteresis, 3)
+        self.assertTrue(config.dry_run)
+        self.assertEqual([(gpu.gpu_uuid, gpu.gpu_name) for gpu in config.gpus], [('GPU-A', ''), ('', 'RTX 4080')])
+        self.assertEqual(config.gpus[0].temp_speed_pair, [parse_args.TempSpeedPair(60, 70), parse_args.TempSpeedPair(40, 30)])
+        self.assertEqual(config.gpus[0].curve_type, 'linear')
+        self.assertEqual(config.gpus[0].power_limit, 250)
+        self.assertEqual(config.gpus[1].temp_speed_pair, [parse_args.TempSpeedPair(60, 100), parse_args.TempSpeedPair(0, 50)])
+        self.assertEqual(config.gpus[1].acoustic_temp_limit, 80)
+
+    def test_config_file_json(self):
+        path = self.config_path('gpu.json', json.dumps({'gpus': [{'uuid': 'GPU-A', 'power-limit': 250}]}))
+
+        # The GPU of the command line comes first
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-id', 'GPU-B', '-sp', '0:50', '-cf', path])
+        self.assertEqual([gpu.gpu_uuid for gpu in config.gpus], ['GPU-B', 'GPU-A'])
+
+        # Top level GPU options apply to the GPU of the command line
+        path = self.config_path('gpu.json', json.dumps({'speed-pair': '0:40', 'curve-type': 'spline'}))
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-id', 'GPU-B', '-cf', path])
+        self.assertEqual(len(config.gpus), 1)
+        self.assertEqual(config.curve_type, 'spline')
+
+    def test_invalid_config_file(self):
+
+        def parse(content, name='gpu.json'):
+            with patch.object(parse_args, 'error_print'), contextlib.redirect_stdout(io.StringIO()):
+                return parse_args.parse_cmd_args(['.python_script', 'control', '-cf', self.config_path(name, content)])
+
+        for content in ['{"gpus": [', '[1, 2]', '{"fan-speed": 50}', '{"gpus": [{"power-limit": 250}]}', '{"dry-run": "yes"}',
+                        '{"gpus": [{"uuid": "GPU-A", "metrics-port": 9400}]}', '{"gpus": [{"uuid": "GPU-A", "speed-pair": [[1, 2, 3]]}]}']:
+            with self.assertRaises(config_file.InvalidConfigFile, msg=content):
+                parse(content)
+
+        # Same rules as the command line
+        with self.assertRaises(parse_args.InvalidFanSpeed):
+            parse('{"gpus": [{"uuid": "GPU-A", "speed-pair": "0:150"}]}')
+
+        with self.assertRaises(parse_args.InvalidConfig):
+            parse('{"gpus": [{"uuid": "GPU-A"}]}')
+
+        with self.assertRaises(config_file.InvalidConfigFile):
+            parse_args.parse_cmd_args(['.python_script', 'control', '-cf', 'missing.json'])
+
+    # Runs the control loop on a simulated GPU, calling the functions of "changes" after the given ticks
+    def run_reloading_simulation(self, path, ticks, changes):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-cf', path])
+        backend = main_funcs.nvml_backend.SimulatedBackend(1, main_funcs.nvml_backend.SimulatedClock(end_time=ticks))
+        fan_speeds = []
+
+        def tick_done(metrics_sample=None):
+            fan_speeds.append(backend.gpus[0].fan_speeds[0])
+
+            if len(fan_speeds) in changes:
+                changes[len(fan_speeds)]()
+
+        worker_link = Mock(spec=['wait_for_activation', 'tick_done', 'error'])
+        worker_link.tick_done.side_effect = tick_done
+        output = io.StringIO()
+
+        main_funcs.set_backend(backend, backend.clock)
+        try:
+            backend.nvmlInit()
+            with contextlib.redirect_stdout(output), patch.object(main_funcs, 'error_print') as error_print, self.assertRaises(main_funcs.nvml_backend.SimulationFinished):
+                main_funcs.control_all(config, worker_link)
+
+        finally:
+            main_funcs.set_backend(main_funcs.nvml_backend.PynvmlBackend(), main_funcs.nvml_backend.SystemClock())
+            main_funcs.reload_requested = False
+
+        return config, backend, fan_speeds, output.getvalue(), error_print
+
+    def test_config_reload(self):
+        uuid = main_funcs.nvml_backend.simulated_gpu_uuid(0)
+        path = self.config_path('gpu.json', json.dumps({'gpus': [{'uuid': uuid, 'speed-pair': '0:40'}]}))
+
+        changes = {
+            3: lambda: self.write_config(path, json.dumps({'time-interval': 2, 'gpus': [{'uuid': uuid, 'speed-pair': '0:70', 'power-limit': 250}]})),
+            5: lambda: self.write_config(path, json.dumps({'gpus': [{'uuid': uuid, 'speed-pair': '0:150'}]})), # Invalid
+            7: lambda: self.write_config(path, json.dumps({'gpus': [{'uuid': 'GPU-OTHER', 'speed-pair': '0:80'}]})), # Other GPU
+            9: lambda: self.write_config(path, json.dumps({'time-interval': 2, 'metrics-port': 9400, 'gpus': [{'uuid': uuid, 'speed-pair': '0:90'}]})),
+        }
+
+        config, backend, fan_speeds, output, error_print = self.run_reloading_simulation(path, 30, changes)
+
+        # The new curve takes effect on the next tick, invalid files keep the current settings
+        self.assertEqual(fan_speeds[:3], [40, 40, 40])
+        self.assertEqual(fan_speeds[3:9], [70] * 6)
+        self.assertEqual(fan_speeds[9:], [90] * len(fan_speeds[9:]))
+        self.assertEqual(config.time_interval, 2)
+        self.assertEqual(config.metrics_port, 0)
+        self.assertEqual(backend.gpus[0].power_limit_mw, 250000) # Removing the power limit doesn't restore the previous one
+
+        self.assertEqual(error_print.call_count, 2)
+        self.assertIn('selecting other GPUs needs a restart', error_print.call_args_list[1].args[0])
+        self.assertIn('metrics_port changed, it only takes effect after a restart', output)
+        self.assertEqual(output.count('Reloaded the settings'), 2)
+
+        # The warnings of the settings were printed on startup, not on every reload
+        self.assertNotIn('WARNING: There is no', output)
+
+        # The device was only attached once
+        self.assertEqual(output.count('Device name'), 1)
+
+    def test_config_reload_signal(self):
+        uuid = main_funcs.nvml_backend.simulated_gpu_uuid(0)
+        path = self.config_path('gpu.json', json.dumps({'gpus': [{'uuid': uuid, 'speed-pair': '0:40'}]}))
+
+        # The file didn't change, so only SIGHUP reloads it
+        config, backend, fan_speeds, output, error_print = self.run_reloading_simulation(path, 5, {2: main_funcs.request_reload})
+        self.assertEqual(output.count('Reloaded the settings'), 1)
+
+# ------------------------------ Inventory tests ------------------------------ #
+
+    def test_list_json_option(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'list', '--json', '-sim', '2'])
+        self.assertEqual(config.action, 'list')
+        self.assertTrue(config.json_output)
+        self.assertEqual(config.simulated_gpus, 2)
+
+    def test_gpu_inventory(self):
+        backend = main_funcs.nvml_backend.SimulatedBackend(3, main_funcs.nvml_backend.SimulatedClock())
+        backend.gpus[0].power_limit_mw = 250000
+        backend.gpus[0].fan_policies[0] = pynvml.NVML_FAN_POLICY_MANUAL
+        backend.gpus[2].lost = True
+
+        # The second device doesn't support the PCI info and the current acoustic threshold
+        def unsupported(function):
+            def query(handle, *args):
+                if handle == backend.gpus[1] and (function.__name__ == 'nvmlDeviceGetPciInfo' or args == (pynvml.NVML_TEMPERATURE_THRESHOLD_ACOUSTIC_CURR,)):
+                    raise pynvml.NVMLError(pynvml.NVML_ERROR_NOT_SUPPORTED)
+
+                return function(handle, *args)
+            return query
+
+        backend.nvmlDeviceGetPciInfo = unsupported(backend.nvmlDeviceGetPciInfo)
+        backend.nvmlDeviceGetTemperatureThreshold = unsupported(backend.nvmlDeviceGetTemperatureThreshold)
+
+        main_funcs.set_backend(backend, backend.clock)
+        try:
+            backend.nvmlInit()
+            output = io.StringIO()
+
+            with contextlib.redirect_stdout(output):
+                main_funcs.print_gpu_inventory()
+
+        finally:
+            main_funcs.set_backend(main_funcs.nvml_backend.PynvmlBackend(), main_funcs.nvml_backend.SystemClock())
+
+        inventory = json.loads(output.getvalue())
+        first, second, lost = inventory['gpus']
+
+        self.assertEqual(inventory['driver_version'], '580.95.05')
+        self.assertEqual(first, {
+            'index': 0,
+            'name': 'NVIDIA Simulated GPU',
+            'uuid': main_funcs.nvml_backend.simulated_gpu_uuid(0),
+            'pci_bus_id': '00000000:01:00.0',
+            'serial': '1320000000000',
+            'fan_count': 2,
+            'fan_policy': 'Manual',
+            'power_limit_constraints': {'min': 100, 'max': 350},
+            'power_limit': 250,
+            'enforced_power_limit': 250,
+            'acoustic_thresholds': {'current': 83, 'min': 40, 'max': 90},
+        })
+
+        # Unsupported values are null, the others are still there
+        self.assertIsNone(second['pci_bus_id'])
+        self.assertEqual(second['acoustic_thresholds'], {'current': None, 'min': 40, 'max': 90})
+        self.assertEqual(second['uuid'], main_funcs.nvml_backend.simulated_gpu_uuid(1))
+
+        # A device that can't be reached is still listed
+        self.assertEqual(lost['index'], 2)
+        self.assertIsNone(lost['uuid'])
+        self.assertIsNone(lost['power_limit'])
+
+# ------------------------------ Device resolver tests ------------------------------ #
+
+    def test_gpu_selector_options(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'record', '-rc', 'gpu.rec', '-pci', '1:0.0', '-pci', '0000:0a:00.0', '-ix', '2', '-dc', '/tmp/devices.json'])
+
+        self.assertEqual([gpu.gpu_pci for gpu in config.gpus], ['00000000:01:00.0', '00000000:0A:00.0'])
+        self.assertEqual(config.gpus[1].gpu_index, '2')
+        self.assertEqual(config.device_cache_path, '/tmp/devices.json')
+
+        # The most specific selector of a GPU wins
+        config = parse_args.parse_cmd_args(['.python_script', 'fan-info', '-n', 'RTX 4080', '-sn', '1320000000000', '-ix', '1'])
+        self.assertEqual(config.gpus[0].selector(), ('gpu_serial', '1320000000000'))
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(parse_args.InvalidGpuSelector):
+                parse_args.parse_cmd_args(['.python_script', 'fan-info', '--pci', '01:00'])
+
+            with self.assertRaises(parse_args.InvalidGpuSelector):
+                parse_args.parse_cmd_args(['.python_script', 'fan-info', '--index', '-1'])
+
+        path = self.config_path('gpu.json', '{"gpus": [{"pci": "02:00.0"}, {"index": 0}, {"serial": "1320000000000"}]}')
+        config = parse_args.parse_cmd_args(['.python_script', 'record', '-rc', 'gpu.rec', '-cf', path])
+        self.assertEqual([gpu.label() for gpu in config.gpus], ['00000000:02:00.0', 'index 0', '1320000000000'])
+
+    def simulated_resolver(self, gpu_count, cache_path=''):
+        backend = main_funcs.nvml_backend.SimulatedBackend(gpu_count, main_funcs.nvml_backend.SimulatedClock())
+        main_funcs.set_backend(backend, backend.clock, cache_path)
+        self.addCleanup(main_funcs.set_backend, main_funcs.nvml_backend.PynvmlBackend(), main_funcs.nvml_backend.SystemClock())
+
+        backend.nvmlInit()
+        return backend
+
+    def resolve(self, args):
+        config = parse_args.parse_cmd_args(['.python_script', 'fan-info'] + args)
+        return main_funcs.device_resolver.resolve(config.gpus[0])
+
+    def test_device_index_selectors(self):
+        backend = self.simulated_resolver(3)
+
+        for args in [['-pci', '0000:03:00.0'], ['-ix', '2'], ['-sn', '1320000000002'], ['-id', main_funcs.nvml_backend.simulated_gpu_uuid(2)]]:
+            handle, device = self.resolve(args)
+            self.assertIs(handle, backend.gpus[2])
+            self.assertEqual(device['pci_bus_id'], '00000000:03:00.0')
+
+        # The devices are only scanned once per session
+        self.assertEqual(main_funcs.device_resolver.scans, 1)
+
+        # Same name: the first one, with a warning
+        error_output = io.StringIO()
+        with contextlib.redirect_stderr(error_output):
+            self.assertIs(self.resolve(['-n', 'NVIDIA Simulated GPU'])[0], backend.gpus[0])
+
+        self.assertIn('3 devices match', error_output.getvalue())
+
+        # A device that is missing is looked for again before giving up
+        with contextlib.redirect_stdout(io.StringIO()), self.assertRaises(main_funcs.GpuNotFound):
+            self.resolve(['-pci', '0000:04:00.0'])
+
+        self.assertEqual(main_funcs.device_resolver.scans, 2)
+
+    @unittest.skipIf(os.path.exists(main_funcs.device_index.boot_id_path) != True, 'The device cache needs the boot ID')
+    def test_device_cache(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'devices.json')
+
+        backend = self.simulated_resolver(4, path)
+        self.assertIs(self.resolve(['-pci', '0000:02:00.0'])[0], backend.gpus[1])
+        self.assertEqual(main_funcs.device_resolver.scans, 1)
+
+        with open(path, 'r') as cache_file:
+            cache = json.load(cache_file)
+
+        self.assertEqual(cache['driver_version'], '580.95.05')
+        self.assertEqual(len(cache['devices']), 4)
+
+        # The next session only asks for the driver version and the target device
+        backend = self.simulated_resolver(4, path)
+        calls_before = main_funcs.nvml.call_count
+
+        self.assertIs(self.resolve(['-pci', '0000:02:00.0'])[0], backend.gpus[1])
+        self.assertEqual(main_funcs.nvml.call_count - calls_before, 2)
+        self.assertEqual(main_funcs.device_resolver.scans, 0)
+
+        # A device that isn't where the file says makes the index be built again
+        backend = self.simulated_resolver(4, path)
+        backend.gpus[1].uuid = 'GPU-replaced'
+
+        self.assertIs(self.resolve(['-pci', '0000:02:00.0'])[0], backend.gpus[1])
+        self.assertEqual(main_funcs.device_resolver.scans, 1)
+
+        with open(path, 'r') as cache_file:
+            self.assertEqual(json.load(cache_file)['devices'][1]['uuid'], 'GPU-replaced')
+
+        # Another driver version invalidates the file
+        backend = self.simulated_resolver(4, path)
+        backend.nvmlSystemGetDriverVersion = Mock(return_value='590.00')
+
+        self.resolve(['-ix', '3'])
+        self.assertEqual(main_funcs.device_resolver.scans, 1)
+
+        # Another device at a cached index (e.g. the devices were enumerated again): the device at the index is checked
+        backend = self.simulated_resolver(4, path)
+        backend.nvmlSystemGetDriverVersion = Mock(return_value='590.00')
+        backend.gpus[2].uuid, backend.gpus[3].uuid = backend.gpus[3].uuid, backend.gpus[2].uuid
+
+        self.assertIs(self.resolve(['-ix', '3'])[0], backend.gpus[3])
+        self.assertEqual(main_funcs.device_resolver.scans, 1)
+
+# ------------------------------ NVML event tests ------------------------------ #
+
+    def test_events_option(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 4080', '-sp', '0:40', '--events', '15'])
+        self.assertEqual(config.event_interval_s, 15.0)
+
+        # The watchdog and the info socket wait for the safety interval
+        self.assertEqual(config.longest_interval(), 15.0)
+        self.assertEqual(parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 4080', '-sp', '0:40', '-ev', '15', '-ai', '1:30']).longest_interval(), 30.0)
+
+        with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(parse_args.InvalidTimeParameter):
+            parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 4080', '-sp', '0:40', '-ev', '0'])
+
+    # Returns the simulated time and the metrics sample of every tick
+    def run_event_simulation(self, args, end_time, setup):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'NVIDIA Simulated GPU', '-sp', '0:30,60:100', '-mp', '9100'] + args)
+        backend = main_funcs.nvml_backend.SimulatedBackend(1, main_funcs.nvml_backend.SimulatedClock(end_time=end_time))
+        setup(backend)
+
+        ticks = []
+        link = Mock()
+        link.tick_done = Mock(side_effect=lambda sample: ticks.append((backend.clock.now, sample)))
+
+        main_funcs.set_backend(backend, backend.clock)
+        try:
+            backend.nvmlInit()
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()), self.assertRaises(main_funcs.nvml_backend.SimulationFinished):
+                main_funcs.control_all(config, link)
+
+        finally:
+            main_funcs.set_backend(main_funcs.nvml_backend.PynvmlBackend(), main_funcs.nvml_backend.SystemClock())
+
+        return ticks
+
+    def test_event_assisted_control(self):
+
+        # A burst of events when the load goes up: 5 clock changes and a performance state change at the same time
+        def setup(backend):
+            backend.gpus[0].load = lambda now: 0.2 if now < 50 else 1.0
+
+            for burst_event in range(5):
+                backend.schedule_event(50.0, 0, pynvml.nvmlEventTypeClock)
+
+            backend.schedule_event(50.0, 0, pynvml.nvmlEventTypePState)
+
+        ticks = self.run_event_simulation(['-ev', '30'], 100, setup)
+
+        # The safety interval, the event right away (a single tick for the burst) and the safety interval again, counted from the event
+        self.assertEqual([tick_time for tick_time, sample in ticks], [0.0, 30.0, 50.0, 80.0])
+
+        sample = ticks[-1][1]
+        self.assertEqual(sample['events'], {'clock': 5, 'pstate': 1, 'power_source': 0, 'xid': 0})
+        self.assertEqual(sample['event_wakeups'], 1)
+        self.assertEqual(sample['event_timeouts'], 2)
+
+        metrics = metrics_server.ControllerMetrics('1.0')
+        metrics.update(sample)
+        text = metrics.render()
+        self.assertIn('nvml_gpu_control_events_total{type="clock"} 5', text)
+        self.assertIn('nvml_gpu_control_event_timeouts_total 2', text)
+
+        # Polling on the same interval only notices the new load on the next tick
+        polling_ticks = self.run_event_simulation(['-ti', '30'], 100, setup)
+        self.assertEqual([tick_time for tick_time, sample in polling_ticks], [0.0, 30.0, 60.0, 90.0])
+        self.assertNotIn('events', polling_ticks[-1][1])
+
+    def test_event_assisted_control_event_stream(self):
+
+        # Under load the clocks change all the time: an event every 100ms
+        def setup(backend):
+            for event_idx in range(10, 600):
+                backend.schedule_event(event_idx / 10, 0, pynvml.nvmlEventTypeClock)
+
+        ticks = self.run_event_simulation(['-ev', '30', '-ti', '5'], 58, setup)
+
+        # No faster than the time interval, the events in between go to the next tick
+        tick_times = [tick_time for tick_time, sample in ticks]
+        self.assertEqual(len(tick_times), 12)
+        for tick_time, expected_time in zip(tick_times, range(0, 60, 5)):
+            self.assertGreaterEqual(tick_time, expected_time)
+            self.assertAlmostEqual(tick_time, expected_time, places=2)
+
+        sample = ticks[-1][1]
+        self.assertEqual(sample['event_wakeups'], 11)
+        self.assertEqual(sample['events']['clock'], sample['event_wakeups'] + sample['merged_events'])
+        self.assertGreater(sample['merged_events'], 500)
+
+    def test_event_assisted_control_without_events(self):
+
+        # The GPU has none of the events: only the safety interval
+        def no_device_events(backend):
+            backend.gpus[0].event_types = 0
+            backend.schedule_event(5.0, 0, pynvml.nvmlEventTypeClock)
+
+        ticks = self.run_event_simulation(['-ev', '20'], 50, no_device_events)
+        self.assertEqual([tick_time for tick_time, sample in ticks], [0.0, 20.0, 40.0])
+        self.assertEqual(ticks[-1][1]['event_wakeups'], 0)
+
+        # The driver has no events: back to the time interval
+        def no_driver_events(backend):
+            backend.nvmlEventSetCreate = Mock(side_effect=pynvml.NVMLError(pynvml.NVML_ERROR_NOT_SUPPORTED))
+
+        ticks = self.run_event_simulation(['-ev', '20', '-ti', '10'], 35, no_driver_events)
+        self.assertEqual([tick_time for tick_time, sample in ticks], [0.0, 10.0, 20.0, 30.0])
+
+# ------------------------------ Async engine tests ------------------------------ #
+
+    def test_engine_options(self):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 4080', '-sp', '0:40', '--engine', 'async', '-cto', '0.5', '-ss', '90'])
+        self.assertEqual((config.engine, config.call_timeout_s, config.safe_fan_speed), ('async', 0.5, 90))
+
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 4080', '-sp', '0:40'])
+        self.assertEqual((config.engine, config.call_timeout_s, config.safe_fan_speed), ('sync', 2.0, 100))
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(parse_args.InvalidEngine):
+                parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 4080', '-sp', '0:40', '-en', 'threads'])
+
+            with self.assertRaises(parse_args.InvalidTimeParameter):
+                parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 4080', '-sp', '0:40', '-cto', '0'])
+
+            with self.assertRaises(parse_args.InvalidFanSpeed):
+                parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 4080', '-sp', '0:40', '-ss', '101'])
+
+            with self.assertRaises(parse_args.InvalidConfig):
+                parse_args.parse_cmd_args(['.python_script', 'control', '-n', 'RTX 4080', '-sp', '0:40', '-en', 'async', '-ev', '10'])
+
+    def test_deadline_call_runner(self):
+        pool = async_engine.DaemonThreadPool(1)
+        runner = async_engine.DeadlineCallRunner(pool, 0.05)
+        release = threading.Event()
+        self.addCleanup(pool.shutdown)
+        self.addCleanup(release.set)
+        writes = []
+
+        def stuck_read():
+            release.wait(10)
+
+        def write(speed):
+            writes.append(speed)
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(runner.run_for_gpu('GPU-A', runner, lambda: 40, ()), 40)
+
+            # The write waits behind the stuck call and misses its deadline too
+            with self.assertRaises(pynvml.NVMLError_Timeout):
+                runner.run_for_gpu('GPU-A', runner, stuck_read, ())
+
+            with self.assertRaises(pynvml.NVMLError_Timeout):
+                runner.run_for_gpu('GPU-A', runner, write, (60,))
+
+            # A call of an older generation that didn't start is dropped, the safe speed is written
+            stale_write = pool.submit(runner.run_call, 'GPU-A', 0, write, (70,))
+            release.set()
+            runner.run_for_gpu('GPU-A', runner, write, (100,))
+
+        with self.assertRaises(pynvml.NVMLError_Timeout):
+            stale_write.result(1)
+
+        self.assertEqual(writes, [100])
+        self.assertEqual(runner.deadline_misses, 2)
+        self.assertEqual(runner.generations['GPU-A'], 2)
+
+    def test_async_engine_exits_with_stuck_call(self):
+        script = ('import sys, threading; sys.path.append("./src/caioh_nvml_gpu_control"); import async_engine; '
+                  'pool = async_engine.DaemonThreadPool(2); pool.submit(threading.Event().wait); pool.shutdown(wait=False); print("exit")')
+
+        # A call that never returns doesn't keep the process alive
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, timeout=30)
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout, 'exit\n')
+
+    def test_device_index_parallel_attach(self):
+        backend = self.simulated_resolver(4)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+            handles = list(pool.map(lambda index: self.resolve(['-ix', str(index)])[0], range(4)))
+
+        # The devices were scanned by the first lookup only
+        self.assertEqual(handles, backend.gpus)
+        self.assertEqual(main_funcs.device_resolver.scans, 1)
+
+    # Two GPUs with the same curve. Returns the backend and the metrics sample of every tick
+    def run_engine_simulation(self, args, end_time, setup=None):
+        config = parse_args.parse_cmd_args(['.python_script', 'control', '-ix', '0', '-sp', '0:30,60:100', '-ix', '1', '-sp', '0:30,60:100', '-mp', '9100'] + args)
+        backend = main_funcs.nvml_backend.SimulatedBackend(2, main_funcs.nvml_backend.SimulatedClock(end_time=end_time))
+
+        if setup != None:
+            setup(backend)
+
+        samples = []
+        link = Mock()
+        link.tick_done = Mock(side_effect=samples.append)
+
+        main_funcs.set_backend(backend, backend.clock)
+        try:
+            backend.nvmlInit()
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()), self.assertRaises(main_funcs.nvml_backend.SimulationFinished):
+                main_funcs.control_all(config, link)
+
+        finally:
+            main_funcs.set_backend(main_funcs.nvml_backend.PynvmlBackend(), main_funcs.nvml_backend.SystemClock())
+
+        return backend, samples
+
+    def test_async_engine_control(self):
+        sync_backend, sync_samples = self.run_engine_simulation([], 600)
+        async_backend, async_samples = self.run_engine_simulation(['-en', 'async'], 600)
+
+        # Same result as one GPU after the other
+        self.assertEqual([gpu.fan_speeds for gpu in async_backend.gpus], [gpu.fan_speeds for gpu in sync_backend.gpus])
+        self.assertEqual(len(async_samples), len(sync_samples))
+        self.assertEqual(async_samples[-1]['nvml_deadline_misses'], 0)
+        self.assertNotIn('nvml_deadline_misses', sync_samples[-1])
+
+        # The engine is gone with the loop
+        self.assertIsNone(main_funcs.nvml.call_runner)
+
+    def test_async_engine_call_deadline(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        fan_writes = []
+
+        # The first temperature read of the second GPU after it was attached never returns (until the test ends)
+        def setup(backend):
+            get_temperature = backend.nvmlDeviceGetTemperatureV
+            set_fan_speed = backend.nvmlDeviceSetFanSpeed_v2
+            reads = []
+
+            def hanging_get_temperature(handle, sensor):
+                if handle is backend.gpus[1]:
+                    reads.append(handle)
+
+                    if len(reads) == 2:
+                        release.wait(10)
+
+                return get_temperature(handle, sensor)
+
+            def logged_set_fan_speed(handle, fan_idx, speed):
+                fan_writes.append((backend.gpus.index(handle), speed))
+                return set_fan_speed(handle, fan_idx, speed)
+
+            backend.nvmlDeviceGetTemperatureV = hanging_get_temperature
+            backend.nvmlDeviceSetFanSpeed_v2 = logged_set_fan_speed
+
+        backend, samples = self.run_engine_simulation(['-en', 'async', '-cto', '0.2', '-ss', '90', '-ti', '1', '-rt'], 30, setup)
+
+        # The hung GPU got the safe speed right away, the other one was controlled on every tick
+        self.assertEqual([speed for gpu_idx, speed in fan_writes if gpu_idx == 1][:2], [90, 90])
+        self.assertEqual(len(samples), 30)
+        self.assertTrue(all(sample['gpus'][0]['device_errors'] == 0 for sample in samples[1:]))
+
+        self.assertEqual(samples[-1]['nvml_deadline_misses'], 1)
+        self.assertEqual(samples[-1]['safe_speed_writes'], 1)
+
+        # Once the retry interval is over (--retry), the GPU is controlled again
+        self.assertEqual(samples[-1]['gpus'][1]['up'], True)
+
+        metrics = metrics_server.ControllerMetrics('1.0')
+        metrics.update(samples[-1])
+        text = metrics.render()
+        self.assertIn('nvml_gpu_control_nvml_deadline_misses_total 1', text)
+        self.assertIn('nvml_gpu_control_safe_speed_writes_total 1', text)
+
+# ------------------------------ CLI startup tests ------------------------------ #
+
+    # Runs the entry point in a new process and returns the modules it imported
+    def cli_imported_modules(self, args):
+        code = ('import sys, runpy; sys.argv = ["nvml_gpu_control"] + sys.argv[1:]; '
+                'runpy.run_path("./src/caioh_nvml_gpu_control/__main__.py", run_name="__main__"); print(" ".join(sys.modules))')
+        result = subprocess.run([sys.executable, '-c', code] + args, capture_output=True, text=True, timeout=60)
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout.splitlines()[-1].split()
+
+    def test_help_startup_imports(self):
+        modules = self.cli_imported_modules(['help'])
+
+        for module in ['pynvml', 'helper_functions', 'numpy', 'multiprocessing', 'http.server', 'worker_process', 'socket', 'fan_curve', 'telemetry_ring', 'config_file']:
+            self.assertNotIn(module, modules)
+
+    def test_replay_startup_imports(self):
+        path = self.recorded_simulation(end_time=20.5)
+        modules = self.cli_imported_modules(['replay', '-n', 'NVIDIA Simulated GPU', '-sp', '0:40', '-rc', path])
+
+        # It runs the same subroutines as the control loop, without the NVML bindings
+        self.assertIn('control_subroutines', modules)
+
+        for module in ['pynvml', 'helper_functions', 'nvml_backend', 'device_index', 'multiprocessing', 'socket']:
+            self.assertNotIn(module, modules)
+
+    def test_info_action_startup_imports(self):
+        modules = self.cli_imported_modules(['fan-info', '-sim', '1', '-id', main_funcs.nvml_backend.simulated_gpu_uuid(0)])
+
+        self.assertIn('pynvml', modules)
+
+        for module in ['numpy', 'multiprocessing', 'http.server', 'worker_process']:
+            self.assertNotIn(module, modules)
+
 # ------------------------------ NVML unit tests ------------------------------ #
 
     # InsufficientPermissions or NotFound